@@ -0,0 +1,789 @@
+"""
+Small benchmarks for simil
+
+run with: python bench.py
+or, for the benchmark suite with JSON output: python bench.py --suite --json results.json (see python bench.py -h)
+"""
+import argparse
+import collections
+import compileall
+import json
+import math
+import os
+import platform
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+from simil import PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing, \
+                  FrequencyOrder, order_symbol_lex, similarity_join, string_to_symbols, shingle_hashes, \
+                  stream_similarity_join, spill_pairs, verified_sim, external_similarity_join, rs_join, \
+                  SIMILARITIES, WeightedJaccard, percentiles
+
+CLASSES = (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing)
+
+
+def random_corpus(n, min_len=5, max_len=20, alphabet=string.ascii_lowercase, seed=0):
+    """
+    n random strings made of distinct symbols (sets represented as strings, see MMDS 3.9.2)
+    """
+    rnd = random.Random(seed)
+    return ["".join(rnd.sample(alphabet, rnd.randint(min_len, max_len))) for _ in range(n)]
+
+
+def skewed_corpus(n, min_len=5, max_len=30, n_symbols=2000, skew=1.0, seed=0):
+    """
+    n strings whose symbols follow a Zipf law (exponent 'skew') over n_symbols symbols
+    the most frequent symbols have the smallest code points, as in natural text
+    """
+    rnd = random.Random(seed)
+    alphabet = [chr(0x100 + k) for k in range(n_symbols)]
+    weights = [1.0 / (k + 1) ** skew for k in range(n_symbols)]
+    list_of_strings = []
+    for _ in range(n):
+        length = rnd.randint(min_len, max_len)
+        s = set()
+        while len(s) < length:
+            s.update(rnd.choices(alphabet, weights, k=length - len(s)))
+        list_of_strings.append("".join(s))
+    return list_of_strings
+
+
+def measure(fun):
+    """
+    returns (result, elapsed seconds, bytes still allocated by fun)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fun()
+    elapsed = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, allocated
+
+
+def bench_index_memory(n=20000, J=0.8):
+    """
+    memory per posting of the dict-of-sets index vs the CompactIndex (many-one problem)
+    """
+    print("*** index memory, {} strings, J={} ***".format(n, J))
+    list_of_strings = random_corpus(n)
+    for cls in CLASSES:
+        for compact in (False, True):
+            pi = cls(list_of_strings, J)
+            _, elapsed, allocated = measure(lambda: pi.make_many_to_one_index(compact=compact))
+            n_postings = sum(map(len, pi.ii.values()))
+            print("{:30} compact={!s:5}  keys: {:6}  postings: {:7}  build: {:.3f}s  {:.1f} bytes/posting".format(
+                cls.__name__, compact, len(pi.ii), n_postings, elapsed, allocated / n_postings))
+
+
+def bench_ordering(n=2000, J=0.8):
+    """
+    candidate pairs with a fixed ordering vs the rare-first FrequencyOrder, on skewed data
+    """
+    print("*** symbol ordering, {} skewed strings, J={} ***".format(n, J))
+    list_of_strings = skewed_corpus(n)
+    orders = (("lexicographic", order_symbol_lex), ("frequency", FrequencyOrder(list_of_strings)))
+    for cls in CLASSES:
+        for name, order in orders:
+            start = time.perf_counter()
+            cp = cls(list_of_strings, J, order=order).make_many_to_many_index()
+            elapsed = time.perf_counter() - start
+            print("{:30} {:14} candidates: {:9}  time: {:.3f}s".format(cls.__name__, name, len(cp), elapsed))
+    for name, order in orders:
+        start = time.perf_counter()
+        pairs = similarity_join(list_of_strings, J, order=order)
+        print("similarity_join {:14} pairs: {}  time: {:.3f}s".format(name, len(pairs), time.perf_counter() - start))
+
+
+def bench_build_probe(n=20000, n_probes=2000, n_many=5000, J=0.8):
+    """
+    index build time, probe time (many-one problem) and many-many time (on the first n_many strings)
+    """
+    print("*** build / probe, {} strings, {} probes, many-many on {} strings, J={} ***".format(n, n_probes, n_many, J))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, max_len=40, alphabet=alphabet)
+    probes = random_corpus(n_probes, max_len=40, alphabet=alphabet, seed=1)
+    for cls in CLASSES:
+        start = time.perf_counter()
+        pi = cls(list_of_strings, J)
+        tokenize = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pi.make_many_to_one_index()
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for probe_string in probes:
+            pi.candidate_pairs(probe_string)
+        probe = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cls(list_of_strings[:n_many], J).make_many_to_many_index()
+        many_to_many = time.perf_counter() - start
+        print("{:30} records: {:.3f}s  build: {:.3f}s  probe: {:.1f}us/probe  many-many: {:.3f}s".format(
+            cls.__name__, tokenize, build, 1e6 * probe / n_probes, many_to_many))
+
+
+def bench_long_strings(n=5000, n_probes=200, n_many=1000):
+    """
+    PrefixPositionLengthIndexing with long strings and low thresholds, where many (symbol, j, q) keys are possible
+    """
+    print("*** long strings, {} strings, {} probes, many-many on {} strings ***".format(n, n_probes, n_many))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, min_len=50, max_len=150, alphabet=alphabet)
+    probes = random_corpus(n_probes, min_len=50, max_len=150, alphabet=alphabet, seed=1)
+    for J in (0.5, 0.7, 0.9):
+        pi = PrefixPositionLengthIndexing(list_of_strings, J)
+        pi.make_many_to_one_index()
+        start = time.perf_counter()
+        for probe_string in probes:
+            pi.candidate_pairs(probe_string)
+        probe = time.perf_counter() - start
+
+        start = time.perf_counter()
+        PrefixPositionLengthIndexing(list_of_strings[:n_many], J).make_many_to_many_index()
+        many_to_many = time.perf_counter() - start
+        print("J={:.1f}  probe: {:.2f}ms/probe  many-many: {:.3f}s".format(J, 1e3 * probe / n_probes, many_to_many))
+
+
+def bench_length_filter(n=3000, J=0.8):
+    """
+    many-many join with and without length filtering, on strings of widely varying lengths
+    """
+    print("*** length filter, {} strings of 2 to 200 symbols, J={} ***".format(n, J))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, min_len=2, max_len=200, alphabet=alphabet)
+    order = FrequencyOrder(list_of_strings)
+    for cls in CLASSES:
+        for length_filter in (False, True):
+            pi = cls(list_of_strings, J, order=order)
+            start = time.perf_counter()
+            cp = pi.make_many_to_many_index(length_filter=length_filter)
+            elapsed = time.perf_counter() - start
+            print("{:30} length_filter={!s:5}  candidates: {:8}  postings kept: {:7}  time: {:.3f}s".format(
+                cls.__name__, length_filter, len(cp), sum(map(len, pi.ii.values())), elapsed))
+
+
+def bench_parallel(n=5000, J=0.9, max_workers=None):
+    """
+    scaling of make_many_to_many_index_parallel over 1..max_workers processes (powers of 2)
+    """
+    max_workers = max_workers or max(os.cpu_count(), 4)
+    print("*** parallel many-many, {} strings, J={}, {} cores ***".format(n, J, os.cpu_count()))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, max_len=40, alphabet=alphabet)
+    for cls in CLASSES:
+        order = FrequencyOrder(list_of_strings)
+        pi = cls(list_of_strings, J, order=order)
+        start = time.perf_counter()
+        serial = pi.make_many_to_many_index()
+        print("{:30} serial     {:.3f}s".format(cls.__name__, time.perf_counter() - start))
+        workers = 1
+        while workers <= max_workers:
+            start = time.perf_counter()
+            cp = pi.make_many_to_many_index_parallel(workers=workers)
+            elapsed = time.perf_counter() - start
+            assert cp == set(serial)
+            print("{:30} workers={:<3} {:.3f}s".format(cls.__name__, workers, elapsed))
+            workers *= 2
+
+
+def bench_persistence(n=20000, n_probes=2000, J=0.8):
+    """
+    loading a saved index (memory-mapped or copied) vs building it again from the strings
+    """
+    print("*** persistence, {} strings, {} probes, J={} ***".format(n, n_probes, J))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, max_len=40, alphabet=alphabet)
+    probes = random_corpus(n_probes, max_len=40, alphabet=alphabet, seed=1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.bin")
+        for cls in CLASSES:
+            start = time.perf_counter()
+            pi = cls(list_of_strings, J, order=FrequencyOrder(list_of_strings))
+            pi.make_many_to_one_index(compact=True)
+            build = time.perf_counter() - start
+            pi.save(path)
+            timings = []
+            for mmap in (True, False):
+                start = time.perf_counter()
+                loaded = cls.load(path, mmap=mmap)
+                load = time.perf_counter() - start
+                start = time.perf_counter()
+                for probe_string in probes:
+                    loaded.candidate_pairs(probe_string)
+                timings.append((load, time.perf_counter() - start))
+            print("{:30} build: {:.3f}s  file: {:.1f}MB  load mmap: {:.4f}s ({:.1f}us/probe)  load copy: {:.4f}s ({:.1f}us/probe)".format(
+                cls.__name__, build, os.path.getsize(path) / 2**20,
+                timings[0][0], 1e6 * timings[0][1] / n_probes, timings[1][0], 1e6 * timings[1][1] / n_probes))
+
+
+def bench_updates(n=20000, n_updates=1000, J=0.8):
+    """
+    cost of add / remove on a live many-one index vs a full rebuild
+    """
+    print("*** updates, {} strings, {} adds + {} removes, J={} ***".format(n, n_updates, n_updates, J))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, max_len=40, alphabet=alphabet)
+    new_strings = random_corpus(n_updates, max_len=40, alphabet=alphabet, seed=1)
+    removed = random.Random(2).sample(range(n), n_updates)
+    for cls in CLASSES:
+        for compact in (False, True):
+            pi = cls(list_of_strings, J)
+            start = time.perf_counter()
+            pi.make_many_to_one_index(compact=compact)
+            rebuild = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for s in new_strings:
+                pi.add(s)
+            add = time.perf_counter() - start
+            start = time.perf_counter()
+            for indx in removed:
+                pi.remove(indx)
+            remove = time.perf_counter() - start
+            print("{:30} compact={!s:5}  rebuild: {:.3f}s  add: {:.1f}us  remove: {:.1f}us per string".format(
+                cls.__name__, compact, rebuild, 1e6 * add / n_updates, 1e6 * remove / n_updates))
+
+
+def bench_batch(n=20000, n_probes=20000, J=0.8):
+    """
+    candidate_pairs_batch vs a loop over candidate_pairs, with distinct probes and with probes
+    drawn (Zipf law) from a pool of 5000 strings, as in a stream of queries
+    """
+    print("*** batch probing, {} skewed strings, {} probes, J={} ***".format(n, n_probes, J))
+    list_of_strings = skewed_corpus(n)
+    order = FrequencyOrder(list_of_strings)
+    pool = skewed_corpus(5000, seed=1)
+    batches = (("distinct", skewed_corpus(n_probes, seed=2)),
+               ("repeated", random.Random(3).choices(pool, [1 / (k + 1) for k in range(len(pool))], k=n_probes)))
+    for cls in CLASSES:
+        for compact in (False, True):
+            pi = cls(list_of_strings, J, order=order)
+            pi.make_many_to_one_index(compact=compact)
+            for name, probes in batches:
+                start = time.perf_counter()
+                for probe_string in probes:
+                    pi.candidate_pairs(probe_string)
+                loop = time.perf_counter() - start
+                start = time.perf_counter()
+                _, candidates = pi.candidate_pairs_batch(probes)
+                batch = time.perf_counter() - start
+                print("{:30} compact={!s:5} {:8}  loop: {:.3f}s  batch: {:.3f}s  candidates: {}".format(
+                    cls.__name__, compact, name, loop, batch, len(candidates)))
+
+
+def bench_shingling(n=20000, length=200):
+    """
+    tokenization of documents into 3-shingles: string_to_symbols (sorted string shingles)
+    vs shingle_hashes (64-bit hashes), pure Python and NumPy
+    """
+    print("*** shingling, {} documents of {} characters ***".format(n, length))
+    rnd = random.Random(0)
+    words = ["".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 8))) for _ in range(5000)]
+    documents = []
+    for _ in range(n):
+        document = ""
+        while len(document) < length:
+            document += rnd.choice(words) + " "
+        documents.append(document[:length])
+
+    start = time.perf_counter()
+    list(map(string_to_symbols, documents))
+    print("string_to_symbols          {:.3f}s".format(time.perf_counter() - start))
+    for use_numpy in (False, True):
+        try:
+            start = time.perf_counter()
+            shingle_hashes(documents, use_numpy=use_numpy)
+            print("shingle_hashes numpy={!s:5}  {:.3f}s".format(use_numpy, time.perf_counter() - start))
+        except ImportError:
+            print("shingle_hashes numpy=True   (NumPy not installed)")
+    for shingle_hash in (False, True):
+        start = time.perf_counter()
+        options = {"shingle_hash": True} if shingle_hash else {"order": order_symbol_lex}
+        pi = PrefixPositionLengthIndexing(documents, 0.8, shingle_size=3, **options)
+        pi.make_many_to_one_index(compact=True)
+        print("PrefixPositionLengthIndexing shingle_hash={!s:5}  records + index: {:.3f}s".format(
+            shingle_hash, time.perf_counter() - start))
+
+
+def peak_memory(fun):
+    """
+    returns (result, elapsed seconds, peak bytes allocated during fun)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fun()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_stream(n=5000, J=0.7):
+    """
+    many-many candidates and similar pairs: in-memory (make_many_to_many_index, similarity_join)
+    vs streamed from a file (stream_similarity_join), counted on the fly or spilled to disk
+    """
+    print("*** streaming join, {} lines, J={} ***".format(n, J))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, max_len=40, alphabet=alphabet)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lines.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(list_of_strings) + "\n")
+
+        def lines():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    yield line.rstrip("\n")
+
+        runs = (("make_many_to_many_index", lambda: len(PrefixPositionLengthIndexing(list_of_strings, J).make_many_to_many_index())),
+                ("stream, candidates", lambda: sum(1 for _ in stream_similarity_join(lines(), J, verify=False))),
+                ("stream, spilled candidates", lambda: len(spill_pairs(stream_similarity_join(lines(), J, verify=False), directory))),
+                ("similarity_join", lambda: len(similarity_join(list_of_strings, J, length_filter=False))),
+                ("stream, verified", lambda: sum(1 for _ in stream_similarity_join(lines(), J))))
+        for name, fun in runs:
+            result, elapsed, peak = peak_memory(fun)
+            print("{:28} result: {:8}  time: {:.3f}s  peak memory: {:.1f}MB".format(name, result, elapsed, peak / 2**20))
+
+
+def bench_pair_buffer(n=5000, J=0.5, budgets=(1 << 26, 1 << 22)):
+    """
+    candidate pairs of the many-many join kept as a set of tuples, in a PairBuffer (packed pairs, sorted runs
+    spilled to disk beyond the memory budget), or only counted (count_only)
+    """
+    print("*** candidate pairs, {} strings, J={} ***".format(n, J))
+    alphabet = "".join(chr(0x100 + k) for k in range(300))
+    list_of_strings = random_corpus(n, max_len=40, alphabet=alphabet)
+
+    def buffered(memory_budget):
+        pairs = PrefixIndexing(list_of_strings, J).make_many_to_many_index(length_filter=True, memory_budget=memory_budget)
+        with pairs:
+            return sum(1 for _ in pairs), pairs.report["runs"]
+
+    runs = [("set of tuples", lambda: (sum(1 for _ in PrefixIndexing(list_of_strings, J).make_many_to_many_index(length_filter=True)), 0))]
+    runs += [("PairBuffer, budget {:.0f}MB".format(budget / 2**20), lambda budget=budget: buffered(budget)) for budget in budgets]
+    runs += [("count_only", lambda: (PrefixIndexing(list_of_strings, J).make_many_to_many_index(length_filter=True, count_only=True), 0))]
+    for name, fun in runs:
+        #timed without tracemalloc, which slows down the allocation of every pair
+        start = time.perf_counter()
+        n_pairs, n_runs = fun()
+        elapsed = time.perf_counter() - start
+        _, _, peak = peak_memory(fun)
+        print("{:26} pairs: {:9}  runs: {:3}  time: {:.2f}s  peak memory: {:.1f}MB".format(name, n_pairs, n_runs, elapsed, peak / 2**20))
+
+
+def bench_top_k(n=20000, n_probes=500, k=10, J=0.3, near_duplicate_rate=0.8):
+    """
+    top_k vs verifying and sorting all the candidate_pairs of the probe, with an index built for J,
+    on a corpus made of clusters of near duplicates (as a catalog)
+    """
+    print("*** top-k, {} strings, {} probes, k={}, index J={}, near duplicates: {} ***".format(n, n_probes, k, J, near_duplicate_rate))
+    corpus = synthetic_corpus(n + n_probes, near_duplicate_rate=near_duplicate_rate)
+    list_of_strings, probes = corpus[:n], corpus[n:]
+    order = FrequencyOrder(list_of_strings)
+    keys = [tuple(map(order, sorted(set(s), key=order))) for s in list_of_strings]
+    for cls in CLASSES:
+        pi = cls(list_of_strings, J, order=order)
+        pi.make_many_to_one_index(compact=True)
+        start = time.perf_counter()
+        for probe_string in probes:
+            x = tuple(map(order, sorted(set(probe_string), key=order)))
+            sims = ((verified_sim(J, x, keys[indx]), indx) for indx in pi.candidate_pairs(probe_string))
+            sorted((sim, indx) for sim, indx in sims if sim is not None)[-k:]
+        verify_all = time.perf_counter() - start
+        start = time.perf_counter()
+        for probe_string in probes:
+            pi.top_k(probe_string, k)
+        top_k = time.perf_counter() - start
+        print("{:30} verify all candidates: {:.2f}ms/probe  top_k: {:.2f}ms/probe".format(
+            cls.__name__, 1e3 * verify_all / n_probes, 1e3 * top_k / n_probes))
+
+
+def bench_multi_threshold(n=20000, n_probes=1000, thresholds=(0.7, 0.8, 0.9, 0.95)):
+    """
+    one index built for the lowest threshold and probed at each J vs one index per J
+    """
+    print("*** multi-threshold, {} strings, {} probes, J={} ***".format(n, n_probes, thresholds))
+    corpus = synthetic_corpus(n + n_probes)
+    list_of_strings, probes = corpus[:n], corpus[n:]
+    order = FrequencyOrder(list_of_strings)
+    for cls in CLASSES:
+        shared = cls(list_of_strings, min(thresholds), order=order)
+        shared.make_many_to_one_index(compact=True)
+        dedicated_postings = 0
+        for J in thresholds:
+            pi = cls(list_of_strings, J, order=order)
+            pi.make_many_to_one_index(compact=True)
+            dedicated_postings += pi.ii.n_postings
+            timings = []
+            for index, J_probe in ((pi, None), (shared, J)):
+                start = time.perf_counter()
+                n_candidates = sum(len(index.candidate_pairs(probe_string, J_probe)) for probe_string in probes)
+                timings.append((1e6 * (time.perf_counter() - start) / n_probes, n_candidates / n_probes))
+            print("{:30} J={:<5} dedicated: {:.0f}us/probe {:.1f} candidates  shared: {:.0f}us/probe {:.1f} candidates".format(
+                cls.__name__, J, *timings[0], *timings[1]))
+        print("{:30} postings: {} for one index per J, {} for the shared index".format(
+            cls.__name__, dedicated_postings, shared.ii.n_postings))
+
+
+def bench_probe_cache(n=20000, n_distinct=5000, n_probes=20000, J=0.8, skew=1.0, cache_sizes=(256, 1024, 4096)):
+    """
+    repeated many-one traffic: n_probes drawn from n_distinct probe strings with a Zipf law of exponent 'skew',
+    without cache and with a ProbeCache of each size
+    """
+    print("*** probe cache, {} strings, {} probes among {} distinct, J={} ***".format(n, n_probes, n_distinct, J))
+    corpus = synthetic_corpus(n + n_distinct)
+    list_of_strings, distinct = corpus[:n], corpus[n:]
+    rnd = random.Random(0)
+    probes = rnd.choices(distinct, cum_weights=list(accumulate(1.0 / (k + 1) ** skew for k in range(n_distinct))), k=n_probes)
+    order = FrequencyOrder(list_of_strings)
+    for cls in CLASSES:
+        pi = cls(list_of_strings, J, order=order)
+        pi.make_many_to_one_index(compact=True)
+        for max_entries in (None,) + tuple(cache_sizes):
+            if max_entries is None:
+                pi.disable_cache()
+            else:
+                cache = pi.enable_cache(max_entries)
+            start = time.perf_counter()
+            for probe_string in probes:
+                pi.candidate_pairs(probe_string)
+            elapsed = 1e6 * (time.perf_counter() - start) / n_probes
+            hit_rate = "" if max_entries is None else "hit rate {:.2f}".format(cache.counters["hits"] / n_probes)
+            print("{:30} cache={:<6} {:.1f}us/probe {}".format(cls.__name__, str(max_entries), elapsed, hit_rate))
+        pi.disable_cache()
+
+
+def bench_bitmaps(n=200000, n_probes=500, thresholds=(0.5, 0.8), densities=(1 / 32, 1 / 128), skew=1.2):
+    """
+    counting and listing candidates: set of candidate_pairs vs lazy Candidates, with bitmaps of several densities
+    (on a skewed corpus, where the prefixes share frequent symbols with long posting lists)
+    """
+    print("*** bitmaps, {} strings, {} probes, skew={} ***".format(n, n_probes, skew))
+    corpus = synthetic_corpus(n + n_probes, skew=skew)
+    list_of_strings, probes = corpus[:n], corpus[n:]
+    order = FrequencyOrder(list_of_strings)
+    for J in thresholds:
+        pi = PrefixIndexing(list_of_strings, J, order=order)
+        pi.make_many_to_one_index(compact=True)
+        for density in (None,) + tuple(densities):
+            n_bitmaps = 0 if density is None else pi.enable_bitmaps(density)
+            timings = []
+            for fun in (lambda s: len(pi.candidate_pairs(s)), lambda s: len(pi.candidates(s)),
+                        lambda s: pi.candidates(s).sorted()):
+                start = time.perf_counter()
+                for probe_string in probes:
+                    fun(probe_string)
+                timings.append(1e6 * (time.perf_counter() - start) / n_probes)
+            print("J={:<4} density={:<9} {:4} bitmaps  set {:.0f}us  lazy count {:.0f}us  lazy sorted {:.0f}us".format(
+                J, "-" if density is None else "1/{}".format(round(1 / density)), n_bitmaps, *timings))
+
+
+def bench_count_filter(n=5000, thresholds=(0.6, 0.8, 0.9)):
+    """
+    many-many candidates and similarity_join time, with and without count_filter (overlap counting)
+    """
+    print("*** count filter, {} strings ***".format(n))
+    list_of_strings = synthetic_corpus(n)
+    order = FrequencyOrder(list_of_strings)
+    for J in thresholds:
+        for cls in CLASSES:
+            results = []
+            for count_filter in (False, True):
+                n_candidates = len(cls(list_of_strings, J, order=order).make_many_to_many_index(length_filter=True, count_filter=count_filter))
+                start = time.perf_counter()
+                n_pairs = len(similarity_join(list_of_strings, J, indexing=cls, order=order, count_filter=count_filter))
+                results.append((n_candidates, time.perf_counter() - start))
+            (n_set, t_set), (n_count, t_count) = results
+            print("{:30} J={:<4} {} pairs  candidates {} -> {} ({:.0f}%)  join {:.2f}s -> {:.2f}s".format(
+                cls.__name__, J, n_pairs, n_set, n_count, 100 * n_count / max(n_set, 1), t_set, t_count))
+
+
+def bench_similarities(n=2000, cases=(("jaccard", 0.8), ("cosine", 0.8), ("dice", 0.8), ("overlap", 20), ("idf", 0.8))):
+    """
+    similarity_join under each Similarity (IDF weights for WeightedJaccard) vs the brute force
+    verification of all the pairs, which was the only way for the measures other than Jaccard
+    """
+    print("*** similarities, {} strings ***".format(n))
+    list_of_strings = synthetic_corpus(n)
+    order = FrequencyOrder(list_of_strings)
+    df = collections.Counter(symbol for s in list_of_strings for symbol in set(s))
+    idf = WeightedJaccard({symbol: math.log(n / df[symbol]) + 1 for symbol in df})
+    keys = [tuple(sorted(map(order, set(s)))) for s in list_of_strings]
+    for name, J in cases:
+        similarity = idf if name == "idf" else SIMILARITIES[name]
+        verified = similarity.bind(order).verified_sim
+        start = time.perf_counter()
+        n_brute = sum(verified(J, keys[a], keys[b]) is not None for a in range(n) for b in range(a + 1, n))
+        t_brute = time.perf_counter() - start
+        for cls in CLASSES:
+            n_candidates = len(cls(list_of_strings, J, order=order, similarity=similarity).make_many_to_many_index(
+                length_filter=True, count_filter=True))
+            start = time.perf_counter()
+            n_pairs = len(similarity_join(list_of_strings, J, indexing=cls, order=order, count_filter=True, similarity=similarity))
+            assert n_pairs == n_brute
+            print("{:8} J={:<4} {:30} {} pairs  candidates {}  join {:.2f}s (brute force {:.2f}s)".format(
+                name, J, cls.__name__, n_pairs, n_candidates, time.perf_counter() - start, t_brute))
+
+
+def rarest_first(symbol):
+    """
+    order of the symbols of synthetic_corpus from the rarest to the most frequent (it draws chr(0x100 + k) with
+    a Zipf law of rank k), known without a pass over the corpus
+    """
+    return -ord(symbol)
+
+
+def _external_run(path, J, memory_budget):
+    """
+    one run of bench_external, in a process of its own: (pairs, seconds, peak RSS in bytes, report)
+    """
+    def lines():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    start = time.perf_counter()
+    report = {}
+    if memory_budget is None:
+        n_pairs = len(similarity_join(list(lines()), J, order=rarest_first))
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            n_pairs = sum(1 for _ in external_similarity_join(lines(), J, directory, memory_budget=memory_budget,
+                                                                  order=rarest_first, report=report))
+    elapsed = time.perf_counter() - start
+    return n_pairs, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, report
+
+
+def bench_external(n=50000, J=0.8, budgets=(1 << 26, 1 << 24, 1 << 22)):
+    """
+    similarity_join in memory vs external_similarity_join with several memory budgets, each in a new process
+    to measure its peak RSS
+    """
+    print("*** external join, {} lines, J={} ***".format(n, J))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lines.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(synthetic_corpus(n)) + "\n")
+        for memory_budget in (None,) + tuple(budgets):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                n_pairs, elapsed, rss, report = executor.submit(_external_run, path, J, memory_budget).result()
+            name = "in memory" if memory_budget is None else "budget {:.0f}MB".format(memory_budget / 2**20)
+            print("{:14} pairs: {}  time: {:.1f}s  peak RSS: {:.0f}MB  shards: {}  runs: {}  written: {:.1f}MB  read: {:.1f}MB".format(
+                name, n_pairs, elapsed, rss / 2**20, report.get("shards", "-"), report.get("runs", "-"),
+                report.get("bytes_written", 0) / 2**20, report.get("bytes_read", 0) / 2**20))
+
+
+def bench_rs_join(n_r=100000, n_s=20000, J=0.8, batch_size=1024, workers=(1, 2)):
+    """
+    R-S join: a loop of candidate_pairs and verified_sim over S vs rs_join (batched, length-sorted), serial and parallel
+    """
+    print("*** R-S join, |R|={}, |S|={}, J={} ***".format(n_r, n_s, J))
+    corpus = synthetic_corpus(n_r + n_s, near_duplicate_rate=0.3)
+    R, S = corpus[:n_r], corpus[n_r:]
+    order = FrequencyOrder(R)
+
+    def loop():
+        pi = PrefixPositionLengthIndexing(R, J, order=order)
+        pi.make_many_to_one_index(compact=True)
+        keys = [tuple(map(order, s_symbols)) for s_symbols in pi.records.symbols]
+        n = 0
+        for s in S:
+            x = tuple(map(order, pi.symbols_of(s)))
+            n += sum(verified_sim(J, keys[indx_r], x) is not None for indx_r in pi.candidate_pairs(s))
+        return n
+
+    runs = [("candidate_pairs loop", loop)]
+    runs += [("rs_join, index R, {} worker(s)".format(w),
+              lambda w=w: sum(1 for _ in rs_join(R, S, J, order=order, batch_size=batch_size, workers=w, index_smaller=False)))
+             for w in workers]
+    runs += [("rs_join, index S (smaller)", lambda: sum(1 for _ in rs_join(R, S, J, order=order, batch_size=batch_size)))]
+    for name, fun in runs:
+        start = time.perf_counter()
+        n_pairs = fun()
+        print("{:32} pairs: {}  time: {:.2f}s".format(name, n_pairs, time.perf_counter() - start))
+
+
+def bench_startup(n=20000, J=0.8, repeats=10):
+    """
+    cold start of a new process (median of repeats): the interpreter alone, import simil, every submodule and
+    optional dependency imported eagerly, and python -m simil query of a single probe against a saved index;
+    the package is byte-compiled first, as an installed one is (PYTHONDONTWRITEBYTECODE would hide it)
+    returns {name: seconds}
+    """
+    print("*** startup, index of {} strings, J={}, median of {} runs ***".format(n, J, repeats))
+    here = os.path.dirname(os.path.abspath(__file__))
+    compileall.compile_dir(os.path.join(here, "simil"), quiet=1)
+    list_of_strings = synthetic_corpus(n)
+    eager = ("import simil.tokens, simil.compact, simil.records, simil.stats, simil.similarity, simil.indexing, "
+             "simil.join, simil.parallel, simil.debug, concurrent.futures.process, tempfile")
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.bin")
+        pi = PrefixPositionLengthIndexing(list_of_strings, J, order=FrequencyOrder(list_of_strings))
+        pi.make_many_to_one_index(compact=True)
+        pi.save(path)
+        commands = [("python -c pass", ["-c", "pass"]),
+                    ("import simil", ["-c", "import simil"]),
+                    ("import everything", ["-c", eager]),
+                    ("python -m simil query", ["-m", "simil", "query", path, list_of_strings[0]])]
+        for name, arguments in commands:
+            elapsed = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                subprocess.run([sys.executable] + arguments, check=True, stdout=subprocess.DEVNULL,
+                               cwd=here)
+                elapsed.append(time.perf_counter() - start)
+            timings[name] = sorted(elapsed)[len(elapsed) // 2]
+            print("{:22} {:.1f}ms".format(name, 1e3 * timings[name]))
+    return timings
+
+
+def synthetic_corpus(n, min_len=5, max_len=40, length_distribution="uniform", n_symbols=2000, skew=1.0,
+                     near_duplicate_rate=0.1, edit_rate=0.05, seed=0):
+    """
+    n strings (sets of distinct symbols), reproducible from 'seed':
+    - set sizes in [min_len, max_len], "uniform" or "lognormal" (most strings short, a long tail)
+    - symbols drawn from a Zipf law of exponent 'skew' over n_symbols symbols (skew=0: uniform)
+    - a fraction near_duplicate_rate of the strings are copies of an earlier string in which
+      a fraction edit_rate of the symbols (at least one) are replaced by other ones
+    """
+    rnd = random.Random(seed)
+    alphabet = [chr(0x100 + k) for k in range(n_symbols)]
+    cum_weights = list(accumulate(1.0 / (k + 1) ** skew for k in range(n_symbols)))
+    mu = math.log((min_len + max_len) / 4)
+
+    def draw(s, length):
+        while len(s) < length:
+            s.update(rnd.choices(alphabet, cum_weights=cum_weights, k=length - len(s)))
+        return s
+
+    list_of_strings = []
+    for _ in range(n):
+        if list_of_strings and rnd.random() < near_duplicate_rate:
+            s = list(rnd.choice(list_of_strings))
+            n_edits = max(1, round(edit_rate * len(s)))
+            kept = set(rnd.sample(s, len(s) - n_edits))
+            list_of_strings.append("".join(sorted(draw(kept, len(s)))))
+            continue
+        if length_distribution == "lognormal":
+            length = min(max_len, max(min_len, round(rnd.lognormvariate(mu, 0.6))))
+        else:
+            length = rnd.randint(min_len, max_len)
+        list_of_strings.append("".join(sorted(draw(set(), length))))
+    return list_of_strings
+
+
+def run_suite(n=3000, n_probes=300, thresholds=(0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99), classes=CLASSES, **corpus_options):
+    """
+    for every indexing class and threshold J, on a synthetic_corpus of n strings (the probes are n_probes more strings):
+    - many-one: index build time and peak memory, probe latency percentiles (us), candidates per probe,
+      false-positive ratio of the candidates (fraction that are not similar)
+    - many-many: time, candidate pairs, false-positive ratio, similar pairs and pairs/sec of the verified join
+    returns a dict (parameters, machine, results) ready for json.dump
+    """
+    corpus = synthetic_corpus(n + n_probes, **corpus_options)
+    list_of_strings, probes = corpus[:n], corpus[n:]
+    order = FrequencyOrder(list_of_strings)
+    keys = [tuple(map(order, sorted(set(s), key=order))) for s in corpus]
+
+    results = []
+    for J in thresholds:
+        for cls in classes:
+            pi = cls(list_of_strings, J, order=order)
+            start = time.perf_counter()
+            pi.make_many_to_one_index(compact=True)
+            build = time.perf_counter() - start
+            _, _, peak = peak_memory(lambda: cls(list_of_strings, J, order=order).make_many_to_one_index(compact=True))
+
+            latencies, n_candidates, n_similar = [], 0, 0
+            for k, probe_string in enumerate(probes):
+                start = time.perf_counter()
+                candidates = pi.candidate_pairs(probe_string)
+                latencies.append(1e6 * (time.perf_counter() - start))
+                n_candidates += len(candidates)
+                n_similar += sum(verified_sim(J, keys[n + k], keys[indx]) is not None for indx in candidates)
+
+            start = time.perf_counter()
+            cp = cls(list_of_strings, J, order=order).make_many_to_many_index(length_filter=True)
+            many_to_many = time.perf_counter() - start
+            start = time.perf_counter()
+            pairs = similarity_join(list_of_strings, J, indexing=cls, order=order)
+            join = time.perf_counter() - start
+
+            results.append({
+                "class": cls.__name__, "J": J,
+                "build_s": build, "index_peak_bytes": peak, "index_keys": len(pi.ii), "index_postings": pi.ii.n_postings,
+                "probe_latency_us": percentiles(latencies), "candidates_per_probe": n_candidates / n_probes,
+                "probe_false_positive_ratio": 1 - n_similar / n_candidates if n_candidates else 0.0,
+                "many_to_many_s": many_to_many, "candidate_pairs": len(cp),
+                "false_positive_ratio": 1 - len(pairs) / len(cp) if cp else 0.0,
+                "similar_pairs": len(pairs), "join_s": join, "join_pairs_per_s": len(pairs) / join,
+                "candidate_pairs_per_s": len(cp) / many_to_many,
+            })
+            print("{:30} J={:<5} build: {:.3f}s  probe p50/p99: {:.0f}/{:.0f}us  candidates: {:8}  fp ratio: {:.3f}  "
+                  "similar: {:6}  join: {:.3f}s".format(cls.__name__, J, build, results[-1]["probe_latency_us"]["p50"],
+                  results[-1]["probe_latency_us"]["p99"], len(cp), results[-1]["false_positive_ratio"], len(pairs), join))
+
+    return {"parameters": dict(corpus_options, n=n, n_probes=n_probes, thresholds=list(thresholds)),
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+            "results": results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", action="store_true", help="run the benchmark suite (run_suite) instead of the benchmarks")
+    parser.add_argument("--json", help="file where the suite results are written")
+    parser.add_argument("-n", type=int, default=3000, help="number of strings")
+    parser.add_argument("--probes", type=int, default=300, help="number of probe strings (many-one)")
+    parser.add_argument("-J", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99], help="thresholds")
+    parser.add_argument("--lengths", nargs=2, type=int, default=[5, 40], metavar=("MIN", "MAX"), help="set sizes")
+    parser.add_argument("--length-distribution", choices=("uniform", "lognormal"), default="uniform")
+    parser.add_argument("--symbols", type=int, default=2000, help="number of distinct symbols")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of the symbol frequencies")
+    parser.add_argument("--near-duplicates", type=float, default=0.1, help="rate of near-duplicate strings")
+    parser.add_argument("--edits", type=float, default=0.05, help="fraction of the symbols edited in a near duplicate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.suite:
+        report = run_suite(args.n, args.probes, args.J, min_len=args.lengths[0], max_len=args.lengths[1],
+                           length_distribution=args.length_distribution, n_symbols=args.symbols, skew=args.skew,
+                           near_duplicate_rate=args.near_duplicates, edit_rate=args.edits, seed=args.seed)
+        report["startup"] = bench_startup()
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=1)
+        raise SystemExit
+
+    bench_index_memory()
+    bench_ordering()
+    bench_build_probe()
+    bench_long_strings()
+    bench_length_filter()
+    bench_parallel()
+    bench_persistence()
+    bench_updates()
+    bench_batch()
+    bench_shingling()
+    bench_stream()
+    bench_pair_buffer()
+    bench_top_k()
+    bench_multi_threshold()
+    bench_probe_cache()
+    bench_bitmaps()
+    bench_count_filter()
+    bench_similarities()
+    bench_external()
+    bench_rs_join()
+    bench_startup()
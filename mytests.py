@@ -1,7 +1,31 @@
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
 import unittest
+import weakref
+from array import array
+from unittest import mock
 
-from simil import order_symbol_1, symbols, id_and_symbols, cmp_to_key, \
-                    PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import simil
+from server import QueryServer, load_test, open_connection
+from simil import order_symbol_1, symbols, id_and_symbols, \
+                    PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing, CompactIndex, FrequencyOrder, RecordStore, \
+                    jaccard_sim, order_symbol_lex, order_symbol_hash, overlap, similarity_join, INDEX_MAGIC, \
+                    shingles_n, shingle_hash, shingle_hashes, stream_similarity_join, spill_pairs, load_pairs, external_similarity_join, rs_join, \
+                    index_histogram, ProbeCache, Candidates, bitmap_of, bitmap_indices, \
+                    Similarity, Jaccard, DICE, OVERLAP, WeightedJaccard, PairBuffer
 
 #run with: python -m unittest -v mytests.py
 
@@ -23,16 +47,26 @@ class TestOrdersWithStrings(unittest.TestCase):
         #print('order_values:', order_values)
         self.assertTrue(all(earlier <= later for earlier, later in zip(order_values, order_values[1:])))
 
+    def test_frequency_order(self):
+        order = FrequencyOrder(["abc", "abd", "ae", "a"])
+        self.assertTupleEqual(symbols("edcba", order=order), ('c', 'd', 'e', 'b', 'a'))
+        #unknown symbols come last, with distinct keys
+        self.assertTupleEqual(symbols("zay", order=order), ('a', 'y', 'z'))
+        self.assertEqual(len({order(symbol) for symbol in "abcdeyz"}), 7)
+
 
 class TestPrefixPositionLengthIndexing(unittest.TestCase):
 
     def test_prefix_length(self):
         J = 0.9
         pi = PrefixIndexing(None, J)
-        self.assertEqual(pi.prefix_length("*" * 9), 1)
-        self.assertEqual(pi.prefix_length("*" * 10), 2)
-        self.assertEqual(pi.prefix_length("*" * 19), 2)
-        self.assertEqual(pi.prefix_length("*" * 20), 3)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:9]), 1)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:10]), 2)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:19]), 2)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:20]), 3)
+        #the set of symbols of the string, not its length
+        self.assertEqual(pi.prefix_length("*" * 20), 1)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:10] * 2), 2)
 
     def test_make_many_to_one_index_1(self):
         list_of_strings = ["acdefghijk", "abdefghijk"]
@@ -79,6 +113,37 @@ class TestPrefixPositionLengthIndexing(unittest.TestCase):
         #self.assertSetEqual(pi.cp_keys, {('a', 1)})
 
 
+    def test_probe_keys_match_enumeration(self):
+        #reference: exhaustive enumeration of every possible (symbol, j, q), intersected with ii.keys()
+        def enumerated_keys(pi, prefix, size):
+            potential_keys = set()
+            for i, symbol in enumerate(prefix, 1):
+                p = size - i
+                for q in range(p, -1, -1):
+                    js = list(itertools.takewhile(lambda j: (q + 1 + pi.EPS) >= pi.J * (size + j - 1), itertools.count(1)))
+                    if not js:
+                        break
+                    potential_keys.update((symbol, j, q) for j in js)
+                for q in itertools.count(p + 1):
+                    js = list(itertools.takewhile(lambda j: (p + 1 + pi.EPS) >= pi.J * (i + j - 1 + q), itertools.count(1)))
+                    if not js:
+                        break
+                    potential_keys.update((symbol, j, q) for j in js)
+            return potential_keys & pi.ii.keys()
+
+        rnd = random.Random(2)
+        for _ in range(10):
+            list_of_strings = random_strings(rnd, 40, max_len=30)
+            probes = random_strings(rnd, 20, max_len=30)
+            for J in (0.5, 0.56, 0.7, 0.8, 0.9, 0.95):
+                for compact in (False, True):
+                    pi = PrefixPositionLengthIndexing(list_of_strings, J)
+                    pi.make_many_to_one_index(compact=compact)
+                    for probe_string in probes:
+                        prefix, size = pi.probe(probe_string)
+                        self.assertSetEqual(pi.probe_keys(prefix, size), enumerated_keys(pi, prefix, size))
+
+
 class TestPrefixIndexing(unittest.TestCase):
 
     # def setUp(self):
@@ -94,10 +159,26 @@ class TestPrefixIndexing(unittest.TestCase):
     def test_prefix_length(self):
         J = 0.9
         pi = PrefixIndexing(None, J)
-        self.assertEqual(pi.prefix_length("*" * 9), 1)
-        self.assertEqual(pi.prefix_length("*" * 10), 2)
-        self.assertEqual(pi.prefix_length("*" * 19), 2)
-        self.assertEqual(pi.prefix_length("*" * 20), 3)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:9]), 1)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:10]), 2)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:19]), 2)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:20]), 3)
+        #the set of symbols of the string, not its length
+        self.assertEqual(pi.prefix_length("*" * 20), 1)
+        self.assertEqual(pi.prefix_length(string.ascii_letters[:10] * 2), 2)
+
+    def test_records(self):
+        list_of_strings = ["bcdefghij", "abcdefghijj", "cbcdefghijklm"]
+        pi = PrefixIndexing(list_of_strings, 0.9)
+        self.assertIsInstance(pi.records, RecordStore)
+        self.assertEqual(len(pi.records), 3)
+        self.assertTupleEqual(pi.records.symbols[1], tuple("abcdefghij"))
+        #sizes are set sizes
+        self.assertListEqual(list(pi.records.sizes), [9, 10, 12])
+        self.assertListEqual(list(pi.records.prefix_lengths), [1, 2, 2])
+        self.assertTupleEqual(pi.records.prefix(2), ('b', 'c'))
+        with self.assertRaises(TypeError):
+            pi.records.sizes[0] = 1
 
     def test_make_many_to_one_index_1(self):
         list_of_strings = ["bcdefghij", "abcdefghij"]
@@ -171,10 +252,772 @@ class TestPrefixPositionIndexing(unittest.TestCase):
         self.assertSetEqual(pi.cp_keys, {('a', 1)})
 
 
+class TestCompactIndex(unittest.TestCase):
+
+    list_of_strings = ["bcdefghij", "abcdefghij", "cdefghijklm", "aefghijkluvw"]
+
+    def test_same_index_as_dict(self):
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            pi = cls(self.list_of_strings, 0.8)
+            pi.make_many_to_one_index()
+            cpi = cls(self.list_of_strings, 0.8)
+            cpi.make_many_to_one_index(compact=True)
+            self.assertIsInstance(cpi.ii, CompactIndex)
+            self.assertDictEqual({k: set(v) for k, v in cpi.ii.items()}, pi.ii)
+            self.assertEqual(cpi.ii.n_postings, sum(map(len, pi.ii.values())))
+
+    def test_candidate_pairs(self):
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            pi = cls(self.list_of_strings, 0.8)
+            pi.make_many_to_one_index()
+            cpi = cls(self.list_of_strings, 0.8)
+            cpi.make_many_to_one_index(compact=True)
+            for probe_string in ("aefghijklmno", "bcdefghijmno", "xyz"):
+                self.assertEqual(cpi.candidate_pairs(probe_string), pi.candidate_pairs(probe_string))
+
+    def test_missing_keys(self):
+        pi = PrefixPositionIndexing(self.list_of_strings, 0.9)
+        pi.make_many_to_one_index(compact=True)
+        self.assertIn(('a', 1), pi.ii)
+        self.assertNotIn(('a', 2), pi.ii)
+        self.assertNotIn(('z', 1), pi.ii)
+        self.assertNotIn('a', pi.ii)
+        self.assertListEqual(list(pi.ii[('a', 1)]), [1, 3])
+
+
+def brute_force_join(list_of_strings, J):
+    return sorted((indx_s, indx_t, jaccard_sim(s, t))
+                  for (indx_s, s), (indx_t, t) in itertools.combinations(enumerate(list_of_strings), 2)
+                  if jaccard_sim(s, t) >= J)
+
+
+def random_strings(rnd, n, alphabet=string.ascii_letters[:20], max_len=15):
+    return ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, max_len))) for _ in range(n)]
+
+
+class TestSimilarityJoin(unittest.TestCase):
+
+    def test_overlap(self):
+        self.assertEqual(overlap((1, 2, 3, 5), (2, 3, 4, 5), 3), 3)
+        self.assertEqual(overlap((1, 2), (3, 4), 0), 0)
+        #early termination: the required overlap can not be reached
+        self.assertLess(overlap((1, 2, 3, 5), (2, 3, 4, 5), 4), 4)
+
+    def test_suffix_bound_rounding(self):
+        #0.56 * 25 == 14.000000000000002
+        s = string.ascii_letters[:25]
+        t = s[11:]
+        self.assertEqual(similarity_join([s, t], 0.56, order=order_symbol_lex), [(0, 1, 0.56)])
+
+    def test_no_false_negatives(self):
+        rnd = random.Random(0)
+        for _ in range(20):
+            list_of_strings = random_strings(rnd, 30)
+            for J in (0.5, 0.7, 0.8, 0.9, 1.0):
+                expected = brute_force_join(list_of_strings, J)
+                for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+                    self.assertListEqual(similarity_join(list_of_strings, J, indexing=cls), expected)
+
+    def test_length_filter(self):
+        rnd = random.Random(4)
+        for _ in range(10):
+            list_of_strings = random_strings(rnd, 40, max_len=25)
+            for J in (0.5, 0.8, 0.9):
+                expected = brute_force_join(list_of_strings, J)
+                cp = PrefixIndexing(list_of_strings, J).make_many_to_many_index()
+                self.assertLessEqual(PrefixIndexing(list_of_strings, J).make_many_to_many_index(length_filter=True), cp)
+                for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+                    self.assertListEqual(similarity_join(list_of_strings, J, indexing=cls, length_filter=True), expected)
+                    self.assertListEqual(similarity_join(list_of_strings, J, indexing=cls, length_filter=False), expected)
+
+    def test_parallel_many_to_many(self):
+        rnd = random.Random(3)
+        list_of_strings = random_strings(rnd, 80)
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            expected = set(cls(list_of_strings, 0.6).make_many_to_many_index())
+            pi = cls(list_of_strings, 0.6)
+            self.assertSetEqual(pi.make_many_to_many_index_parallel(workers=2), expected)
+            self.assertSetEqual(pi.make_many_to_many_index_parallel(workers=2, length_filter=True),
+                                set(cls(list_of_strings, 0.6).make_many_to_many_index(length_filter=True)))
+            self.assertEqual(pi.make_many_to_many_index_parallel(workers=2, count_only=True), len(expected))
+
+    def test_pair_buffer(self):
+        rnd = random.Random(23)
+        pairs = [(rnd.randrange(300), rnd.randrange(300, 1 << 32))[::rnd.choice((1, -1))] for _ in range(5000)]
+        pairs += pairs[:1000]
+        expected = sorted({(a, b) if a < b else (b, a) for a, b in pairs})
+        for use_numpy in (True, False):
+            with mock.patch.dict(sys.modules, {} if use_numpy and numpy else {"numpy": None}):
+                for memory_budget in (None, 4000):
+                    with PairBuffer(memory_budget, chunk_size=700) as buffer:
+                        for a, b in pairs[:3000]:
+                            buffer.add(a, b)
+                        for a, b in pairs[3000:]:
+                            buffer.extend(a, [b])
+                        self.assertListEqual(list(buffer), expected)
+                        self.assertEqual(buffer.count(), len(expected))
+                        self.assertEqual(buffer.report["pairs_added"], len(pairs))
+                        self.assertEqual(buffer.report["runs"] > 0, memory_budget is not None)
+                        #list and count read the runs once each
+                        self.assertEqual(buffer.report["bytes_read"], 2 * buffer.report["bytes_written"])
+                        runs = list(buffer.runs)
+                    self.assertFalse(any(map(os.path.exists, runs)))
+
+        list_of_strings = random_strings(rnd, 120)
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for count_filter in (False, True):
+                expected = sorted(cls(list_of_strings, 0.5).make_many_to_many_index(length_filter=True, count_filter=count_filter))
+                with tempfile.TemporaryDirectory() as directory:
+                    buffer = cls(list_of_strings, 0.5).make_many_to_many_index(length_filter=True, count_filter=count_filter,
+                                                                               memory_budget=1000, directory=directory)
+                    self.assertListEqual(list(buffer), expected)
+                    self.assertGreater(buffer.report["runs"], 0)
+                    buffer.close()
+                    self.assertListEqual(os.listdir(directory), [])
+                self.assertEqual(cls(list_of_strings, 0.5).make_many_to_many_index(length_filter=True, count_filter=count_filter,
+                                                                                   count_only=True), len(expected))
 
+    def test_stream(self):
+        rnd = random.Random(9)
+        list_of_strings = random_strings(rnd, 80)
+        expected = brute_force_join(list_of_strings, 0.6)
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            self.assertListEqual(sorted(stream_similarity_join(iter(list_of_strings), 0.6, indexing=cls)), expected)
+            self.assertSetEqual(set(stream_similarity_join(iter(list_of_strings), 0.6, indexing=cls, verify=False)),
+                                set(cls(list_of_strings, 0.6).make_many_to_many_index()))
+        #pairs are yielded while the input is read
+        endless = itertools.cycle(["abcdefghij", "bcdefghijk"])
+        self.assertTupleEqual(next(stream_similarity_join(endless, 0.8, verify=False)), (0, 1))
+
+    def test_spill_pairs(self):
+        rnd = random.Random(10)
+        list_of_strings = random_strings(rnd, 80)
+        with tempfile.TemporaryDirectory() as directory:
+            for verify in (False, True):
+                pairs = list(stream_similarity_join(list_of_strings, 0.5, verify=verify))
+                paths = spill_pairs(stream_similarity_join(list_of_strings, 0.5, verify=verify), directory, chunk_size=7)
+                self.assertEqual(len(paths), -(-len(pairs) // 7))
+                self.assertListEqual(list(load_pairs(paths)), pairs)
+
+    def test_external(self):
+        rnd = random.Random(21)
+        list_of_strings = random_strings(rnd, 200, alphabet=string.ascii_letters[:14])
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for J in (0.5, 0.8):
+                expected = similarity_join(list_of_strings, J, indexing=cls)
+                candidates = sorted(map(tuple, cls(list_of_strings, J).make_many_to_many_index(length_filter=True)))
+                for memory_budget in (1 << 30, 2000):
+                    with tempfile.TemporaryDirectory() as directory:
+                        report = {}
+                        self.assertEqual(list(external_similarity_join(iter(list_of_strings), J, directory, memory_budget,
+                                                                       indexing=cls, report=report)), expected)
+                        self.assertEqual(list(external_similarity_join(iter(list_of_strings), J, directory, memory_budget,
+                                                                       indexing=cls, verify=False)), candidates)
+                    self.assertEqual(report["shards"] > 1, memory_budget < 1 << 30)
+                    self.assertEqual(report["bytes_written"], report["bytes_read"])
+
+    def test_rs_join(self):
+        rnd = random.Random(22)
+        R = random_strings(rnd, 150, alphabet=string.ascii_letters[:12])
+        S = random_strings(rnd, 100, alphabet=string.ascii_letters[:12])
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for J in (0.5, 0.8):
+                expected = [(r, s) for r, s in itertools.product(range(len(R)), range(len(S))) if jaccard_sim(R[r], S[s]) >= J]
+                #S is indexed (smaller) when both have a len, R when S is an iterator
+                for S_items, workers in ((S, 1), (iter(S), 1), (S, 2)):
+                    triples = list(rs_join(R, S_items, J, indexing=cls, batch_size=17, workers=workers))
+                    self.assertEqual(sorted((r, s) for r, s, _ in triples), expected)
+                    for r, s, sim in triples:
+                        self.assertAlmostEqual(sim, jaccard_sim(R[r], S[s]))
+                candidates = set(rs_join(R, S, J, indexing=cls, verify=False))
+                self.assertLessEqual(set(expected), candidates)
+
+    def test_count_filter(self):
+        rnd = random.Random(20)
+        list_of_strings = random_strings(rnd, 150, alphabet=string.ascii_letters[:12])
+        for J in (0.5, 0.8):
+            similar = {(a, b) for a, b in itertools.combinations(range(len(list_of_strings)), 2)
+                       if jaccard_sim(list_of_strings[a], list_of_strings[b]) >= J}
+            expected = similarity_join(list_of_strings, J)
+            for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+                for length_filter in (False, True):
+                    candidates = set(cls(list_of_strings, J).make_many_to_many_index(length_filter=length_filter))
+                    pi = cls(list_of_strings, J)
+                    stats = pi.enable_stats()
+                    counted = set(pi.make_many_to_many_index(length_filter=length_filter, count_filter=True))
+                    self.assertLessEqual(similar, counted)
+                    self.assertLessEqual(counted, candidates)
+                    self.assertEqual(stats.counters["many_to_many_candidates"], len(counted))
+                self.assertEqual(similarity_join(list_of_strings, J, indexing=cls, count_filter=True), expected)
+
+    def test_overlap_stats(self):
+        rnd = random.Random(24)
+        list_of_strings = random_strings(rnd, 60, alphabet=string.ascii_letters[:12])
+        probes = [s for s in random_strings(rnd, 10, alphabet=string.ascii_letters[:12]) if len(set(s)) >= 3]
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for compact in (False, True):
+                ref = cls(list_of_strings, 3, similarity="overlap")
+                ref.make_many_to_one_index(compact=compact)
+                pi = cls(list_of_strings, 3, similarity="overlap")
+                pi.make_many_to_one_index(compact=compact)
+                stats = pi.enable_stats()
+                for probe_string in probes:
+                    self.assertEqual(set(pi.candidate_pairs(probe_string)), set(ref.candidate_pairs(probe_string)))
+                self.assertLessEqual(stats.counters["keys_hit"], stats.counters["keys_generated"])
+
+    def test_similarities(self):
+        rnd = random.Random(23)
+        alphabet = string.ascii_letters[:12]
+        list_of_strings = random_strings(rnd, 120, alphabet=alphabet)
+        probes = random_strings(rnd, 20, alphabet=alphabet)
+        weights = {symbol: 0.5 + rnd.random() * 2 for symbol in alphabet}
+
+        def brute(name, a, b):
+            a, b = set(a), set(b)
+            o = len(a & b)
+            return {"cosine": lambda: o / math.sqrt(len(a) * len(b)), "dice": lambda: 2 * o / (len(a) + len(b)),
+                    "overlap": lambda: o, "weighted": lambda: sum(map(weights.get, a & b)) / sum(map(weights.get, a | b))}[name]()
+
+        for name, similarity, J in (("cosine", "cosine", 0.7), ("dice", DICE, 0.75), ("overlap", OVERLAP, 5),
+                                    ("weighted", WeightedJaccard(weights), 0.6)):
+            expected = [(a, b) for a, b in itertools.combinations(range(len(list_of_strings)), 2)
+                        if brute(name, list_of_strings[a], list_of_strings[b]) >= J - 1e-9]
+            for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+                for length_filter, count_filter in ((False, False), (True, False), (True, True)):
+                    triples = similarity_join(list_of_strings, J, indexing=cls, length_filter=length_filter,
+                                              count_filter=count_filter, similarity=similarity)
+                    self.assertEqual([(a, b) for a, b, _ in triples], expected, (name, cls, length_filter, count_filter))
+                    for a, b, sim in triples:
+                        self.assertAlmostEqual(sim, brute(name, list_of_strings[a], list_of_strings[b]))
+                self.assertEqual(sorted((a, b) for a, b, _ in stream_similarity_join(list_of_strings, J, indexing=cls, similarity=similarity)),
+                                 expected)
+
+                pi = cls(list_of_strings, J, similarity=similarity)
+                pi.make_many_to_one_index(compact=True)
+                for s in probes:
+                    similar = [indx for indx in range(len(list_of_strings)) if brute(name, s, list_of_strings[indx]) >= J - 1e-9]
+                    self.assertLessEqual(set(similar), set(pi.candidate_pairs(s)))
+                    self.assertEqual(sorted(indx for indx, _ in pi.matches_batch([s])[0]), similar)
+                    best = sorted(similar, key=lambda indx: (-brute(name, s, list_of_strings[indx]), indx))[:3]
+                    self.assertEqual([indx for _, indx in pi.top_k(s, 3)], best)
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, "index.bin")
+                pi.save(path)
+                loaded = PrefixIndexing.load(path)
+                self.assertEqual(type(loaded.similarity), type(pi.similarity))
+                for s in probes:
+                    self.assertEqual(sorted(loaded.candidate_pairs(s)), sorted(pi.candidate_pairs(s)))
+                self.assertEqual(sorted((a, b) for a, b, _ in external_similarity_join(list_of_strings, J, tmpdir, memory_budget=2000,
+                                                                                      similarity=similarity)), expected)
+
+            R, S = list_of_strings[:70], list_of_strings[70:]
+            self.assertEqual(sorted((r, s) for r, s, _ in rs_join(R, S, J, similarity=similarity)),
+                             [(r, s) for r, s in itertools.product(range(len(R)), range(len(S))) if brute(name, R[r], S[s]) >= J - 1e-9])
+
+    def test_generic_bounds(self):
+        #the numeric bounds of Similarity are those of the closed forms of Jaccard
+        class GenericJaccard(Similarity):
+            sim, required_overlap = Jaccard.sim, Jaccard.required_overlap
+            size_bounds, min_overlap = Jaccard.size_bounds, Jaccard.min_overlap
+        generic, jaccard = GenericJaccard(), Jaccard()
+        for t in (0.5, 0.75, 0.9):
+            for size in range(1, 40):
+                self.assertEqual(generic.prefix_length(t, size), jaccard.prefix_length(t, size))
+                for i in range(1, jaccard.prefix_length(t, size) + 1):
+                    self.assertEqual(generic.max_j(t, i, size), jaccard.max_j(t, i, size))
+                    for j in range(1, jaccard.max_j(t, i, size) + 1):
+                        self.assertEqual(generic.q_range(t, i, j, size), jaccard.q_range(t, i, j, size))
+            for j in range(1, 30):
+                self.assertEqual(generic.min_suffix(t, j), jaccard.min_suffix(t, j))
+        #each instance has its own caches, which do not keep it alive
+        self.assertEqual(vars(GenericJaccard()), {})
+        reference = weakref.ref(generic)
+        del generic
+        self.assertIsNone(reference())
+
+    def test_multi_threshold(self):
+        rnd = random.Random(12)
+        list_of_strings = random_strings(rnd, 100, alphabet=string.ascii_letters[:12])
+        probes = random_strings(rnd, 30, alphabet=string.ascii_letters[:12])
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for compact in (False, True):
+                pi = cls(list_of_strings, 0.5)
+                pi.make_many_to_one_index(compact=compact)
+                with self.assertRaisesRegex(ValueError, "the index is built for J >= 0.5"):
+                    list(pi.candidate_pairs(probes[0], J=0.4))
+                with self.assertRaises(ValueError):
+                    list(pi.candidates(probes[0], J=0.4))
+                with self.assertRaises(ValueError):
+                    list(pi.candidate_pairs_batch(probes, J=0.4))
+                with self.assertRaises(ValueError):
+                    pi.top_k(probes[0], 3, J=0.4)
+                for J in (0.5, 0.7, 0.9, 1.0):
+                    dedicated = cls(list_of_strings, J)
+                    dedicated.make_many_to_one_index()
+                    for probe_string in probes:
+                        candidates = set(pi.candidate_pairs(probe_string, J))
+                        similar = {indx for indx, t in enumerate(list_of_strings) if jaccard_sim(probe_string, t) >= J}
+                        self.assertLessEqual(similar, candidates)
+                        if cls is PrefixPositionLengthIndexing:
+                            self.assertSetEqual(candidates, set(dedicated.candidate_pairs(probe_string)))
+
+    def test_top_k(self):
+        rnd = random.Random(11)
+        list_of_strings = random_strings(rnd, 150, alphabet=string.ascii_letters[:12])
+        probes = random_strings(rnd, 20, alphabet=string.ascii_letters[:12]) + list_of_strings[:5]
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for compact in (False, True):
+                for J in (0.3, 0.6):
+                    pi = cls(list_of_strings, J)
+                    pi.make_many_to_one_index(compact=compact)
+                    pi.remove(3)
+                    for probe_string in probes:
+                        expected = sorted((-jaccard_sim(set(probe_string), set(t)), indx) for indx, t in enumerate(list_of_strings)
+                                          if indx != 3 and jaccard_sim(set(probe_string), set(t)) >= J)
+                        for k in (1, 5):
+                            top = pi.top_k(probe_string, k)
+                            self.assertListEqual([indx for _, indx in top], [indx for _, indx in expected[:k]])
+                            for (sim, _), (minus_sim, _) in zip(top, expected):
+                                self.assertAlmostEqual(sim, -minus_sim)
+                        self.assertListEqual(pi.top_k(probe_string, 0), [])
+
+    def test_top_k_of_shingles(self):
+        #orders whose unseen symbols (shingles of characters counted one by one, or of a sample) share no key
+        rnd = random.Random(13)
+        list_of_strings = [s for s in random_strings(rnd, 150, alphabet=string.ascii_letters[:4]) if len(s) >= 3]
+        for order in (FrequencyOrder(list_of_strings), FrequencyOrder(list_of_strings[:10], shingle_size=3)):
+            pi = PrefixPositionLengthIndexing(list_of_strings, 0.3, order=order, shingle_size=3)
+            pi.make_many_to_one_index()
+            for probe_string in list_of_strings[:20]:
+                for sim, indx in pi.top_k(probe_string, 5):
+                    self.assertAlmostEqual(sim, jaccard_sim(shingles_n(probe_string, 3), shingles_n(list_of_strings[indx], 3)))
+
+    def test_frequency_order(self):
+        rnd = random.Random(1)
+        list_of_strings = random_strings(rnd, 60)
+        #the order of a sample leaves symbols unseen
+        for order in (FrequencyOrder(list_of_strings), FrequencyOrder(list_of_strings[:3])):
+            for J in (0.6, 0.8):
+                expected = brute_force_join(list_of_strings, J)
+                for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+                    self.assertListEqual(similarity_join(list_of_strings, J, indexing=cls, order=order), expected)
+
+
+class TestPersistence(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "index.bin")
+        self.list_of_strings = [s for s in random_strings(random.Random(4), 80) if len(s) > 1]
+        self.probes = [s for s in random_strings(random.Random(5), 30) if len(s) > 1]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_load(self):
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for order, compact, shingle_size, shingle_hash in ((order_symbol_1, False, None, False),
+                                                               (FrequencyOrder(self.list_of_strings), True, None, False),
+                                                               (order_symbol_lex, True, 2, False), (order_symbol_1, True, 2, True),
+                                                               (FrequencyOrder(self.list_of_strings, shingle_size=2), True, 2, False),
+                                                               (FrequencyOrder(self.list_of_strings, shingle_size=2, shingle_hash=True), True, 2, True)):
+                pi = cls(self.list_of_strings, 0.7, order=order, shingle_size=shingle_size, shingle_hash=shingle_hash)
+                pi.make_many_to_one_index(compact=compact)
+                pi.save(self.path)
+                for mmap in (True, False):
+                    loaded = PrefixIndexing.load(self.path, mmap=mmap)
+                    self.assertIs(type(loaded), cls)
+                    self.assertEqual((loaded.J, loaded.shingle_size, loaded.shingle_hash), (0.7, shingle_size, shingle_hash))
+                    for probe_string in self.probes:
+                        self.assertEqual(loaded.candidate_pairs(probe_string), pi.candidate_pairs(probe_string))
+
+    def test_bad_files(self):
+        pi = PrefixPositionIndexing(self.list_of_strings, 0.7)
+        pi.make_many_to_one_index()
+        pi.save(self.path)
+        with self.assertRaises(ValueError):
+            PrefixPositionLengthIndexing.load(self.path)
+        with open(self.path, "r+b") as f:
+            f.seek(len(INDEX_MAGIC))
+            f.write(bytes([99]))
+        with self.assertRaises(ValueError):
+            PrefixPositionIndexing.load(self.path)
+        #hash() of a string is salted per process
+        for order in (lambda symbol: symbol, order_symbol_hash):
+            pi = PrefixIndexing(self.list_of_strings, 0.7, order=order, shingle_size=2)
+            pi.make_many_to_one_index()
+            with self.assertRaises(ValueError):
+                pi.save(self.path)
+
+    def test_default_order_of_shingles(self):
+        list_of_strings = [s for s in self.list_of_strings if len(s) >= 3]
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            pi = cls(list_of_strings, 0.5, shingle_size=3)
+            self.assertIs(pi.order, order_symbol_lex)
+            pi.make_many_to_one_index()
+            reference = cls(list_of_strings, 0.5, shingle_size=3, order=order_symbol_lex)
+            reference.make_many_to_one_index()
+            for s in list_of_strings:
+                self.assertEqual(pi.candidate_pairs(s), reference.candidate_pairs(s))
+
+
+class TestPackage(unittest.TestCase):
+
+    def run_python(self, *arguments, **kwargs):
+        return subprocess.run([sys.executable] + list(arguments), check=True, capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), **kwargs).stdout
+
+    def test_lazy_imports(self):
+        loaded = json.loads(self.run_python("-c", "import json, sys, simil; simil.PrefixIndexing; simil.symbols('ab'); "
+                                                  "print(json.dumps(sorted(sys.modules)))"))
+        for module in ("numpy", "concurrent.futures", "multiprocessing", "pprint", "tempfile", "simil.join", "simil.debug"):
+            self.assertNotIn(module, loaded)
+        self.assertIn("symbols", dir(simil))
+        with self.assertRaises(AttributeError):
+            simil.no_such_name
+
+    def test_cli(self):
+        rnd = random.Random(19)
+        list_of_strings = random_strings(rnd, 100, alphabet=string.ascii_letters[:12])
+        probes = [s for s in random_strings(rnd, 10, alphabet=string.ascii_letters[:12]) if s]
+        with tempfile.TemporaryDirectory() as directory:
+            strings_path, index_path = os.path.join(directory, "strings.txt"), os.path.join(directory, "index.bin")
+            with open(strings_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(list_of_strings) + "\n")
+            self.run_python("-m", "simil", "build", strings_path, index_path, "-J", "0.5")
+            lines = self.run_python("-m", "simil", "query", index_path, *probes).splitlines()
+            verified = self.run_python("-m", "simil", "query", index_path, "-J", "0.7", "--strings", strings_path,
+                                       input="\n".join(probes) + "\n").splitlines()
+            for arguments, error in (((probes[0], "-J", "0.4"), "below the threshold"), (("",), "has no symbols")):
+                with self.assertRaises(subprocess.CalledProcessError) as cm:
+                    self.run_python("-m", "simil", "query", index_path, *arguments)
+                self.assertEqual(cm.exception.returncode, 2)
+                self.assertIn(error, cm.exception.stderr)
+                self.assertNotIn("Traceback", cm.exception.stderr)
+        indexed = [s for s in list_of_strings if s.strip()]
+        pi = PrefixPositionLengthIndexing(indexed, 0.5, order=FrequencyOrder(indexed))
+        pi.make_many_to_one_index()
+        for probe_string, line, verified_line in zip(probes, lines, verified):
+            self.assertEqual(json.loads(line), {"s": probe_string, "candidates": sorted(pi.candidate_pairs(probe_string))})
+            self.assertEqual([indx for indx, _ in json.loads(verified_line)["matches"]],
+                             [indx for indx, t in enumerate(indexed) if jaccard_sim(probe_string, t) >= 0.7])
+        self.assertEqual(len(lines), len(probes))
+
+
+class TestUpdates(unittest.TestCase):
+
+    def test_add_remove_same_candidates_as_rebuild(self):
+        rnd = random.Random(6)
+        list_of_strings = random_strings(rnd, 60)
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for compact in (False, True):
+                pi = cls(list_of_strings[:30], 0.6)
+                pi.make_many_to_one_index(compact=compact)
+                alive = dict(enumerate(list_of_strings[:30]))
+                for step in range(120):
+                    if rnd.random() < 0.5:
+                        indx = rnd.choice(list(alive))
+                        pi.remove(indx)
+                        del alive[indx]
+                    else:
+                        s = rnd.choice(list_of_strings)
+                        alive[pi.add(s)] = s
+                    if step % 20 == 0:
+                        rebuilt = cls(list(alive.values()), 0.6)
+                        rebuilt.make_many_to_one_index()
+                        indx_alive = list(alive)
+                        for probe_string in list_of_strings[:10]:
+                            self.assertSetEqual(set(pi.candidate_pairs(probe_string)),
+                                                {indx_alive[k] for k in rebuilt.candidate_pairs(probe_string)})
+                with self.assertRaises(KeyError):
+                    pi.remove(indx)
+
+    def test_candidate_pairs_batch(self):
+        rnd = random.Random(7)
+        list_of_strings = random_strings(rnd, 60)
+        probes = random_strings(rnd, 20) * 2
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for compact in (False, True):
+                pi = cls(list_of_strings, 0.6)
+                pi.make_many_to_one_index(compact=compact)
+                pi.add(probes[0])
+                pi.remove(3)
+                offsets, candidates = pi.candidate_pairs_batch(probes)
+                self.assertEqual(len(offsets), len(probes) + 1)
+                for k, probe_string in enumerate(probes):
+                    self.assertListEqual(list(candidates[offsets[k]:offsets[k + 1]]), sorted(pi.candidate_pairs(probe_string)))
+
+    def test_compaction(self):
+        pi = PrefixPositionLengthIndexing(["bcdefghij", "abcdefghij", "cdefghijklm", "aefghijkluvw"], 0.8)
+        pi.COMPACTION_RATIO = 0.3
+        pi.make_many_to_one_index(compact=True)
+        pi.remove(1)
+        self.assertEqual(pi.tombstones, {1})
+        self.assertListEqual(pi.candidate_pairs("abcdefghij"), [0, 3])
+        self.assertEqual(pi.add("abcdefghij"), 4)
+        #2 changes for 4 strings: compacted
+        self.assertEqual((pi.tombstones, pi.n_compacted), (set(), 5))
+        self.assertListEqual(list(pi.ii[('a', 1, 9)]), [4])
+        self.assertListEqual(pi.candidate_pairs("abcdefghij"), [0, 3, 4])
+
+
+class TestShingleHashes(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(8)
+        self.list_of_strings = ["", "ab", "abc", "aaaaaa", "abcabcabc"] + \
+                               ["".join(rnd.choices("abcd\u00e9\u4e00", k=rnd.randint(0, 40))) for _ in range(100)]
+
+    def test_same_sets_as_shingles_n(self):
+        for n in (1, 3, 4):
+            list_of_hashes = shingle_hashes(self.list_of_strings, n, use_numpy=False)
+            for s, hashes in zip(self.list_of_strings, list_of_hashes):
+                self.assertTupleEqual(hashes, tuple(sorted(shingles_n(s, n, hashfun=shingle_hash))))
+                self.assertEqual(len(hashes), len(shingles_n(s, n)))
+
+    @unittest.skipUnless(numpy, "NumPy not installed")
+    def test_numpy(self):
+        for n in (1, 3, 4):
+            self.assertListEqual(shingle_hashes(self.list_of_strings, n, use_numpy=True),
+                                 shingle_hashes(self.list_of_strings, n, use_numpy=False))
+
+    def test_indexing(self):
+        list_of_strings = [s for s in self.list_of_strings if len(s) >= 3]
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            pi = cls(list_of_strings, 0.5, shingle_hash=True)
+            self.assertTupleEqual(pi.records.symbols[2], shingle_hashes(["abcabcabc"])[0])
+            pi.make_many_to_one_index(compact=True)
+            reference = cls([tuple(map(shingle_hash, sorted(shingles_n(s, 3)))) for s in list_of_strings], 0.5,
+                            order=lambda symbol: symbol)
+            reference.make_many_to_one_index()
+            for s in list_of_strings:
+                s_hashes = tuple(shingles_n(s, 3, hashfun=shingle_hash))
+                self.assertEqual(pi.candidate_pairs(s), reference.candidate_pairs(s_hashes))
+
+
+class TestBitmaps(unittest.TestCase):
+
+    def test_bitmap(self):
+        self.assertEqual(bitmap_of([0, 3, 9], 10), 0b1000001001)
+        self.assertEqual(bitmap_indices(0b1000001001), [0, 3, 9])
+        candidates = Candidates(bitmap_of([1, 5, 70], 71), [memoryview(array('I', [2, 5, 80])), {3}], removed={70})
+        for use_numpy in (True, False):
+            with mock.patch.dict(sys.modules, {} if use_numpy and numpy else {"numpy": None}):
+                self.assertEqual(len(candidates), 5)
+                self.assertEqual(candidates.sorted(), [1, 2, 3, 5, 80])
+                self.assertEqual(candidates.to_set(), {1, 2, 3, 5, 80})
+        self.assertIn(3, candidates)
+        self.assertNotIn(70, candidates)
+
+    def test_candidates(self):
+        rnd = random.Random(19)
+        list_of_strings = random_strings(rnd, 300, alphabet=string.ascii_letters[:10])
+        probes = random_strings(rnd, 20, alphabet=string.ascii_letters[:10])
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            pi = cls(list_of_strings, 0.5)
+            pi.make_many_to_one_index(compact=True)
+            self.assertGreater(pi.enable_bitmaps(0.05), 0)
+            for s in probes[:5]:
+                pi.remove(pi.add(s))
+                pi.remove(rnd.choice([indx for indx in range(len(list_of_strings)) if indx not in pi.deleted]))
+            for use_numpy in (True, False):
+                with mock.patch.dict(sys.modules, {} if use_numpy and numpy else {"numpy": None}):
+                    for s in probes:
+                        expected = sorted(pi.candidate_pairs(s))
+                        candidates = pi.candidates(s)
+                        self.assertEqual(len(candidates), len(expected))
+                        self.assertEqual(candidates.sorted(), expected)
+                        self.assertEqual(candidates.to_set(), set(expected))
+                        self.assertEqual(pi.candidates(s, 0.8).sorted(), sorted(pi.candidate_pairs(s, 0.8)))
+            pi.compact()
+            self.assertTrue(pi.ii.bitmaps)
+
+
+class TestStats(unittest.TestCase):
+
+    def test_disabled_by_default(self):
+        pi = PrefixPositionIndexing(["bcdefghij", "abcdefghij"], 0.9)
+        pi.make_many_to_one_index()
+        pi.candidate_pairs("abcdefghij")
+        self.assertIsNone(pi.stats)
+        self.assertNotIn("counters", pi.stats_report())
+
+    def test_counters(self):
+        list_of_strings = ["bcdefghij", "abcdefghij", "cdefghijklm", "aefghijkluvw"]
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for compact in (False, True):
+                pi = cls(list_of_strings, 0.8)
+                stats = pi.enable_stats()
+                pi.make_many_to_one_index(compact=compact)
+                n_candidates = sum(len(pi.candidate_pairs(s)) for s in list_of_strings)
+                counters = stats.counters
+                self.assertEqual(counters["probes"], 4)
+                self.assertEqual(counters["candidates"], n_candidates)
+                self.assertLessEqual(counters["keys_hit"], counters["keys_generated"])
+                self.assertEqual(sum(stats.posting_lengths.values()), counters["keys_hit"])
+                self.assertTrue({"build", "tokenize", "probe_keys", "fusion"} <= stats.timers.keys())
+                report = json.loads(json.dumps(pi.stats_report()))
+                self.assertEqual(report["index"]["postings"], sum(map(len, pi.ii.values())))
+
+    def test_index_histogram(self):
+        histogram = index_histogram({"a": {1, 2, 3}, "b": {1}, "c": {4, 5}})
+        self.assertEqual((histogram["keys"], histogram["postings"], histogram["max_length"]), (3, 6, 3))
+        self.assertDictEqual(histogram["lengths"], {1: 1, 2: 2})
+        self.assertEqual(histogram["top_1pct_share"], 0.5)
+
+
+class TestProbeCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = ProbeCache(max_entries=2)
+        cache.put("a", frozenset({1}))
+        cache.put("b", frozenset({2}))
+        self.assertEqual(cache.get("a"), {1})
+        cache.put("c", frozenset({3}))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.counters["hits"], cache.counters["misses"], cache.counters["evictions"]), (1, 1, 1))
+
+        cache = ProbeCache(max_entries=None, max_candidates=3)
+        cache.put("a", frozenset({1, 2}))
+        cache.put("b", frozenset({3, 4}))
+        self.assertEqual((len(cache), cache.n_candidates), (1, 2))
+        cache.put("c", frozenset({1, 2, 3, 4}))
+        self.assertNotIn("c", cache.entries)
+
+    def test_candidate_pairs(self):
+        rnd = random.Random(17)
+        list_of_strings = random_strings(rnd, 100, alphabet=string.ascii_letters[:12])
+        probes = random_strings(rnd, 20, alphabet=string.ascii_letters[:12])
+        for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing):
+            for compact in (False, True):
+                pi = cls(list_of_strings, 0.6)
+                cache = pi.enable_cache(max_entries=8)
+                pi.make_many_to_one_index(compact=compact)
+                ref = cls(list_of_strings, 0.6)
+                ref.make_many_to_one_index(compact=compact)
+                for s in probes:
+                    for _ in range(2):
+                        self.assertEqual(pi.candidate_pairs(s), ref.candidate_pairs(s))
+                        self.assertEqual(pi.candidate_pairs(s, 0.8), ref.candidate_pairs(s, 0.8))
+                self.assertGreater(cache.counters["hits"], 0)
+                self.assertGreater(cache.counters["evictions"], 0)
+                self.assertLessEqual(len(cache), 8)
+
+                #the cache is invalidated by every change of the index
+                for s in probes[:5]:
+                    pi.candidate_pairs(s)
+                    indx = pi.add(s)
+                    ref.add(s)
+                    self.assertIn(indx, pi.candidate_pairs(s))
+                    pi.remove(indx)
+                    ref.remove(indx)
+                    self.assertEqual(pi.candidate_pairs(s), ref.candidate_pairs(s))
+                self.assertGreater(pi.stats_report()["cache"]["invalidations"], 0)
+
+
+class TestServer(unittest.TestCase):
+
+    def test_matches_batch(self):
+        rnd = random.Random(18)
+        list_of_strings = random_strings(rnd, 100, alphabet=string.ascii_letters[:12])
+        probes = random_strings(rnd, 20, alphabet=string.ascii_letters[:12])
+        pi = PrefixPositionLengthIndexing(list_of_strings, 0.5)
+        pi.make_many_to_one_index(compact=True)
+        for J in (0.5, 0.8):
+            for probe_string, matches in zip(probes, pi.matches_batch(probes, J)):
+                expected = [(indx, jaccard_sim(probe_string, t)) for indx, t in enumerate(list_of_strings)
+                            if jaccard_sim(probe_string, t) >= J]
+                self.assertEqual([indx for indx, _ in matches], [indx for indx, _ in expected])
+                for (_, sim), (_, expected_sim) in zip(matches, expected):
+                    self.assertAlmostEqual(sim, expected_sim)
+
+    def test_bad_request_in_batch(self):
+        rnd = random.Random(25)
+        list_of_strings = [s for s in random_strings(rnd, 100, alphabet=string.ascii_letters[:8]) if len(s) >= 3]
+        probes = [s for s in random_strings(rnd, 10, alphabet=string.ascii_letters[:8]) if len(s) >= 3]
+        pi = PrefixPositionLengthIndexing(list_of_strings, 0.3, order=order_symbol_lex, shingle_size=3)
+        pi.make_many_to_one_index()
+        server = QueryServer(pi, window=0.05)
+
+        async def run():
+            await server.start(port=0)
+            try:
+                return await asyncio.gather(*(server.answer(json.dumps({"id": k, "s": s, "verify": k % 2 == 0}))
+                                              for k, s in enumerate(["ab"] + probes)))
+            finally:
+                await server.stop()
+
+        responses = asyncio.run(run())
+        self.assertIn("error", responses[0])
+        for probe_string, response in zip(probes, responses[1:]):
+            self.assertNotIn("error", response)
+            if response["id"] % 2:
+                self.assertEqual(response["candidates"], pi.candidate_pairs(probe_string))
+            else:
+                self.assertEqual([indx for indx, _ in response["matches"]],
+                                 [indx for indx, t in enumerate(list_of_strings) if jaccard_sim(shingles_n(probe_string, 3), shingles_n(t, 3)) >= 0.3])
+
+        #a request failing in the batch only fails itself
+        requests = [(pi.symbols_of(s), None, False) for s in probes]
+        failing = requests[1][0]
+        probe_of_symbols = pi.probe_of_symbols
+        def failing_probe(s_symbols, J=None):
+            if s_symbols is failing:
+                raise ValueError("failing probe")
+            return probe_of_symbols(s_symbols, J)
+        with mock.patch.object(pi, "probe_of_symbols", failing_probe):
+            results = server.run_batch(requests)
+        self.assertIsInstance(results[1], ValueError)
+        for (s_symbols, _, _), probe_string, result in zip(requests, probes, results):
+            if s_symbols is not failing:
+                self.assertEqual(result, pi.candidate_pairs(probe_string))
+
+    def test_server(self):
+        rnd = random.Random(18)
+        list_of_strings = random_strings(rnd, 200, alphabet=string.ascii_letters[:12])
+        probes = random_strings(rnd, 50, alphabet=string.ascii_letters[:12])
+        pi = PrefixPositionIndexing(list_of_strings, 0.5)
+        pi.make_many_to_one_index()
 
+        async def run(unix):
+            server = QueryServer(pi, window=0.01)
+            await server.start(unix=unix)
+            try:
+                #pipelined requests on one connection, answered by id
+                reader, writer = await open_connection(unix=unix)
+                requests = [{"id": k, "s": s, "J": 0.7 if k % 2 else None, "verify": k % 3 == 0} for k, s in enumerate(probes)]
+                requests.append({"id": "bad", "s": "abc", "J": 0.1})
+                for request in requests:
+                    writer.write((json.dumps(request) + "\n").encode())
+                await writer.drain()
+                responses = {}
+                for _ in requests:
+                    response = json.loads(await reader.readline())
+                    responses[response["id"]] = response
+                writer.close()
+                report = await load_test(probes, n_requests=200, n_connections=8, unix=unix)
+            finally:
+                await server.stop()
+            return requests, responses, report
 
+        with tempfile.TemporaryDirectory() as tmpdir:
+            requests, responses, report = asyncio.run(run(os.path.join(tmpdir, "simil.sock")))
 
+        self.assertIn("error", responses["bad"])
+        for request in requests[:-1]:
+            response = responses[request["id"]]
+            if request["verify"]:
+                J = request["J"] or pi.J
+                self.assertEqual([indx for indx, _ in response["matches"]],
+                                 [indx for indx, t in enumerate(list_of_strings) if jaccard_sim(request["s"], t) >= J])
+            else:
+                self.assertEqual(response["candidates"], pi.candidate_pairs(request["s"], request["J"]))
+        metrics = report["server"]
+        self.assertEqual(metrics["requests"], len(requests) - 1 + 200)
+        self.assertLess(metrics["batches"], metrics["requests"])
+        self.assertGreater(report["throughput"], 0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,317 @@
+"""
+asyncio query server for the many-one problem of simil
+
+one request per line, in JSON: {"id": 1, "s": "probe string"}, optionally with "J" (>= the J of the index)
+and "verify": true; one response per line, with the same id: {"id": 1, "candidates": [...]}, or with verify,
+{"id": 1, "matches": [[indx, sim], ...]}; {"id": 1, "error": "..."} if the request is invalid.
+{"op": "metrics"} returns the metrics of the server (see QueryServer.metrics).
+
+concurrent requests are gathered in micro-batches (for at most 'window' seconds, at most max_batch requests)
+answered by candidate_pairs_batch in an executor, so that the event loop keeps reading requests meanwhile
+
+run with: python server.py serve strings.txt -J 0.8 (one string per line; or --index for a saved index)
+and measure with: python server.py load strings.txt (see python server.py -h)
+"""
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from simil import PrefixIndexing, INDEXING_CLASSES, SIMILARITIES, FrequencyOrder, percentiles
+
+
+class QueryServer(object):
+    """
+    serves one many-one index (of any of the three classes, built or loaded) over TCP or a Unix socket
+    the index is only read by one executor thread at a time (batches are answered one after the other)
+    """
+    #latencies kept for the percentiles of the metrics
+    N_LATENCIES = 10000
+
+    def __init__(self, indexing, window=0.002, max_batch=256, executor=None):
+        assert indexing.mode == "many_to_one"
+        self.indexing = indexing
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = ThreadPoolExecutor(max_workers=1) if executor is None else executor
+        self.queue = None
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=self.N_LATENCIES)
+        self.batch_times = collections.deque(maxlen=self.N_LATENCIES)
+        self.max_queue_depth = 0
+
+    async def start(self, host="127.0.0.1", port=8765, unix=None):
+        """
+        starts listening (on a Unix socket if 'unix' is a path) and batching; returns the asyncio server
+        """
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.batch_loop())
+        if unix is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path=unix)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        try:
+            await self.batcher
+        except asyncio.CancelledError:
+            pass
+
+    async def handle(self, reader, writer):
+        """
+        one connection: requests are queued as they are read, and answered as soon as their batch is done
+        (not necessarily in order, see the ids)
+        """
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self.respond(line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, line, writer):
+        start = time.perf_counter()
+        response = await self.answer(line)
+        writer.write(json.dumps(response).encode() + b"\n")
+        self.latencies.append(time.perf_counter() - start)
+        await writer.drain()
+
+    async def answer(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request is a JSON object")
+            request_id = request.get("id")
+            if request.get("op") == "metrics":
+                return {"id": request_id, "metrics": self.metrics()}
+            s, J, verify = request["s"], request.get("J"), bool(request.get("verify", False))
+            if not isinstance(s, str) or not s:
+                raise ValueError("'s' must be a non-empty string")
+            if J is not None and not self.indexing.J <= J <= self.indexing.similarity.MAX_THRESHOLD:
+                raise ValueError("the index is built for J >= {}".format(self.indexing.J))
+            if verify and self.indexing.records is None:
+                raise ValueError("this index can not verify candidates (no records)")
+            #tokenized here, so that a string without symbols is rejected before it joins a batch
+            s_symbols = self.indexing.symbols_of(s)
+            if not s_symbols:
+                raise ValueError("'s' has no symbols for this index (shorter than a shingle?)")
+        except (ValueError, KeyError, TypeError) as e:
+            self.counters["errors"] += 1
+            return {"id": request_id, "error": "{}: {}".format(type(e).__name__, e)}
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((s_symbols, J, verify, future))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        try:
+            result = await future
+        except Exception as e:
+            self.counters["errors"] += 1
+            return {"id": request_id, "error": str(e)}
+        return {"id": request_id, "matches" if verify else "candidates": result}
+
+    async def batch_loop(self):
+        """
+        gathers the queued requests in micro-batches and answers them in the executor
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self.queue.get_nowait())
+
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, [item[:3] for item in batch])
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (*_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            self.batch_times.append(time.perf_counter() - start)
+            self.counters["batches"] += 1
+            self.counters["requests"] += len(batch)
+
+    def run_batch(self, requests):
+        """
+        answers a batch of (symbols of s, J, verify) requests: one candidate_pairs_batch (or matches_batch) per (J, verify)
+        if a group fails, its requests are answered one by one, so that a failing request only fails itself:
+        its result is then the exception
+        """
+        groups = collections.defaultdict(list)
+        for k, (s_symbols, J, verify) in enumerate(requests):
+            groups[J, verify].append(k)
+        results = [None] * len(requests)
+        for (J, verify), ks in groups.items():
+            try:
+                self.run_group(requests, ks, J, verify, results)
+            except Exception:
+                for k in ks:
+                    try:
+                        self.run_group(requests, [k], J, verify, results)
+                    except Exception as e:
+                        results[k] = e
+        return results
+
+    def run_group(self, requests, ks, J, verify, results):
+        probes = [requests[k][0] for k in ks]
+        if verify:
+            for k, matches in zip(ks, self.indexing.matches_batch(probes, J, tokenized=True)):
+                results[k] = [[indx, sim] for indx, sim in matches]
+        else:
+            offsets, candidates = self.indexing.candidate_pairs_batch(probes, J, tokenized=True)
+            for n, k in enumerate(ks):
+                results[k] = candidates[offsets[n]:offsets[n + 1]].tolist()
+
+    def metrics(self):
+        """
+        numbers of requests, batches and errors, queue depth (current and max), mean batch size,
+        percentiles (in seconds) of the latency of the requests (from reading to writing) and of the batch time
+        """
+        batches = self.counters["batches"]
+        return {"requests": self.counters["requests"], "batches": batches, "errors": self.counters["errors"],
+                "queue_depth": self.queue.qsize() if self.queue is not None else 0, "max_queue_depth": self.max_queue_depth,
+                "mean_batch_size": self.counters["requests"] / batches if batches else 0.0,
+                "latency": percentiles(self.latencies), "batch_time": percentiles(self.batch_times)}
+
+
+async def open_connection(host="127.0.0.1", port=8765, unix=None):
+    if unix is not None:
+        return await asyncio.open_unix_connection(unix)
+    return await asyncio.open_connection(host, port)
+
+
+async def query(reader, writer, request):
+    """
+    sends one request (a dict) and waits for its response, on a connection with no other request in flight
+    """
+    writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def load_test(probes, n_requests=10000, n_connections=32, J=None, verify=False, host="127.0.0.1", port=8765,
+                    unix=None, seed=0):
+    """
+    load generator: n_connections clients, each sending one request at a time (closed loop), drawn from probes
+    returns the throughput (requests/s), the latency percentiles (in seconds) seen by the clients,
+    and the metrics of the server
+    """
+    rnd = random.Random(seed)
+    requests = [{"id": k, "s": rnd.choice(probes), "J": J, "verify": verify} for k in range(n_requests)]
+    latencies = []
+
+    async def client(my_requests):
+        reader, writer = await open_connection(host, port, unix)
+        for request in my_requests:
+            start = time.perf_counter()
+            response = await query(reader, writer, request)
+            latencies.append(time.perf_counter() - start)
+            assert response["id"] == request["id"] and "error" not in response, response
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(requests[c::n_connections]) for c in range(n_connections)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await open_connection(host, port, unix)
+    metrics = (await query(reader, writer, {"op": "metrics"}))["metrics"]
+    writer.close()
+    return {"requests": n_requests, "connections": n_connections, "throughput": n_requests / elapsed,
+            "latency": percentiles(latencies), "server": metrics}
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def build_index(args):
+    if args.index:
+        return PrefixIndexing.load(args.index)
+    list_of_strings = read_lines(args.strings)
+    order = FrequencyOrder(list_of_strings)
+    pi = INDEXING_CLASSES[args.indexing](list_of_strings, args.J, order=order, similarity=args.similarity)
+    pi.make_many_to_one_index(compact=True)
+    return pi
+
+
+async def serve(args):
+    server = QueryServer(build_index(args), window=args.window, max_batch=args.max_batch)
+    await server.start(args.host, args.port, args.unix)
+    print("serving on {}".format(args.unix or "{}:{}".format(args.host, args.port)))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="builds (or loads) a many-one index and serves it")
+    serve_parser.add_argument("strings", nargs="?", help="file of the strings to index, one per line")
+    serve_parser.add_argument("--index", help="many-one index saved by PrefixIndexing.save (candidates only, no verify)")
+    serve_parser.add_argument("-J", type=float, default=0.8)
+    serve_parser.add_argument("--indexing", choices=sorted(INDEXING_CLASSES), default="PrefixPositionLengthIndexing")
+    serve_parser.add_argument("--similarity", choices=sorted(SIMILARITIES), default="jaccard")
+    serve_parser.add_argument("--window", type=float, default=0.002, help="micro-batching window, in seconds")
+    serve_parser.add_argument("--max-batch", type=int, default=256)
+    load_parser = commands.add_parser("load", help="sends probe strings to a server, reports throughput and latency")
+    load_parser.add_argument("probes", help="file of the probe strings, one per line")
+    load_parser.add_argument("--requests", type=int, default=10000)
+    load_parser.add_argument("--connections", type=int, default=32)
+    load_parser.add_argument("-J", type=float, default=None)
+    load_parser.add_argument("--verify", action="store_true")
+    for command_parser in (serve_parser, load_parser):
+        command_parser.add_argument("--host", default="127.0.0.1")
+        command_parser.add_argument("--port", type=int, default=8765)
+        command_parser.add_argument("--unix", help="path of a Unix socket (instead of host and port)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if not (args.strings or args.index):
+            parser.error("serve needs a file of strings or --index")
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+    else:
+        report = asyncio.run(load_test(read_lines(args.probes), args.requests, args.connections, args.J, args.verify,
+                                       args.host, args.port, args.unix))
+        print(json.dumps(report, indent=1))
@@ -0,0 +1,58 @@
+"""
+the three algorithms of MMDS §3.9 "Methods for High Degrees of Similarity" (see README.md)
+
+the submodules are imported on first use of one of their names (PEP 562), so that "import simil" costs
+nothing and a short-lived process only loads what it uses (e.g. simil.indexing and simil.compact to query
+a saved index). NumPy, process pools and shared memory are only imported by the functions that use them.
+
+    tokens      ordering keys of the symbols, shingles, hashed shingles, packed pairs
+    compact     CompactIndex (CSR posting lists, saved and memory-mapped), bitmaps, lazy Candidates
+    records     RecordStore
+    stats       IndexStats, ProbeCache
+    similarity  Similarity measures and exact verification
+    indexing    PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing
+    pairs       PairBuffer (packed candidate pairs, sorted runs spilled to disk)
+    join        similarity joins (in memory, streamed, external, R-S)
+    parallel    shared memory records of make_many_to_many_index_parallel
+    debug       display of an index
+
+python -m simil runs a small command line tool (build, query, demo: see python -m simil -h)
+"""
+import importlib
+
+_MODULES = {
+    "tokens": ("pair", "encode_pair", "decode_pair", "order_symbol_1", "symbols", "id_and_symbols", "identity",
+                "shingles_n", "order_symbol_lex", "order_symbol_hash", "FrequencyOrder", "jaccard_sim", "order_to_json",
+                "order_from_json", "SHINGLE_SIZE", "shingles", "symbols_shingles", "string_to_symbols", "HASH_MASK",
+                "HASH_BASE", "HASH_MIX", "shingle_hash", "shingle_hashes"),
+    "compact": ("INDEX_MAGIC", "INDEX_VERSION", "CompactIndex", "BITMAP_DENSITY", "BYTE_BITS", "bitmap_of",
+                "bitmap_indices", "Candidates"),
+    "records": ("RecordStore",),
+    "stats": ("IndexStats", "ProbeCache", "index_histogram", "percentiles"),
+    "similarity": ("overlap", "required_overlap", "verified_sim", "Similarity", "Jaccard", "Cosine", "Dice", "Overlap",
+                   "WeightedJaccard", "JACCARD", "COSINE", "DICE", "OVERLAP", "SIMILARITIES", "similarity_of",
+                   "similarity_to_json", "similarity_from_json"),
+    "indexing": ("PrefixIndexing", "PrefixPositionIndexing", "PrefixPositionLengthIndexing", "INDEXING_CLASSES"),
+    "pairs": ("PAIR_BYTES", "sort_unique", "PairBuffer"),
+    "join": ("similarity_join", "stream_similarity_join", "spill_pairs", "load_pairs", "ExternalJoin",
+             "external_similarity_join", "RSJoin", "rs_join"),
+    "parallel": ("SharedRecords",),
+}
+
+#name -> submodule
+_EXPORTS = {name: module for module, names in _MODULES.items() for name in names}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
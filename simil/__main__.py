@@ -0,0 +1,103 @@
+"""
+command line tool of simil, e.g. for short-lived workers querying a saved index
+
+python -m simil build strings.txt index.bin -J 0.8   builds the many-one index of a file of strings (one per line,
+                                                     blank lines skipped) and saves it (see PrefixIndexing.save)
+python -m simil query index.bin "probe string" ...   candidates of the probe strings (of the lines of stdin if none),
+                                                     one JSON line per probe: {"s": ..., "candidates": [indx, ...]};
+                                                     with --strings (the file of the index), the verified
+                                                     {"s": ..., "matches": [[indx, sim], ...]}
+python -m simil demo                                 sample run
+
+only the modules that the command needs are imported (see simil/__init__.py)
+"""
+import argparse
+import json
+import sys
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def build(args):
+    from .indexing import INDEXING_CLASSES
+    from .tokens import FrequencyOrder, order_symbol_1
+
+    list_of_strings = read_lines(args.strings)
+    if args.order == "frequency":
+        order = FrequencyOrder(list_of_strings, shingle_size=args.shingle_size, shingle_hash=args.shingle_hash)
+    else:
+        order = order_symbol_1  #order_symbol_lex (or the hash value) with shingles, see PrefixIndexing
+    pi = INDEXING_CLASSES[args.indexing](list_of_strings, args.J, order=order, shingle_size=args.shingle_size,
+                                         shingle_hash=args.shingle_hash, similarity=args.similarity)
+    pi.make_many_to_one_index(compact=True)
+    pi.save(args.index)
+    print("{} strings, {} keys, {} postings: {}".format(len(list_of_strings), len(pi.ii), pi.ii.n_postings, args.index))
+
+
+def query(args):
+    from .indexing import PrefixIndexing
+
+    pi = PrefixIndexing.load(args.index)
+    if args.J is not None and args.J < pi.J:
+        args.parser.error("-J {} is below the threshold of the index, {}".format(args.J, pi.J))
+    probes = args.probes or (line.rstrip("\n") for line in sys.stdin if line.strip())
+    strings = read_lines(args.strings) if args.strings else None
+    J = pi.J if args.J is None else args.J
+    for s in probes:
+        if not pi.symbols_of(s):
+            args.parser.error("the probe {!r} has no symbols for this index (shorter than a shingle?)".format(s))
+        candidates = sorted(pi.candidate_pairs(s, args.J))
+        if strings is None:
+            print(json.dumps({"s": s, "candidates": candidates}))
+            continue
+        x = tuple(map(pi.order, pi.symbols_of(s)))
+        matches = []
+        for indx in candidates:
+            sim = pi.similarity.verified_sim(J, x, tuple(map(pi.order, pi.symbols_of(strings[indx]))))
+            if sim is not None:
+                matches.append([indx, sim])
+        print(json.dumps({"s": s, "matches": matches}))
+
+
+def demo(args):
+    from .demo import main
+    main()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m simil", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="builds the many-one index of a file of strings and saves it")
+    build_parser.add_argument("strings", help="file of the strings to index, one per line")
+    build_parser.add_argument("index", help="path of the saved index")
+    build_parser.add_argument("-J", type=float, default=0.8, help="threshold (of the similarity)")
+    build_parser.add_argument("--indexing", default="PrefixPositionLengthIndexing",
+                              choices=("PrefixIndexing", "PrefixPositionIndexing", "PrefixPositionLengthIndexing"))
+    build_parser.add_argument("--similarity", default="jaccard", choices=("jaccard", "cosine", "dice", "overlap"))
+    build_parser.add_argument("--order", default="frequency", choices=("frequency", "natural"),
+                              help="rarest symbols first (FrequencyOrder), or the natural order of the symbols")
+    build_parser.add_argument("--shingle-size", type=int, default=None, help="index the k-shingles of the strings")
+    build_parser.add_argument("--shingle-hash", action="store_true", help="index the 64-bit hashes of the shingles")
+    build_parser.set_defaults(run=build)
+
+    query_parser = commands.add_parser("query", help="candidates (or verified matches) of probe strings in a saved index")
+    query_parser.add_argument("index", help="index saved by build (or PrefixIndexing.save)")
+    query_parser.add_argument("probes", nargs="*", help="probe strings (the lines of stdin if none)")
+    query_parser.add_argument("-J", type=float, default=None, help="threshold, at least the one of the index")
+    query_parser.add_argument("--strings", help="file of the indexed strings, to verify the candidates")
+    query_parser.set_defaults(run=query, parser=query_parser)
+
+    demo_parser = commands.add_parser("demo", help="sample run")
+    demo_parser.set_defaults(run=demo)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
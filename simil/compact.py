@@ -0,0 +1,380 @@
+"""
+CompactIndex: posting lists in CSR layout, saved and memory-mapped; bitmaps and lazy Candidates
+"""
+import collections
+import collections.abc
+import json
+import math
+import mmap as _mmap
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+
+#file format of saved indexes (see CompactIndex.save)
+INDEX_MAGIC = b"SIMILIDX"
+INDEX_VERSION = 1
+
+
+class CompactIndex(collections.abc.Mapping):
+    """
+    read-only inverted index, drop-in replacement for the dict of sets 'ii'
+
+    keys are either symbols (PrefixIndexing) or tuples (symbol, i, ...) whose first item is a symbol.
+    Every symbol is mapped once to a dense token id t; the keys of token t occupy the slots
+    tok_offsets[t]:tok_offsets[t+1], sorted by their remaining components (stored column-wise
+    in 'subkeys'), and the posting list of slot k is postings[offsets[k]:offsets[k+1]] (CSR layout).
+    Posting lists are sorted and returned as zero-copy memoryviews.
+    """
+    def __init__(self, tokens, tok_offsets, subkeys, offsets, postings):
+        self.tokens = tokens  #token id -> symbol
+        self.token_ids = {symbol: t for t, symbol in enumerate(tokens)}
+        self.tok_offsets = tok_offsets
+        self.subkeys = subkeys
+        self.offsets = offsets
+        self.postings = memoryview(postings)
+        #slot -> bitmap of the dense posting lists (see make_bitmaps)
+        self.bitmaps = {}
+
+    @classmethod
+    def build(cls, make_items):
+        """
+        bulk construction in two passes over make_items(), which must yield (key, indx)
+        by increasing indx for each key: the first pass counts the postings of every key, the second one fills them in.
+        """
+        counts = {}
+        for key, _ in make_items():
+            counts[key] = counts.get(key, 0) + 1
+
+        arity = len(next(iter(counts))) - 1 if counts and isinstance(next(iter(counts)), tuple) else 0
+        split = (lambda key: (key[0], key[1:])) if arity else (lambda key: (key, ()))
+
+        tokens, token_ids = [], {}
+        encoded = []
+        for key in counts:
+            symbol, rest = split(key)
+            if symbol not in token_ids:
+                token_ids[symbol] = len(tokens)
+                tokens.append(symbol)
+            encoded.append(((token_ids[symbol],) + rest, key))
+        encoded.sort()
+
+        tok_offsets = array('Q', [0] * (len(tokens) + 1))
+        subkeys = tuple(array('I') for _ in range(arity))
+        for (t, *rest), _ in encoded:
+            tok_offsets[t + 1] += 1
+            for column, value in zip(subkeys, rest):
+                column.append(value)
+        tok_offsets = array('Q', accumulate(tok_offsets))
+
+        offsets = array('Q', [0])
+        offsets.extend(accumulate(counts[key] for _, key in encoded))
+        cursor = {key: offsets[k] for k, (_, key) in enumerate(encoded)}
+
+        postings = array('I', bytes(4 * offsets[-1]))
+        for key, indx in make_items():
+            postings[cursor[key]] = indx
+            cursor[key] += 1
+
+        return cls(tokens, tok_offsets, subkeys, offsets, postings)
+
+    @classmethod
+    def from_dict(cls, ii):
+        """
+        CompactIndex with the same content as a dict of sets
+        """
+        return cls.build(lambda: ((key, indx) for key, postings in ii.items() for indx in sorted(postings)))
+
+    def save(self, path, metadata):
+        """
+        versioned binary format:
+        magic, version (uint32), header size (uint32), JSON header (metadata, tokens, array layout),
+        then the arrays, 8-byte aligned
+        """
+        columns = [("tok_offsets", self.tok_offsets), ("offsets", self.offsets), ("postings", self.postings)]
+        columns += [("subkeys_{}".format(k), column) for k, column in enumerate(self.subkeys)]
+
+        layout, position = {}, 0
+        for name, column in columns:
+            view = memoryview(column)
+            layout[name] = (view.format, view.itemsize, position, len(view))
+            position += -(-view.nbytes // 8) * 8
+
+        header = json.dumps({"metadata": metadata, "tokens": self.tokens, "arity": len(self.subkeys),
+                             "byteorder": sys.byteorder, "arrays": layout}).encode("utf-8")
+        start = -(-(len(INDEX_MAGIC) + 8 + len(header)) // 8) * 8
+
+        with open(path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(array('I', [INDEX_VERSION, len(header)]).tobytes())
+            f.write(header)
+            for name, column in columns:
+                _, _, offset, _ = layout[name]
+                f.write(bytes(start + offset - f.tell()))
+                f.write(memoryview(column).cast('B'))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        returns (CompactIndex, metadata) from a file written by save
+        with mmap=True, the arrays are memory-mapped: nothing is copied, and processes loading the same file share its pages
+        """
+        with open(path, "rb") as f:
+            if mmap:
+                buffer = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+            else:
+                buffer = f.read()
+        view = memoryview(buffer)
+
+        if bytes(view[:len(INDEX_MAGIC)]) != INDEX_MAGIC:
+            raise ValueError("{} is not an index file".format(path))
+        version, header_size = view[len(INDEX_MAGIC):len(INDEX_MAGIC) + 8].cast('I')
+        if version != INDEX_VERSION:
+            raise ValueError("unsupported index format version {} (expected {})".format(version, INDEX_VERSION))
+        header_end = len(INDEX_MAGIC) + 8 + header_size
+        header = json.loads(bytes(view[len(INDEX_MAGIC) + 8:header_end]).decode("utf-8"))
+        start = -(-header_end // 8) * 8
+
+        columns = {}
+        for name, (typecode, itemsize, offset, length) in header["arrays"].items():
+            if array(typecode).itemsize != itemsize:
+                raise ValueError("array '{}' of {} has items of {} bytes".format(name, path, itemsize))
+            column = view[start + offset:start + offset + itemsize * length].cast(typecode)
+            if header["byteorder"] != sys.byteorder:
+                column = array(typecode, column)
+                column.byteswap()
+            columns[name] = column
+
+        subkeys = tuple(columns["subkeys_{}".format(k)] for k in range(header["arity"]))
+        index = cls(header["tokens"], columns["tok_offsets"], subkeys, columns["offsets"], columns["postings"])
+        return index, header["metadata"]
+
+    def slot(self, key):
+        """
+        position of key in the CSR arrays, None if key is not indexed
+        """
+        if self.subkeys:
+            if not isinstance(key, tuple) or len(key) != len(self.subkeys) + 1:
+                return None
+            symbol, rest = key[0], key[1:]
+        else:
+            symbol = key
+        t = self.token_ids.get(symbol)
+        if t is None:
+            return None
+        lo, hi = self.tok_offsets[t], self.tok_offsets[t + 1]
+        if not self.subkeys:
+            return lo
+        k = bisect_left(_SubKeys(self.subkeys), rest, lo, hi)
+        if k < hi and all(column[k] == value for column, value in zip(self.subkeys, rest)):
+            return k
+        return None
+
+    def subkeys_of(self, symbol):
+        """
+        sorted sequence of the (i, ...) such that (symbol, i, ...) is a key
+        """
+        t = self.token_ids.get(symbol)
+        if t is None:
+            return ()
+        return _SubKeys(self.subkeys, self.tok_offsets[t], self.tok_offsets[t + 1])
+
+    def __getitem__(self, key):
+        k = self.slot(key)
+        if k is None:
+            raise KeyError(key)
+        return self.postings[self.offsets[k]:self.offsets[k + 1]]
+
+    def make_bitmaps(self, density=None, n_bits=None):
+        """
+        copies every posting list of at least density * n_bits postings (n_bits: largest posting + 1 by default)
+        into a bitmap, a Python int whose bit indx is set for every indx of the list; union then unions
+        these bitmaps with a single | each (see union). With density >= 1/32, a bitmap is smaller than the posting list.
+        The CSR arrays are left as they are (and saved as they are): the bitmaps live in memory only.
+        """
+        density = BITMAP_DENSITY if density is None else density
+        n_bits = max(self.postings, default=-1) + 1 if n_bits is None else n_bits
+        min_length = max(1, math.ceil(density * n_bits))
+        offsets, postings = self.offsets, self.postings
+        self.bitmaps = {}
+        for k, (lo, hi) in enumerate(zip(offsets, offsets[1:])):
+            if hi - lo >= min_length:
+                self.bitmaps[k] = bitmap_of(postings[lo:hi], n_bits)
+        return len(self.bitmaps)
+
+    def union(self, keys):
+        """
+        union of the posting lists of keys, as Candidates: the bitmaps of the dense lists are or-ed together,
+        the other lists are kept as memoryviews
+        """
+        bits, lists = 0, []
+        bitmaps, offsets, postings = self.bitmaps, self.offsets, self.postings
+        for key in keys:
+            k = self.slot(key)
+            bitmap = bitmaps.get(k)
+            if bitmap is None:
+                lists.append(postings[offsets[k]:offsets[k + 1]])
+            else:
+                bits |= bitmap
+        return Candidates(bits, lists)
+
+    def __contains__(self, key):
+        return self.slot(key) is not None
+
+    def __iter__(self):
+        for t, symbol in enumerate(self.tokens):
+            for k in range(self.tok_offsets[t], self.tok_offsets[t + 1]):
+                yield (symbol,) + tuple(column[k] for column in self.subkeys) if self.subkeys else symbol
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_postings(self):
+        return len(self.postings)
+
+    @property
+    def nbytes(self):
+        """
+        size of the CSR arrays (the token dictionary is not included)
+        """
+        arrays = (self.tok_offsets, self.offsets, self.postings) + tuple(self.subkeys)
+        return sum(memoryview(a).nbytes for a in arrays)
+
+
+#posting lists with at least this fraction of the strings are copied into bitmaps (see CompactIndex.make_bitmaps)
+BITMAP_DENSITY = 1 / 32
+
+#positions of the set bits of every byte
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256))
+
+
+def bitmap_of(indices, n_bits):
+    """
+    Python int whose bit indx is set for every indx of indices (all < n_bits)
+    """
+    buffer = bytearray((n_bits + 7) // 8)
+    for indx in indices:
+        buffer[indx >> 3] |= 1 << (indx & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def bitmap_indices(bits):
+    """
+    sorted list of the positions of the set bits of a Python int (with NumPy when it is installed)
+    """
+    buffer = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    try:
+        import numpy as np
+    except ImportError:
+        return [8 * k + bit for k, byte in enumerate(buffer) if byte for bit in BYTE_BITS[byte]]
+    return np.flatnonzero(np.unpackbits(np.frombuffer(buffer, dtype=np.uint8), bitorder="little")).tolist()
+
+
+class Candidates(object):
+    """
+    lazy union of posting lists (see PrefixIndexing.candidates): a bitmap 'bits' (Python int) of the dense lists,
+    the other posting lists as they are (memoryviews of a CompactIndex, or sets), minus the indx in 'removed'.
+    Nothing is unioned before len, in, to_set or sorted; with NumPy (if installed) the union is a boolean mask,
+    so that len does not create a Python int per candidate; without it, only the bitmap is counted in place
+    """
+    __slots__ = ("bits", "lists", "removed")
+
+    def __init__(self, bits=0, lists=(), removed=()):
+        self.bits = bits
+        self.lists = list(lists)
+        self.removed = set(removed)
+
+    def update(self, indices):
+        self.lists.append(indices)
+
+    def discard_all(self, indices):
+        """
+        removes indices (e.g. tombstones) from the union
+        """
+        self.removed.update(indices)
+
+    def mask(self, np):
+        """
+        numpy boolean array, True at the indx of the union
+        """
+        arrays = [np.frombuffer(postings, dtype=np.uint32) if isinstance(postings, memoryview)
+                  else np.fromiter(postings, dtype=np.uint32, count=len(postings)) for postings in self.lists]
+        indices = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.uint32)
+        n_bits = max(self.bits.bit_length(), int(indices.max()) + 1 if len(indices) else 0, max(self.removed, default=-1) + 1)
+        if self.bits:
+            buffer = self.bits.to_bytes((n_bits + 7) // 8, "little")
+            mask = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8), count=n_bits, bitorder="little").view(bool)
+        else:
+            mask = np.zeros(n_bits, dtype=bool)
+        mask[indices] = True
+        if self.removed:
+            mask[np.fromiter(self.removed, dtype=np.int64, count=len(self.removed))] = False
+        return mask
+
+    def __len__(self):
+        try:
+            import numpy as np
+        except ImportError:
+            pass
+        else:
+            return int(np.count_nonzero(self.mask(np)))
+        sparse = set().union(*self.lists)
+        bits = self.bits
+        if self.removed:
+            sparse -= self.removed
+            bits &= ~bitmap_of(self.removed, max(self.removed) + 1)
+        if not bits:
+            return len(sparse)
+        buffer = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+        n_bytes = len(buffer)
+        return bin(bits).count("1") + sum(1 for indx in sparse if indx >> 3 >= n_bytes or not buffer[indx >> 3] >> (indx & 7) & 1)
+
+    def __contains__(self, indx):
+        if indx in self.removed:
+            return False
+        return bool(self.bits >> indx & 1) or any(indx in postings for postings in self.lists)
+
+    def __iter__(self):
+        return iter(self.sorted())
+
+    def sorted(self):
+        """
+        sorted list of the candidates
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            return sorted(self.to_set())
+        return np.flatnonzero(self.mask(np)).tolist()
+
+    def to_set(self):
+        try:
+            import numpy as np
+        except ImportError:
+            pass
+        else:
+            return set(np.flatnonzero(self.mask(np)).tolist())
+        candidates = set().union(*self.lists)
+        if self.bits:
+            candidates.update(bitmap_indices(self.bits))
+        return candidates - self.removed if self.removed else candidates
+
+
+class _SubKeys(object):
+    """
+    utility: row view over the subkey columns of a CompactIndex (rows lo:hi), for bisect
+    """
+    def __init__(self, columns, lo=0, hi=None):
+        self.columns = columns
+        self.lo = lo
+        self.hi = len(columns[0]) if hi is None else hi
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.hi - self.lo:
+            raise IndexError(k)
+        return tuple(column[self.lo + k] for column in self.columns)
+
+    def __len__(self):
+        return self.hi - self.lo
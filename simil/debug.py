@@ -0,0 +1,21 @@
+"""
+debugging helpers: printing an index (imported by PrefixIndexing.display only)
+"""
+import pprint
+
+
+def display(pi, display_strings=False):
+    """
+    prints the strings and the inverted index ii of pi (with the strings of the posting lists if display_strings)
+    """
+    print("inner list_of_strings:", pi.list_of_strings)
+    print("ii (indices):")
+
+    pp = pprint.PrettyPrinter(indent=2)
+    pp.pprint(pi.ii)
+
+    if display_strings:
+        print("\nii (strings):")
+        for k in pi.ii:
+            print("  {}: {}".format(k, set(map(pi.indx_to_string, pi.ii[k]))))
+        print()
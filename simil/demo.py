@@ -0,0 +1,87 @@
+"""
+sample run of the three indexing classes (python -m simil demo)
+"""
+from .indexing import PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing
+from .join import similarity_join
+
+
+def main():
+    print("\n+++ A) PrefixIndexing +++")
+    print("*** TESTING of the many-one problem ***")
+    list_of_strings = ["bcdefghij", "abcdefghij", "cdefghijklm", "aefghijkluvw"]
+    JACCARD_SIM_THRESHOLD = 0.9
+
+    pi = PrefixIndexing(list_of_strings, JACCARD_SIM_THRESHOLD)
+    pi.make_many_to_one_index()
+    #pi.display(display_strings=True)
+
+    for probe_string in ("aefghijklmno", "defghijklmno"):
+        print("candidate strings for '{}': {}".format(probe_string, pi.candidate_pairs(probe_string)))
+
+    print("*** TESTING of the many-many problem ***")
+    list_of_strings = ["bcdefghij", "abcdefghij", "abcdefghvwxyz", "cdefghijklm", "aefghijkluvw", "cdefghlmnopq"]
+    JACCARD_SIM_THRESHOLD = 0.9
+
+    pi2 = PrefixIndexing(list_of_strings, JACCARD_SIM_THRESHOLD)
+    cpmm = pi2.make_many_to_many_index()
+    print("candidate pairs (many-many):", cpmm)
+
+
+
+
+    print("\n+++ B) PrefixPositionIndexing +++")
+    print("*** TESTING of the many-one problem ***")
+    list_of_strings = ["bcdefghij", "abcdefghij", "cdefghijklm", "aefghijkluvw"]
+    JACCARD_SIM_THRESHOLD = 0.9
+    ppi = PrefixPositionIndexing(list_of_strings, JACCARD_SIM_THRESHOLD)
+
+    ppi.make_many_to_one_index()
+    #ppi.display()
+    #print("cp3:", ppi.candidate_pairs("acdefghijk"))
+    for probe_string in ("acdefghijk", "defghijklmno"):
+        print("candidate strings for '{}': {}".format(probe_string, ppi.candidate_pairs(probe_string)))
+
+
+    print("*** TESTING of the many-many problem ***")
+    #list_of_strings = ["bcdefghij", "abcdefghij", "cdefghijklm", "aefghijkluvw"]
+    #list_of_strings = ["bcdefghij", "abcdefghij", "ef", "cdefghijklm", "aefghijkluvw", "aefghijlmnopq"]
+    list_of_strings = ["bcdefghij", "cd", "abcdefghij", "bcdefghijmno", "cdefghijklm", "aefghijkluvw", "aefghijlmnopq"]
+
+    JACCARD_SIM_THRESHOLD = 0.9
+    ppi = PrefixPositionIndexing(list_of_strings, JACCARD_SIM_THRESHOLD)
+    cpmm = ppi.make_many_to_many_index()
+    #print("\n\n")
+    #ppi.display()
+    print("candidate pairs (many-many):", cpmm)
+
+
+
+
+
+    print("\n+++ C) PrefixPositionLengthIndexing +++")
+    print("*** TESTING of the many-one problem ***")
+    list_of_strings = ["bcdefghij", "cd", "abcdefghij", "bcdefghijmno"]
+    JACCARD_SIM_THRESHOLD = 0.8
+    ppli = PrefixPositionLengthIndexing(list_of_strings, JACCARD_SIM_THRESHOLD)
+    ppli.make_many_to_one_index()
+    #print("\n\n")
+    #ppli.display()
+    for probe_string in ("acdefghijk", "bcdefghijmno"):
+        print("candidate strings for '{}': {}".format(probe_string, ppli.candidate_pairs(probe_string)))
+
+    print("*** TESTING of the many-many problem ***")
+    list_of_strings = ["bcdefghij", "cd", "abcdefghij", "bcdefghijmno", "cdefghijklm", "aefghijkluvw", "aefghijlmnopq"]
+
+    JACCARD_SIM_THRESHOLD = 0.9
+    ppli = PrefixPositionLengthIndexing(list_of_strings, JACCARD_SIM_THRESHOLD)
+    cpmm = ppli.make_many_to_many_index()
+    #print("\n\n")
+    #ppi.display()
+    print("candidate pairs (many-many):", cpmm)
+
+
+    print("\n+++ D) similarity join +++")
+    print("similar pairs (many-many):", similarity_join(list_of_strings, JACCARD_SIM_THRESHOLD))
+
+
+    print("\n** THE END **\n")
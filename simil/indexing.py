@@ -0,0 +1,1030 @@
+"""
+the three indexing classes of MMDS 3.9: PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing
+"""
+import collections
+import heapq
+import math
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import count
+
+from .compact import BITMAP_DENSITY, Candidates, CompactIndex
+from .pairs import PairBuffer
+from .records import RecordStore
+from .similarity import similarity_from_json, similarity_of, similarity_to_json
+from .stats import IndexStats, ProbeCache, index_histogram
+from .tokens import SHINGLE_SIZE, identity, order_from_json, order_symbol_1, order_symbol_lex, order_to_json, shingle_hash, \
+    shingle_hashes, shingles_n, symbols
+
+
+class PrefixIndexing(object):
+    """
+    MMDS 3.9.4
+    """
+    EPS = 1e-3
+    #a compact index is rebuilt when the strings added or removed since its construction exceed this fraction of it
+    COMPACTION_RATIO = 0.2
+    def __init__(self, list_of_strings, J, order=order_symbol_1, shingle_size=None, shingle_hash=False, similarity=None):
+        """
+        with shingle_size=n, strings are represented by their sets of n-shingles (see MMDS 3.2) instead of their characters
+        with shingle_hash=True, shingles (of size SHINGLE_SIZE by default) are replaced by their 64-bit shingle_hash,
+        computed in bulk by shingle_hashes
+        with shingles, the default order (order_symbol_1, for characters) becomes the lexicographical order of the shingles
+        (order_symbol_lex), or the hash value of hashed shingles
+        'similarity' is the measure that J is a threshold of: a Similarity or a name of SIMILARITIES (Jaccard by default)
+        """
+        if shingle_hash:
+            shingle_size = shingle_size or SHINGLE_SIZE
+        if shingle_size and order is order_symbol_1:
+            order = identity if shingle_hash else order_symbol_lex
+        self.list_of_strings = None if list_of_strings is None else list(list_of_strings)
+        self.J = J
+        self.order = order
+        self.shingle_size = shingle_size
+        self.shingle_hash = shingle_hash
+        self.similarity = similarity_of(similarity).bind(order)
+
+        #strings are tokenized once and for all
+        self.records = None if list_of_strings is None else RecordStore(self.tokenize(self.list_of_strings), identity, self.prefix_length_of)
+
+        #indx of the removed strings (see remove)
+        self.deleted = set()
+        self.delta = None
+        self.tombstones = set()
+
+        #IndexStats, see enable_stats
+        self.stats = None
+        #ProbeCache, see enable_cache
+        self.cache = None
+        #bitmaps of the dense posting lists of a CompactIndex, see enable_bitmaps
+        self.bitmap_density = None
+
+        #indx -> ordering keys of the symbols of the record, computed once when verifying (see top_k)
+        self.order_keys = {}
+
+        self.mode = "not_set"
+
+    def prefix_length(self, s):
+        """
+        prefix length of string s, from its symbols (see symbols_of), not from len(s)
+        """
+        s_symbols = self.symbols_of(s)
+        assert s_symbols, "string {} has zero length !".format(s)
+        return self.prefix_length_of(s_symbols)
+
+    def prefix_length_of_size(self, size, J=None):
+        return self.similarity.prefix_length(self.J if J is None else J, size)
+
+    def prefix_length_of(self, s_symbols, J=None):
+        """
+        prefix length of the ordered symbols of a string (which depends on the symbols for a WeightedJaccard)
+        """
+        return self.similarity.prefix_length_of(self.J if J is None else J, s_symbols)
+
+    def prefix(self, s):
+        """
+        computes the prefix of the set that represents string s
+        depends on the chosen ordering
+        see MMDS §3.26 for details and example
+        """
+        return self.probe(s)[0]
+
+    def symbols_of(self, s):
+        """
+        ordered symbols of string s (or of its shingles)
+        """
+        if self.shingle_size:
+            s = shingles_n(s, self.shingle_size, hashfun=shingle_hash if self.shingle_hash else identity)
+        return symbols(s, order=self.order)
+
+    def tokenize(self, list_of_strings):
+        """
+        symbols_of every string of the list (hashed shingles are computed in bulk)
+        """
+        if not self.shingle_hash:
+            return list(map(self.symbols_of, list_of_strings))
+        list_of_symbols = shingle_hashes(list_of_strings, self.shingle_size)
+        if self.order is identity:
+            return list_of_symbols
+        return [tuple(sorted(s_symbols, key=self.order)) for s_symbols in list_of_symbols]
+
+    def probe(self, s, J=None):
+        """
+        (prefix, set size) of a string that is not in the record store
+        """
+        s_symbols = self.symbols_of(s)
+        assert s_symbols, "string {} has zero length !".format(s)
+        return self.probe_of_symbols(s_symbols, J)
+
+    def probe_of_symbols(self, s_symbols, J=None):
+        return s_symbols[:self.prefix_length_of(s_symbols, J)], len(s_symbols)
+
+    def index_keys(self, prefix, size):
+        """
+        keys under which a string with this prefix and this set size is stored in the inverted index
+        """
+        return prefix
+
+    def probe_keys(self, prefix, size, J=None):
+        """
+        keys of ii that have to be looked up for a string with this prefix and this set size
+        (for a threshold J >= self.J, see candidate_pairs)
+        """
+        return prefix & self.ii.keys()
+
+    def keys_at(self, i, symbol, size, J=None):
+        """
+        keys of ii to look up for the symbol at position i of the prefix of a string of this set size
+        """
+        return [symbol] if symbol in self.ii else []
+
+    def key_bound(self, i, key, size):
+        """
+        upper bound of the similarity between a string of this set size and the strings of the posting list of key,
+        when key matches the symbol at position i and no symbol before it (see top_k)
+        """
+        o = size - i + 1
+        return self.similarity.bound(o, size, o)
+
+    def top_k(self, s, k, J=None):
+        """
+        the k strings of the many-one index most similar to s, as (sim, indx) pairs by decreasing similarity
+        (then increasing indx). Exact among the strings whose similarity with s is >= J (by default the threshold
+        of the index, else J >= self.J): fewer than k pairs are returned if fewer strings reach J (none if k <= 0).
+
+        the symbols of the prefix of s are visited in order: a string first met at position i shares no symbol
+        before i with s, so that key_bound(i, key, size) bounds its similarity. Keys are visited by decreasing bound,
+        candidates are verified exactly with a threshold raised to the k-th best similarity so far,
+        and the search stops as soon as no bound can beat it.
+        """
+        assert self.mode == "many_to_one" and self.records is not None
+        s_symbols = self.symbols_of(s)
+        assert s_symbols, "string {} has zero length !".format(s)
+        size = len(s_symbols)
+        x = tuple(map(self.order, s_symbols))
+        records, EPS, similarity = self.records, self.EPS, self.similarity
+        order_keys = self.order_keys
+
+        heap = []  #(sim, -indx) of the best strings so far, worst first
+        seen = set(self.deleted)
+        if J is not None and J < self.J:
+            raise ValueError("the index is built for J >= {}".format(self.J))
+        threshold = self.J if J is None else J
+        if k <= 0:
+            return []
+        for i, symbol in enumerate(s_symbols[:self.prefix_length_of(s_symbols, threshold)], 1):
+            if similarity.bound(size - i + 1, size, size - i + 1) + EPS < threshold:
+                break
+            keys = [(self.key_bound(i, key, size), key, index) for index in (self, self.delta) if index is not None
+                    for key in index.keys_at(i, symbol, size, J)]
+            keys.sort(key=lambda item: -item[0])
+            for bound, key, index in keys:
+                if bound + EPS < threshold:
+                    break
+                for indx in index.ii[key]:
+                    if indx in seen:
+                        continue
+                    seen.add(indx)
+                    y = order_keys.get(indx)
+                    if y is None:
+                        y = order_keys[indx] = tuple(map(self.order, records.symbols[indx]))
+                    min_size, max_size = similarity.size_bounds(threshold, size)
+                    if not min_size <= len(y) <= max_size:
+                        continue
+                    sim = similarity.verified_sim(threshold, x, y)
+                    if sim is None:
+                        continue
+                    if len(heap) < k:
+                        heapq.heappush(heap, (sim, -indx))
+                    elif (sim, -indx) > heap[0]:
+                        heapq.heapreplace(heap, (sim, -indx))
+                    if len(heap) == k:
+                        threshold = max(threshold, heap[0][0])
+        return [(sim, -minus_indx) for sim, minus_indx in sorted(heap, key=lambda item: (-item[0], -item[1]))]
+
+    def index_items(self):
+        """
+        utility: (key, indx_s) for every entry of the many-one index, by increasing indx_s
+        """
+        records, deleted = self.records, self.deleted
+        for indx_s in range(len(records)):
+            if indx_s in deleted:
+                continue
+            for key in self.index_keys(records.prefix(indx_s), records.sizes[indx_s]):
+                yield key, indx_s
+
+    def make_many_to_one_index(self, compact=False):
+        """
+        see 1st paragraph, MMDS page 121.
+        with compact=True, ii is a CompactIndex (integer tokens, CSR posting lists) instead of a dict of sets
+        """
+        self.mode = "many_to_one"
+        start = time.perf_counter()
+        if self.cache is not None:
+            self.cache.clear()
+
+        if compact:
+            self.compact()
+        else:
+            self.clear_index()
+            for key, indx_s in self.index_items():
+                self.insert(key, indx_s)
+            self.delta = None
+            self.tombstones = set()
+
+        if self.stats is not None:
+            self.stats.timers["build"] += time.perf_counter() - start
+            self.stats.counters["builds"] += 1
+
+    def clear_index(self, length_sorted=False):
+        """
+        utility: starts a new, empty dict of sets ii
+        with length_sorted=True, posting lists are deques filled by increasing set size (see many_to_many_candidates)
+        """
+        self.ii = {}
+        self.length_sorted = length_sorted
+
+    def insert(self, key, indx_s):
+        """
+        utility: adds indx_s to the posting list of key in ii (dict of sets)
+        """
+        if self.length_sorted:
+            self.ii.setdefault(key, collections.deque()).append(indx_s)
+        else:
+            self.ii.setdefault(key, set()).add(indx_s)
+
+    def discard(self, key, indx_s):
+        """
+        utility: removes indx_s from the posting list of key in ii (dict of sets), and key if its list becomes empty
+        """
+        postings = self.ii[key]
+        postings.discard(indx_s)
+        if not postings:
+            del self.ii[key]
+
+    def compact(self):
+        """
+        (re)builds ii as a CompactIndex from the records that are not deleted
+        """
+        self.ii = CompactIndex.build(self.index_items)
+        self.n_compacted = len(self.records)
+        if self.bitmap_density is not None:
+            self.ii.make_bitmaps(self.bitmap_density, len(self.records))
+        #strings added since the build are indexed in delta, a dict of sets index of the same class
+        self.delta = type(self)(None, self.J, order=self.order, shingle_size=self.shingle_size, shingle_hash=self.shingle_hash,
+                                similarity=self.similarity)
+        self.delta.clear_index()
+        #strings removed since the build, still in the posting lists of ii
+        self.tombstones = set()
+
+    def add(self, s):
+        """
+        adds string s to the many-one index and returns its indx
+        only the posting lists of the keys of its prefix are touched: a dict of sets is updated in place,
+        a CompactIndex gets the new postings in its delta (see compact)
+        """
+        assert self.mode == "many_to_one" and self.records is not None
+        s_symbols = self.symbols_of(s)
+        assert s_symbols, "string {} has zero length !".format(s)
+        size = len(s_symbols)
+        prefix_length = self.prefix_length_of(s_symbols)
+
+        indx_s = self.records.append(s_symbols, prefix_length)
+        self.list_of_strings.append(s)
+        if self.cache is not None:
+            self.cache.clear()
+
+        target = self if self.delta is None else self.delta
+        for key in self.index_keys(s_symbols[:prefix_length], size):
+            target.insert(key, indx_s)
+        self.compact_if_needed()
+        return indx_s
+
+    def remove(self, indx_s):
+        """
+        removes string indx_s from the many-one index (indx are never reused)
+        a dict of sets is updated in place; in a CompactIndex, the string becomes a tombstone, filtered out
+        of the candidates until the next compaction
+        """
+        assert self.mode == "many_to_one" and self.records is not None
+        if not 0 <= indx_s < len(self.records) or indx_s in self.deleted:
+            raise KeyError(indx_s)
+        self.deleted.add(indx_s)
+        if self.cache is not None:
+            self.cache.clear()
+
+        if self.delta is not None and indx_s < self.n_compacted:
+            self.tombstones.add(indx_s)
+            self.compact_if_needed()
+            return
+
+        target = self if self.delta is None else self.delta
+        for key in self.index_keys(self.records.prefix(indx_s), self.records.sizes[indx_s]):
+            target.discard(key, indx_s)
+
+    def compact_if_needed(self):
+        if self.delta is not None:
+            n_changes = len(self.tombstones) + len(self.records) - self.n_compacted
+            if n_changes > self.COMPACTION_RATIO * self.n_compacted:
+                self.compact()
+
+    def candidate_pairs(self, s, J=None):
+        """
+        in the many-one problem, returns the candidate strings in the index that may match string s
+        requirement: the many-one index must have been computed first.
+
+        the index is built for self.J, but it can be probed for any J >= self.J: the prefix of s and the
+        position/suffix filters are then those of J, so that one index built for the lowest J serves all of them
+        """
+        assert self.mode == "many_to_one"
+        if J is not None and J < self.J:
+            raise ValueError("the index is built for J >= {}".format(self.J))
+        if self.cache is not None:
+            return self.cached_candidate_pairs(s, J)
+        if self.stats is not None:
+            return self.candidate_pairs_with_stats(s, J)
+        return self.candidates_of_probe(*self.probe(s, J), J)
+
+    def candidates_of_probe(self, prefix, size, J=None):
+        """
+        utility: candidate_pairs of a probe (prefix, set size)
+        """
+        cp_keys = self.probe_keys(prefix, size, J)
+
+        #for unittest
+        self.cp_keys = cp_keys
+
+        candidates = self.fusion_values(cp_keys)
+        if self.delta is not None:
+            candidates |= self.delta.fusion_values(self.delta.probe_keys(prefix, size, J))
+            candidates -= self.tombstones
+        return candidates
+
+    def candidates(self, s, J=None):
+        """
+        candidate_pairs of s as lazy Candidates, unioned only when they are counted (len) or listed (sorted, to_set);
+        with enable_bitmaps, the dense posting lists of a CompactIndex are unioned as bitmaps
+        """
+        assert self.mode == "many_to_one"
+        if J is not None and J < self.J:
+            raise ValueError("the index is built for J >= {}".format(self.J))
+        prefix, size = self.probe(s, J)
+        cp_keys = self.probe_keys(prefix, size, J)
+        if isinstance(self.ii, CompactIndex):
+            candidates = self.ii.union(cp_keys)
+        else:
+            candidates = Candidates(0, map(self.ii.__getitem__, cp_keys))
+        if self.delta is not None:
+            for key in self.delta.probe_keys(prefix, size, J):
+                candidates.update(self.delta.ii[key])
+            candidates.discard_all(self.tombstones)
+        return candidates
+
+    def enable_bitmaps(self, density=None):
+        """
+        copies the dense posting lists of the CompactIndex (make_many_to_one_index(compact=True), or load)
+        into bitmaps (see CompactIndex.make_bitmaps), also after every compaction; returns their number
+        """
+        assert self.mode == "many_to_one" and isinstance(self.ii, CompactIndex)
+        self.bitmap_density = BITMAP_DENSITY if density is None else density
+        return self.ii.make_bitmaps(self.bitmap_density, None if self.records is None else len(self.records))
+
+    def cached_candidate_pairs(self, s, J=None):
+        """
+        candidate_pairs through the ProbeCache (see enable_cache): a probe whose ordered symbols were seen
+        recently is answered without computing its keys nor merging its posting lists
+        """
+        cache_key = (self.symbols_of(s), self.J if J is None else J)
+        assert cache_key[0], "string {} has zero length !".format(s)
+        candidates = self.cache.get(cache_key)
+        if candidates is None:
+            if self.stats is not None:
+                candidates = self.candidate_pairs_with_stats(s, J)
+            else:
+                candidates = self.candidates_of_probe(*self.probe_of_symbols(cache_key[0], J), J)
+            candidates = frozenset(candidates)
+            self.cache.put(cache_key, candidates)
+        return set(candidates)
+
+    def candidate_pairs_with_stats(self, s, J=None):
+        """
+        candidate_pairs, timed phase by phase: tokenize (probe), probe_keys, fusion (see enable_stats)
+        """
+        stats = self.stats
+        counters, timers = stats.counters, stats.timers
+        t0 = time.perf_counter()
+        prefix, size = self.probe(s, J)
+        t1 = time.perf_counter()
+        cp_keys = self.probe_keys(prefix, size, J)
+        delta_keys = () if self.delta is None else self.delta.probe_keys(prefix, size, J)
+        t2 = time.perf_counter()
+        self.cp_keys = cp_keys
+        candidates = self.fusion_values(cp_keys)
+        if self.delta is not None:
+            candidates |= self.delta.fusion_values(delta_keys)
+            candidates -= self.tombstones
+        t3 = time.perf_counter()
+
+        timers["tokenize"] += t1 - t0
+        timers["probe_keys"] += t2 - t1
+        timers["fusion"] += t3 - t2
+        counters["probes"] += 1
+        counters["keys_generated"] += self.n_potential_keys(prefix, size, J)
+        counters["keys_hit"] += len(cp_keys) + len(delta_keys)
+        counters["candidates"] += len(candidates)
+        stats.add_postings(self.ii[key] for key in cp_keys)
+        if delta_keys:
+            stats.add_postings(self.delta.ii[key] for key in delta_keys)
+        return candidates
+
+    def n_potential_keys(self, prefix, size, J=None):
+        """
+        number of keys that a string with this prefix and this set size may match (hit or not)
+        """
+        return len(prefix)
+
+    def enable_stats(self, stats=None):
+        """
+        starts recording counters and timers in an IndexStats (a new one by default), returned
+        index build, candidate_pairs, candidate_pairs_batch and the many-many loop are instrumented;
+        when stats are disabled (self.stats is None), the cost is one test per call
+        """
+        self.stats = IndexStats() if stats is None else stats
+        return self.stats
+
+    def stats_report(self):
+        """
+        stats as a dict (ready for json.dumps), with the index_histogram of the many-one index
+        and the counters of the ProbeCache
+        """
+        report = self.stats.as_dict() if self.stats is not None else {}
+        if self.mode == "many_to_one":
+            report["index"] = index_histogram(self.ii)
+        if self.cache is not None:
+            report["cache"] = self.cache.as_dict()
+        return report
+
+    def enable_cache(self, max_entries=1024, max_candidates=None):
+        """
+        starts caching the candidates of candidate_pairs in a ProbeCache (LRU, at most max_entries probes
+        and/or max_candidates candidates in total), returned. The cache is cleared whenever the index changes
+        (make_many_to_one_index, add, remove). disable_cache() stops it
+        """
+        self.cache = ProbeCache(max_entries, max_candidates)
+        return self.cache
+
+    def disable_cache(self):
+        self.cache = None
+
+    def candidate_pairs_batch(self, probes, J=None, tokenized=False):
+        """
+        candidate_pairs (for J, see candidate_pairs) for a batch of probe strings, returned as two arrays in CSR layout:
+        the candidates of probes[k] are candidates[offsets[k]:offsets[k+1]], sorted
+        with tokenized=True, probes are the symbols_of the probe strings (e.g. from tokenize)
+
+        probes are tokenized first and grouped by (prefix, set size), so that probe keys are computed once
+        per distinct group; then groups are gathered by key, so that each posting list is read once per batch
+        """
+        assert self.mode == "many_to_one"
+        if J is not None and J < self.J:
+            raise ValueError("the index is built for J >= {}".format(self.J))
+        start = time.perf_counter()
+        group_of_probe = []
+        groups = {}  #(prefix, size) -> group number
+        probe = self.probe_of_symbols if tokenized else self.probe
+        for s in probes:
+            group_of_probe.append(groups.setdefault(probe(s, J), len(groups)))
+
+        postings_of_group = [[] for _ in range(len(groups))]
+        for index in (self, self.delta):
+            if index is None:
+                continue
+            groups_of_key = {}
+            for (prefix, size), g in groups.items():
+                for key in index.probe_keys(prefix, size, J):
+                    groups_of_key.setdefault(key, []).append(g)
+            ii = index.ii
+            for key, groups_with_key in groups_of_key.items():
+                postings = ii[key]
+                for g in groups_with_key:
+                    postings_of_group[g].append(postings)
+            if self.stats is not None:
+                self.stats.counters["batch_keys_hit"] += len(groups_of_key)
+                self.stats.add_postings(map(ii.__getitem__, groups_of_key))
+
+        sorted_candidates = [sorted(set().union(*postings).difference(self.tombstones) if self.tombstones else set().union(*postings))
+                             for postings in postings_of_group]
+        offsets = array('Q', [0])
+        candidates = array('I')
+        for g in group_of_probe:
+            candidates.extend(sorted_candidates[g])
+            offsets.append(len(candidates))
+
+        if self.stats is not None:
+            self.stats.timers["batch"] += time.perf_counter() - start
+            self.stats.counters["batch_probes"] += len(group_of_probe)
+            self.stats.counters["batch_groups"] += len(groups)
+            self.stats.counters["batch_candidates"] += len(candidates)
+        return offsets, candidates
+
+    def matches_batch(self, probes, J=None, tokenized=False):
+        """
+        candidate_pairs_batch, verified: for every probe string, the (indx, sim) of the strings of the index whose
+        similarity with it is >= J (by default the threshold of the index), by increasing indx
+        with tokenized=True, probes are the symbols_of the probe strings
+        requirement: the records of the strings (an index built from strings, not loaded)
+        """
+        assert self.records is not None, "verification needs the records of the indexed strings"
+        J = self.J if J is None else J
+        offsets, candidates = self.candidate_pairs_batch(probes, J, tokenized=tokenized)
+        records, order_keys = self.records, self.order_keys
+        matches = []
+        for k, s in enumerate(probes):
+            x = tuple(map(self.order, s if tokenized else self.symbols_of(s)))
+            s_matches = []
+            for indx in candidates[offsets[k]:offsets[k + 1]]:
+                y = order_keys.get(indx)
+                if y is None:
+                    y = order_keys[indx] = tuple(map(self.order, records.symbols[indx]))
+                sim = self.similarity.verified_sim(J, x, y)
+                if sim is not None:
+                    s_matches.append((indx, sim))
+            matches.append(s_matches)
+        return matches
+
+    def fusion_values(self, keys):
+        """
+        utility
+
+        if keys = [a,b]
+        ==> ii[a] U ii[b]
+        """
+        return set().union(*(self.ii[k] for k in keys))
+
+    def make_many_to_many_index(self, length_filter=False, count_filter=False, memory_budget=None, directory=None,
+                                count_only=False):
+        """
+        see 2nd paragraph, MMDS page 121.
+        each string is compared with the strings already in ii, then added to ii
+        see many_to_many_candidates for length_filter and count_filter
+
+        returns the set of candidate pairs (indx_s, indx_t), indx_s < indx_t; with a memory_budget (bytes), a PairBuffer
+        of the packed pairs instead, whose sorted runs are spilled to 'directory' beyond the budget;
+        with count_only=True, the number of candidate pairs only (a pair is found once, when its second string
+        is compared: nothing is kept)
+        """
+        self.mode = "many_to_many"
+
+        candidates = self.many_to_many_candidates(length_filter=length_filter, count_filter=count_filter)
+        if count_only:
+            return sum(len(c_for_s) for _, c_for_s in candidates)
+        if memory_budget is not None:
+            pairs = PairBuffer(memory_budget, directory)
+            for indx_s, c_for_s in candidates:
+                pairs.extend(indx_s, c_for_s)
+            return pairs
+        cp = set()  #candidate pairs
+        for indx_s, c_for_s in candidates:
+            cp.update([(indx_t, indx_s) if indx_t < indx_s else (indx_s, indx_t) for indx_t in c_for_s])
+
+        return cp
+
+    def many_to_many_candidates(self, shard=None, length_filter=False, count_filter=False):
+        """
+        utility: yields (indx_s, candidates for s among the strings processed before s)
+        if 'shard' is a set of symbols, only the keys of these symbols are added to ii: the candidate pairs
+        are then those that share a key of one of these symbols (see make_many_to_many_index_parallel)
+
+        with length_filter=True (as in AllPairs/PPJoin), strings are processed by increasing set size,
+        so that posting lists are sorted by size: since jaccard(s, t) >= J implies |t| >= J * |s| (see size_bounds),
+        the strings that are too short for s are dropped from the front of the lists, for good.
+        The similar pairs among the candidates are the same as without length filtering.
+
+        with count_filter=True (as in PPJoin), the candidates are counted instead of collected: see
+        many_to_many_count_loop (not with a shard)
+        """
+        self.clear_index(length_sorted=length_filter)
+
+        records = self.records
+        if length_filter:
+            order_of_strings = sorted(range(len(records)), key=records.sizes.__getitem__)
+        else:
+            order_of_strings = range(len(records))
+        if self.deleted:
+            order_of_strings = [indx_s for indx_s in order_of_strings if indx_s not in self.deleted]
+        if count_filter:
+            assert shard is None, "count_filter needs all the keys"
+            return self.many_to_many_count_loop(order_of_strings, length_filter=length_filter)
+        return self.many_to_many_loop(order_of_strings, shard=shard, length_filter=length_filter)
+
+    def stream_many_to_many(self, iterable):
+        """
+        many-many problem over an iterable of strings (e.g. the lines of a file), consumed lazily:
+        yields (indx_s, symbols of s, candidates for s among the strings before s), indx_s being the position
+        of s in the iterable. Only the index, the set sizes and the prefixes are kept in memory.
+        """
+        self.mode = "many_to_many"
+        self.list_of_strings = None
+        self.records = RecordStore.from_arrays([], array('I'), array('I'))
+        self.order_keys = {}
+        self.clear_index()
+
+        tokenized = []
+        def indices():
+            for s in iterable:
+                s_symbols = self.symbols_of(s)
+                assert s_symbols, "string {} has zero length !".format(s)
+                prefix_length = self.prefix_length_of(s_symbols)
+                tokenized.append(s_symbols)
+                yield self.records.append(s_symbols[:prefix_length], prefix_length, size=len(s_symbols))
+
+        for indx_s, c_for_s in self.many_to_many_loop(indices()):
+            yield indx_s, tokenized.pop(), c_for_s
+
+    def many_to_many_loop(self, order_of_strings, shard=None, length_filter=False):
+        """
+        utility: body of many_to_many_candidates, over the records of order_of_strings
+        """
+        records = self.records
+        stats = self.stats
+        for indx_s in order_of_strings:
+            sizes = records.sizes
+            prefix, size = records.prefix(indx_s), sizes[indx_s]
+
+            if stats is not None:
+                start = time.perf_counter()
+            cp_keys = self.probe_keys(prefix, size)
+            if length_filter:
+                min_size = self.similarity.size_bounds(self.J, size)[0]
+                for key in cp_keys:
+                    postings = self.ii[key]
+                    while postings and sizes[postings[0]] < min_size:
+                        postings.popleft()
+
+            c_for_s = self.fusion_values(cp_keys)
+            if stats is not None:
+                stats.timers["many_to_many"] += time.perf_counter() - start
+                stats.counters["many_to_many_strings"] += 1
+                stats.counters["many_to_many_keys_hit"] += len(cp_keys)
+                stats.counters["many_to_many_candidates"] += len(c_for_s)
+                stats.add_postings(self.ii[key] for key in cp_keys)
+            yield indx_s, c_for_s
+
+            for symbol, key in zip(prefix, self.index_keys(prefix, size)):
+                if shard is None or symbol in shard:
+                    self.insert(key, indx_s)
+
+    def many_to_many_count_loop(self, order_of_strings, length_filter=False):
+        """
+        utility: many_to_many_loop with overlap counting (PPJoin): the symbols of the prefix of s are visited
+        in order and, for every posting t of every key of the symbol, counts[t] is the number of symbols shared
+        so far, all of them before the current one in both prefixes (the symbols are sorted in the same order).
+        If the symbol is at position i in s and j in t, the overlap of s and t is at most
+        counts[t] + 1 + min(|s| - i, |t| - j): t is pruned, for good, as soon as this bound is below
+        the overlap required for J (required_overlap).
+
+        the bound needs every shared symbol of the prefixes to be counted, so all the keys of the symbol are
+        looked up, not only those that pass the filters of the class (probe_keys); the filters of the class
+        are then applied to the counts, through key_position. Yields (indx_s, {indx_t: overlap counted so far}).
+        """
+        self.clear_index(length_sorted=length_filter)
+        records = self.records
+        sizes = records.sizes
+        stats = self.stats
+        ii, J = self.ii, self.J
+        size_bounds, required_overlap = self.similarity.size_bounds, self.similarity.required_overlap
+        keys_of_symbol = {}  #symbol -> keys of ii for this symbol
+        counts = [0] * len(records)  #counter array, reset after each string (-1: pruned)
+        for indx_s in order_of_strings:
+            prefix, size = records.prefix(indx_s), sizes[indx_s]
+            if stats is not None:
+                start = time.perf_counter()
+            touched = []
+            n_keys = 0
+            min_size = size_bounds(J, size)[0]
+            for i, symbol in enumerate(prefix, 1):
+                rest_s = size - i
+                for key in keys_of_symbol.get(symbol, ()):
+                    j = self.key_position(key)
+                    postings = ii[key]
+                    if length_filter:
+                        while postings and sizes[postings[0]] < min_size:
+                            postings.popleft()
+                    n_keys += 1
+                    for indx_t in postings:
+                        o = counts[indx_t]
+                        if o < 0:
+                            continue
+                        if not o:
+                            touched.append(indx_t)
+                        size_t = sizes[indx_t]
+                        rest_t = size_t - (o + 1 if j is None else j)
+                        if o + 1 + min(rest_s, rest_t) < required_overlap(J, size, size_t):
+                            counts[indx_t] = -1
+                        else:
+                            counts[indx_t] = o + 1
+
+            c_for_s = {}
+            for indx_t in touched:
+                if counts[indx_t] > 0:
+                    c_for_s[indx_t] = counts[indx_t]
+                counts[indx_t] = 0
+            if stats is not None:
+                stats.timers["many_to_many"] += time.perf_counter() - start
+                stats.counters["many_to_many_strings"] += 1
+                stats.counters["many_to_many_keys_hit"] += n_keys
+                stats.counters["many_to_many_candidates"] += len(c_for_s)
+                stats.counters["many_to_many_pruned"] += len(touched) - len(c_for_s)
+            yield indx_s, c_for_s
+
+            for symbol, key in zip(prefix, self.index_keys(prefix, size)):
+                if key not in ii:
+                    keys_of_symbol.setdefault(symbol, []).append(key)
+                self.insert(key, indx_s)
+
+    def key_position(self, key):
+        """
+        position of the symbol of key in the prefix of the indexed strings, None if the key does not tell
+        (the symbol is then at position o + 1 at least, when o symbols before it are shared, see many_to_many_count_loop)
+        """
+        return None
+
+    def make_many_to_many_index_parallel(self, workers=None, shards_per_worker=4, length_filter=False, memory_budget=None,
+                                         directory=None, count_only=False):
+        """
+        same candidate pairs as make_many_to_many_index, returned as a set, computed by a pool of processes
+
+        every candidate pair comes from one key, hence from one symbol: symbols are split into shards
+        (balanced on the size of their posting lists) and each worker runs the many-many loop with the keys
+        of one shard only. The prefixes are shared through shared memory as integer tokens, ranked
+        in the order of self.order; pairs are deduplicated when merging the shards (in a PairBuffer,
+        returned as it is with a memory_budget; with count_only=True, only the number of distinct pairs is returned).
+        ii is not kept.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from .parallel import SharedRecords, _many_to_many_shard
+        self.mode = "many_to_many"
+
+        workers = workers or os.cpu_count()
+        shared = SharedRecords.create(self.records, self.order)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_many_to_many_shard, type(self), self.J, shared.name, shard, length_filter, self.similarity)
+                           for shard in shared.shards(shards_per_worker * workers)]
+                pairs = PairBuffer(memory_budget, directory)
+                for future in futures:
+                    codes = array('Q', future.result())
+                    if self.deleted:
+                        codes = [code for code in codes if not {code >> 32, code & 0xFFFFFFFF} & self.deleted]
+                    pairs.extend_codes(codes)
+        finally:
+            shared.unlink()
+        if count_only:
+            with pairs:
+                return pairs.count()
+        if memory_budget is not None:
+            return pairs
+        return set(pairs)
+
+    def indx_to_string(self, indx):
+        return self.list_of_strings[indx]
+
+    def display(self, display_strings=False):
+        """
+        prints the index (see simil.debug)
+        """
+        from .debug import display
+        display(self, display_strings=display_strings)
+
+    def save(self, path):
+        """
+        saves the many-one index, with J, the similarity, the ordering and the shingling options (see CompactIndex.save)
+        """
+        assert self.mode == "many_to_one"
+        if self.delta is not None and (self.tombstones or len(self.records) > self.n_compacted):
+            self.compact()
+        ii = self.ii if isinstance(self.ii, CompactIndex) else CompactIndex.from_dict(self.ii)
+        ii.save(path, {"class": type(self).__name__, "J": self.J, "order": order_to_json(self.order),
+                       "shingle_size": self.shingle_size, "shingle_hash": self.shingle_hash,
+                       "similarity": similarity_to_json(self.similarity)})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        many-one index saved by save(path), ready for candidate_pairs: ii is a CompactIndex, memory-mapped
+        if mmap=True. The class is the one of the saved index (which must be cls or a subclass of cls).
+        """
+        ii, metadata = CompactIndex.load(path, mmap=mmap)
+        indexing = INDEXING_CLASSES.get(metadata["class"])
+        if indexing is None or not issubclass(indexing, cls):
+            raise ValueError("{} is an index of class {}, not {}".format(path, metadata["class"], cls.__name__))
+
+        pi = indexing(None, metadata["J"], order=order_from_json(metadata["order"]), shingle_size=metadata["shingle_size"],
+                      shingle_hash=metadata["shingle_hash"], similarity=similarity_from_json(metadata.get("similarity", {"name": "jaccard"})))
+        pi.ii = ii
+        pi.mode = "many_to_one"
+        return pi
+
+
+class PrefixPositionIndexing(PrefixIndexing):
+    """
+    MMDS 3.9.5
+    """
+    def __init__(self, list_of_strings, J, order=order_symbol_1, shingle_size=None, shingle_hash=False, similarity=None):
+        super().__init__(list_of_strings, J, order=order, shingle_size=shingle_size, shingle_hash=shingle_hash, similarity=similarity)
+        #(ii, largest position of its keys), see max_position
+        self.positions = None
+
+    def index_keys(self, prefix, size):
+        return [(symbol, i) for i, symbol in enumerate(prefix, 1)]
+
+    def insert(self, key, indx_s):
+        super().insert(key, indx_s)
+        if self.positions is not None and key[1] > self.positions[1]:
+            self.positions = (self.positions[0], key[1])
+
+    def max_j(self, i, size, J=None):
+        j = self.similarity.max_j(self.J if J is None else J, i, size)
+        if j == math.inf:
+            #no set is too large for a match (Overlap): positions are bounded by the keys of ii
+            return self.max_position()
+        return j
+
+    def max_position(self):
+        """
+        largest position of the keys of ii, computed once per ii (then kept up to date by insert)
+        """
+        if self.positions is None or self.positions[0] is not self.ii:
+            self.positions = (self.ii, max((key[1] for key in self.ii), default=0))
+        return self.positions[1]
+
+    def n_potential_keys(self, prefix, size, J=None):
+        return sum(self.max_j(i, size, J) for i in range(1, len(prefix) + 1))
+
+    def probe_keys(self, prefix, size, J=None):
+        cp_keys = set()
+        for i, symbol in enumerate(prefix, 1):
+            potential_keys = [(symbol, j) for j in range(1, self.max_j(i, size, J) + 1)]
+            cp_keys |= potential_keys & self.ii.keys()
+        return cp_keys
+
+    def keys_at(self, i, symbol, size, J=None):
+        return [(symbol, j) for j in range(1, self.max_j(i, size, J) + 1) if (symbol, j) in self.ii]
+
+    def key_bound(self, i, key, size):
+        o = size - i + 1
+        return self.similarity.bound(o, size, key[1] - 1 + o)
+
+    def key_position(self, key):
+        return key[1]
+
+    def candidate_pairs(self, s, J=None):
+        """
+        in the many-one problem, returns the candidate strings in the index that may match string s
+        requirement: the many-one index must have been computed first.
+        """
+        #no need to sort but better for reading
+        return sorted(super().candidate_pairs(s, J))
+
+    def make_many_to_many_index(self, length_filter=False, count_filter=False, memory_budget=None, directory=None,
+                                count_only=False):
+        """
+        see 2nd paragraph, MMDS page 121.
+        """
+        cp = super().make_many_to_many_index(length_filter=length_filter, count_filter=count_filter,
+                                             memory_budget=memory_budget, directory=directory, count_only=count_only)
+        #no need to sort but better for reading (a PairBuffer is iterated in order)
+        return sorted(cp) if isinstance(cp, set) else cp
+
+
+class PrefixPositionLengthIndexing(PrefixIndexing):
+    """
+    3.9.6
+    """
+    def __init__(self, list_of_strings, J, order=order_symbol_1, shingle_size=None, shingle_hash=False, similarity=None):
+        super().__init__(list_of_strings, J, order=order, shingle_size=shingle_size, shingle_hash=shingle_hash, similarity=similarity)
+        self.symbol_keys = None
+
+    def index_keys(self, prefix, size):
+        return [(symbol, i, size - i) for i, symbol in enumerate(prefix, 1)]
+
+    def make_many_to_one_index(self, compact=False):
+        self.symbol_keys = None
+        super().make_many_to_one_index(compact=compact)
+
+    def clear_index(self, length_sorted=False):
+        super().clear_index(length_sorted=length_sorted)
+        #symbol -> sorted list of the (j, q) such that (symbol, j, q) is a key of ii (dict of sets only)
+        self.symbol_keys = {}
+
+    def insert(self, key, indx_s):
+        if key not in self.ii:
+            insort(self.symbol_keys.setdefault(key[0], []), key[1:])
+        super().insert(key, indx_s)
+
+    def discard(self, key, indx_s):
+        super().discard(key, indx_s)
+        if key not in self.ii:
+            subkeys = self.symbol_keys[key[0]]
+            del subkeys[bisect_left(subkeys, key[1:])]
+
+    def subkeys_of(self, symbol):
+        """
+        sorted sequence of the (j, q) such that (symbol, j, q) is a key of ii
+        """
+        if self.symbol_keys is None:
+            return self.ii.subkeys_of(symbol)
+        return self.symbol_keys.get(symbol, ())
+
+    def q_range(self, i, j, size, J=None):
+        """
+        range [q_min, q_max] of the suffix lengths q such that the key (symbol, j, q) may match
+        the symbol at position i of a string of set size 'size' (empty if q_min > q_max), see Similarity.q_range
+        """
+        return self.similarity.q_range(self.J if J is None else J, i, j, size)
+
+    def min_suffix(self, j, J):
+        """
+        smallest suffix length q such that position j is in the prefix, for J, of a string of set size j + q
+        """
+        return self.similarity.min_suffix(J, j)
+
+    def n_potential_keys(self, prefix, size, J=None):
+        """
+        when the q ranges are unbounded (e.g. Overlap), the keys of ii of the symbol in the ranges are counted instead
+        """
+        n = 0
+        for i, symbol in enumerate(prefix, 1):
+            for j in count(1):
+                q_min, q_max = self.q_range(i, j, size, J)
+                if q_min > q_max:
+                    break
+                if q_max == math.inf:
+                    for key_j, key_q in self.subkeys_of(symbol):
+                        if key_j >= j:
+                            q_min, q_max = self.q_range(i, key_j, size, J)
+                            n += q_min <= key_q <= q_max
+                    break
+                n += q_max - q_min + 1
+        return n
+
+    def probe_keys(self, prefix, size, J=None):
+        """
+        walks, for every symbol of the prefix, the sorted (j, q) of this symbol in ii:
+        only the valid q ranges are visited, and the walk stops at the first j without any valid q
+        (the ranges shrink when j grows)
+        for J > self.J, the keys (symbol, j, q) whose position j is beyond the prefix, for J, of the indexed
+        string (of set size j + q) are skipped as well
+        """
+        cp_keys = set()
+        for i, symbol in enumerate(prefix, 1):
+            cp_keys.update(self.keys_at(i, symbol, size, J))
+        return cp_keys
+
+    def keys_at(self, i, symbol, size, J=None):
+        keys = []
+        subkeys = self.subkeys_of(symbol)
+        k, n = 0, len(subkeys)
+        t = self.J if J is None else J
+        q_range, min_suffix = self.similarity.q_range, self.similarity.min_suffix
+        while k < n:
+            j = subkeys[k][0]
+            q_min, q_max = q_range(t, i, j, size)
+            if t > self.J:
+                q_min = max(q_min, min_suffix(t, j))
+            if q_min > q_max:
+                break
+            lo = bisect_left(subkeys, (j, q_min), k)
+            hi = bisect_right(subkeys, (j, q_max), lo)
+            keys.extend((symbol,) + tuple(subkeys[m]) for m in range(lo, hi))
+            k = bisect_left(subkeys, (j + 1,), hi)
+        return keys
+
+    def key_bound(self, i, key, size):
+        _, j, q = key
+        o = 1 + min(size - i, q)
+        return self.similarity.bound(o, size, j + q)
+
+    def key_position(self, key):
+        return key[1]
+
+    def candidate_pairs(self, s, J=None):
+        """
+        in the many-one problem, returns the candidate strings in the index that may match string s
+        requirement: the many-one index must have been computed first.
+        """
+        return sorted(super().candidate_pairs(s, J)) #no need to sort but better for reading
+
+    def make_many_to_many_index(self, return_sorted=False, length_filter=False, count_filter=False, memory_budget=None,
+                                directory=None, count_only=False):
+        """
+        see 2nd paragraph, MMDS page 121.
+        """
+        cp = super().make_many_to_many_index(length_filter=length_filter, count_filter=count_filter,
+                                             memory_budget=memory_budget, directory=directory, count_only=count_only)
+        return sorted(cp) if return_sorted and isinstance(cp, set) else cp
+
+
+INDEXING_CLASSES = {cls.__name__: cls for cls in (PrefixIndexing, PrefixPositionIndexing, PrefixPositionLengthIndexing)}
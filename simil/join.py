@@ -0,0 +1,490 @@
+"""
+similarity joins: in memory, streamed, out of core (ExternalJoin) and between two collections (RSJoin)
+"""
+import collections
+import mmap as _mmap
+import os
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, islice, repeat
+
+from .indexing import PrefixIndexing, PrefixPositionLengthIndexing
+from .pairs import PairBuffer
+from .records import RecordStore
+from .tokens import decode_pair, identity, order_symbol_1
+
+
+def similarity_join(list_of_strings, J, indexing=PrefixPositionLengthIndexing, order=order_symbol_1, length_filter=True,
+                    count_filter=False, similarity=None):
+    """
+    all pairs of strings whose (set) Jaccard similarity (or 'similarity', see Similarity) is >= J,
+    as sorted (indx_s, indx_t, sim) triples with indx_s < indx_t
+    candidates are given by the many-many index of class 'indexing' (see many_to_many_candidates for the filters),
+    then verified exactly with 'overlap'
+    """
+    pi = indexing(list_of_strings, J, order=order, similarity=similarity)
+    cp = pi.make_many_to_many_index(length_filter=length_filter, count_filter=count_filter)
+    keys = [tuple(map(order, record)) for record in pi.records.symbols]
+    verified_sim = pi.similarity.verified_sim
+
+    result = []
+    for indx_s, indx_t in cp:
+        sim = verified_sim(J, keys[indx_s], keys[indx_t])
+        if sim is not None:
+            result.append((indx_s, indx_t, sim))
+    return sorted(result)
+
+
+def stream_similarity_join(iterable, J, indexing=PrefixPositionLengthIndexing, order=order_symbol_1, verify=True,
+                           similarity=None):
+    """
+    similarity join over an iterable of strings (e.g. the lines of a file), consumed lazily:
+    yields the candidate pairs (indx_t, indx_s) with indx_t < indx_s (positions in the iterable) as soon as s is read,
+    or, with verify=True, the (indx_t, indx_s, sim) triples of similarity_join.
+    Pairs are not kept: memory holds the index (and the ordering keys of the strings to verify the candidates).
+    See spill_pairs to write the pairs to disk.
+    """
+    pi = indexing(None, J, order=order, similarity=similarity)
+    verified_sim = pi.similarity.verified_sim
+    keys = []
+    for indx_s, s_symbols, c_for_s in pi.stream_many_to_many(iterable):
+        if not verify:
+            for indx_t in sorted(c_for_s):
+                yield indx_t, indx_s
+            continue
+
+        x = tuple(map(order, s_symbols))
+        keys.append(x)
+        for indx_t in sorted(c_for_s):
+            sim = verified_sim(J, keys[indx_t], x)
+            if sim is not None:
+                yield indx_t, indx_s, sim
+
+
+def spill_pairs(pairs, directory, chunk_size=1 << 20):
+    """
+    writes the (indx_s, indx_t) pairs or (indx_s, indx_t, sim) triples of the iterable 'pairs' to files of at most
+    chunk_size items in 'directory', so that memory holds one chunk at most. Returns the paths of the files.
+    File layout: number of items and has_sims flag (2 uint64), packed pairs (uint64, see encode_pair), sims (double).
+    """
+    paths = []
+    codes, sims = array('Q'), array('d')
+    def flush():
+        path = os.path.join(directory, "pairs_{:06d}.bin".format(len(paths)))
+        with open(path, "wb") as f:
+            f.write(array('Q', [len(codes), len(sims) > 0]).tobytes())
+            f.write(codes.tobytes())
+            f.write(sims.tobytes())
+        paths.append(path)
+        del codes[:], sims[:]
+
+    for item in pairs:
+        codes.append((item[0] << 32) | item[1])
+        if len(item) > 2:
+            sims.append(item[2])
+        if len(codes) == chunk_size:
+            flush()
+    if codes:
+        flush()
+    return paths
+
+
+def load_pairs(paths):
+    """
+    yields the items written by spill_pairs, in the same order
+    """
+    for path in paths:
+        with open(path, "rb") as f:
+            n, has_sims = array('Q', f.read(16))
+            codes = array('Q', f.read(8 * n))
+            sims = array('d', f.read(8 * n)) if has_sims else None
+        for k, code in enumerate(codes):
+            if sims is None:
+                yield decode_pair(code)
+            else:
+                yield decode_pair(code) + (sims[k],)
+
+
+class ExternalJoin(object):
+    """
+    out-of-core many-many join (see external_similarity_join), for corpora whose index does not fit in memory.
+    All files are written in 'directory':
+    1. tokenize: the strings are read once; their symbols are written as integer ids (first-seen order)
+       with their set sizes; only the vocabulary (symbol -> id) stays in memory
+    2. rank: ids are replaced by their rank in the order of the symbols and every record is sorted,
+       so that records are increasing tuples of ranks ('tokens', memory-mapped from then on);
+       the prefix lengths are computed and the number of prefixes containing each rank is counted
+    3. partition: the ranks are cut into ranges holding at most max_postings prefix postings each
+       (memory_budget / BYTES_PER_POSTING; a rank with more postings gets a range of its own), and every
+       record is written to the shard of each range its prefix meets, with its whole prefix
+    4. shards are joined one after the other: the many-many loop of 'indexing' only indexes the keys of the
+       symbols of the range, so that every candidate pair comes out of the shards of the symbols of its keys
+       (as in make_many_to_many_index_parallel). Pairs go to a PairBuffer of memory_budget bytes, which writes
+       sorted runs of packed pairs to 'directory'
+    5. the runs are merged (heapq.merge), deduplicated and verified against the tokens
+    'report' counts the shards, runs, pairs and bytes written and read
+    """
+    #estimated memory of one posting of a shard index (set entry, int, record prefix share)
+    BYTES_PER_POSTING = 150
+
+    def __init__(self, J, directory, memory_budget=1 << 28, indexing=PrefixPositionLengthIndexing, order=order_symbol_1,
+                 length_filter=True, similarity=None):
+        self.J = J
+        self.directory = directory
+        self.indexing = indexing
+        self.order = order
+        self.length_filter = length_filter
+        self.tokenizer = indexing(None, J, order=order, similarity=similarity)
+        #the similarity of the records of ranks (see rank)
+        self.similarity = self.tokenizer.similarity
+        self.max_postings = max(1, memory_budget // self.BYTES_PER_POSTING)
+        self.pairs = PairBuffer(memory_budget, directory)
+        self.report = collections.Counter()
+        self.maps = []
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, f, column):
+        data = memoryview(column).cast('B')
+        f.write(data)
+        self.report["bytes_written"] += data.nbytes
+
+    def mapped(self, name, typecode):
+        """
+        memory-mapped array of file 'name' (an empty array for an empty file)
+        """
+        size = os.path.getsize(self.path(name))
+        self.report["bytes_read"] += size
+        if not size:
+            return array(typecode)
+        with open(self.path(name), "rb") as f:
+            buffer = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        self.maps.append(buffer)
+        return memoryview(buffer).cast(typecode)
+
+    def tokenize(self, iterable, chunk_size=1 << 16):
+        vocabulary = {}
+        ids, sizes = array('I'), array('I')
+        with open(self.path("ids"), "wb") as f_ids, open(self.path("sizes"), "wb") as f_sizes:
+            for s in iterable:
+                s_symbols = self.tokenizer.symbols_of(s)
+                assert s_symbols, "string {} has zero length !".format(s)
+                for symbol in s_symbols:
+                    ids.append(vocabulary.setdefault(symbol, len(vocabulary)))
+                sizes.append(len(s_symbols))
+                if len(ids) >= chunk_size:
+                    self.write(f_ids, ids)
+                    del ids[:]
+                if len(sizes) >= chunk_size:
+                    self.write(f_sizes, sizes)
+                    del sizes[:]
+            self.write(f_ids, ids)
+            self.write(f_sizes, sizes)
+        self.vocabulary = vocabulary
+
+    def rank(self, chunk_size=1 << 16):
+        ranked = sorted(self.vocabulary, key=lambda symbol: self.order(symbol))
+        rank_of_id = array('I', bytes(4 * len(ranked)))
+        for rank, symbol in enumerate(ranked):
+            rank_of_id[self.vocabulary[symbol]] = rank
+        self.similarity = self.tokenizer.similarity.for_ranks(ranked)
+        del self.vocabulary, ranked
+
+        ids, self.sizes = self.mapped("ids", 'I'), self.mapped("sizes", 'I')
+        self.offsets = array('Q', [0])
+        self.offsets.extend(accumulate(self.sizes))
+        self.df = array('Q', bytes(8 * len(rank_of_id)))
+        self.prefix_lengths = array('I')
+        prefix_length_of, J = self.similarity.prefix_length_of, self.J
+        tokens = array('I')
+        with open(self.path("tokens"), "wb") as f:
+            for indx in range(len(self.sizes)):
+                record = sorted(rank_of_id[k] for k in ids[self.offsets[indx]:self.offsets[indx + 1]])
+                self.prefix_lengths.append(prefix_length_of(J, record))
+                for rank in record[:self.prefix_lengths[-1]]:
+                    self.df[rank] += 1
+                tokens.extend(record)
+                if len(tokens) >= chunk_size:
+                    self.write(f, tokens)
+                    del tokens[:]
+            self.write(f, tokens)
+        ids.release()
+        self.tokens = self.mapped("tokens", 'I')
+
+    def partition(self):
+        """
+        returns the (lo, hi) rank ranges of the shards, and writes the records of each shard:
+        indx, size, prefix length, prefix ranks (uint32)
+        """
+        ranges, lo, load = [], 0, 0
+        for rank, n in enumerate(self.df):
+            if load and load + n > self.max_postings:
+                ranges.append((lo, rank))
+                lo, load = rank, 0
+            load += n
+        if load:
+            ranges.append((lo, len(self.df)))
+
+        bounds = [hi for _, hi in ranges]
+        files = [open(self.path("shard_{:06d}".format(k)), "wb") for k in range(len(ranges))]
+        buffers = [array('I') for _ in ranges]
+        try:
+            for indx, size in enumerate(self.sizes):
+                start = self.offsets[indx]
+                prefix_length = self.prefix_lengths[indx]
+                prefix = self.tokens[start:start + prefix_length]
+                #the prefix is increasing: its shards are those of its ranks, in order
+                for k in sorted({bisect_right(bounds, rank) for rank in prefix}):
+                    buffer = buffers[k]
+                    buffer.extend((indx, size, prefix_length))
+                    buffer.extend(prefix)
+                    if len(buffer) >= 1 << 16:
+                        self.write(files[k], buffer)
+                        del buffer[:]
+            for f, buffer in zip(files, buffers):
+                self.write(f, buffer)
+        finally:
+            for f in files:
+                f.close()
+        self.report["shards"] = len(ranges)
+        return ranges
+
+    def join_shard(self, k, lo, hi):
+        """
+        adds the candidate pairs of shard k (ranks lo:hi) to self.pairs
+        """
+        column = self.mapped("shard_{:06d}".format(k), 'I')
+        indx_of, sizes, prefix_lengths, prefixes = array('I'), array('I'), array('I'), []
+        position = 0
+        while position < len(column):
+            indx, size, prefix_length = column[position:position + 3]
+            indx_of.append(indx)
+            sizes.append(size)
+            prefix_lengths.append(prefix_length)
+            prefixes.append(tuple(column[position + 3:position + 3 + prefix_length]))
+            position += 3 + prefix_length
+        column.release()
+
+        pi = self.indexing(None, self.J, order=identity, similarity=self.similarity)
+        pi.records = RecordStore.from_arrays(prefixes, sizes, prefix_lengths)
+        for local_s, c_for_s in pi.many_to_many_candidates(shard=range(lo, hi), length_filter=self.length_filter):
+            self.pairs.extend(indx_of[local_s], [indx_of[local_t] for local_t in c_for_s])
+
+    def run(self, iterable, verify=True):
+        """
+        yields the pairs of make_many_to_many_index (verify=False), or the triples of similarity_join,
+        sorted by (indx_s, indx_t)
+        """
+        try:
+            self.tokenize(iterable)
+            self.rank()
+            for k, (lo, hi) in enumerate(self.partition()):
+                self.join_shard(k, lo, hi)
+            tokens, offsets, J = self.tokens, self.offsets, self.J
+            verified_sim = self.similarity.verified_sim
+            x, last_s = None, None
+            for indx_s, indx_t in self.pairs:
+                self.report["candidates"] += 1
+                if not verify:
+                    yield indx_s, indx_t
+                    continue
+                if indx_s != last_s:
+                    x, last_s = tuple(tokens[offsets[indx_s]:offsets[indx_s + 1]]), indx_s
+                sim = verified_sim(J, x, tuple(tokens[offsets[indx_t]:offsets[indx_t + 1]]))
+                if sim is not None:
+                    self.report["pairs"] += 1
+                    yield indx_s, indx_t, sim
+        finally:
+            self.close()
+
+    def close(self):
+        for name in ("sizes", "tokens"):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        self.sizes = self.tokens = None
+        for buffer in self.maps:
+            try:
+                buffer.close()
+            except BufferError:
+                pass
+        self.maps = []
+        #the runs of pairs are counted with the other files
+        self.report.update(self.pairs.report)
+        self.pairs.close()
+        self.pairs.report.clear()
+
+
+def external_similarity_join(iterable, J, directory, memory_budget=1 << 28, indexing=PrefixPositionLengthIndexing,
+                             order=order_symbol_1, verify=True, length_filter=True, report=None, similarity=None):
+    """
+    similarity join of an iterable of strings (e.g. the lines of a file) with bounded memory: the records,
+    the shards of the index and the candidate pairs go through files of 'directory' (see ExternalJoin),
+    and every shard index holds about memory_budget bytes at most.
+    yields the same pairs as similarity_join (or make_many_to_many_index with verify=False), sorted.
+    If 'report' is a dict, it receives the counters of the join (shards, runs, bytes_written, bytes_read...)
+    """
+    join = ExternalJoin(J, directory, memory_budget=memory_budget, indexing=indexing, order=order, length_filter=length_filter,
+                        similarity=similarity)
+    try:
+        yield from join.run(iterable, verify=verify)
+    finally:
+        if report is not None:
+            report.update(join.report)
+
+
+class RSJoin(object):
+    """
+    R-S join: the strings of R are indexed once (a many-one index of class 'indexing'), then the strings of S are
+    streamed through it in batches: every batch is tokenized at once, sorted by set size, probed with
+    candidate_pairs_batch (the filters of the class, each posting list read once per batch) and verified
+    against the ordering keys of R (kept in two arrays, CSR layout)
+    """
+    def __init__(self, R, J, indexing=PrefixPositionLengthIndexing, order=order_symbol_1, compact=True, **options):
+        self.J = J
+        self.pi = indexing(R, J, order=order, **options)
+        self.pi.make_many_to_one_index(compact=compact)
+        records = self.pi.records
+        self.key_offsets = array('Q', [0])
+        self.key_offsets.extend(accumulate(records.sizes))
+        order = self.pi.order
+        keys = [key for s_symbols in records.symbols for key in map(order, s_symbols)]
+        typecode = self.typecode(keys)
+        self.keys = keys if typecode is None else array(typecode, keys)
+
+    @staticmethod
+    def typecode(keys):
+        """
+        typecode of an array able to hold the integer keys, None if they are not all integers of 64 bits at most
+        """
+        if not all(isinstance(key, int) for key in keys):
+            return None
+        lo, hi = min(keys, default=0), max(keys, default=0)
+        if -(1 << 63) <= lo and hi < 1 << 63:
+            return 'q'
+        if 0 <= lo and hi < 1 << 64:
+            return 'Q'
+        return None
+
+    def join_batch(self, batch, J=None, verify=True):
+        """
+        (indx_r, indx_s, sim) triples (or (indx_r, indx_s) pairs without verify) of a batch of (indx_s, s),
+        by increasing set size of s, then indx_r
+        """
+        J = self.J if J is None else J
+        pi, keys, key_offsets = self.pi, self.keys, self.key_offsets
+        size_bounds, verified_sim = pi.similarity.size_bounds, pi.similarity.verified_sim
+        tokenized = pi.tokenize([s for _, s in batch])
+        by_size = sorted(range(len(batch)), key=lambda k: len(tokenized[k]))
+        probes = [tokenized[k] for k in by_size]
+        assert all(probes), "strings of zero length !"
+        offsets, candidates = pi.candidate_pairs_batch(probes, J, tokenized=True)
+
+        result = []
+        for n, k in enumerate(by_size):
+            indx_s = batch[k][0]
+            if not verify:
+                result.extend(zip(candidates[offsets[n]:offsets[n + 1]], repeat(indx_s)))
+                continue
+            x = tuple(map(pi.order, probes[n]))
+            size = len(x)
+            min_size, max_size = size_bounds(J, size)
+            for indx_r in candidates[offsets[n]:offsets[n + 1]]:
+                lo, hi = key_offsets[indx_r], key_offsets[indx_r + 1]
+                if not min_size <= hi - lo <= max_size:
+                    continue
+                sim = verified_sim(J, x, keys[lo:hi])
+                if sim is not None:
+                    result.append((indx_r, indx_s, sim))
+        return result
+
+    def save(self, directory):
+        """
+        writes the index (see PrefixIndexing.save) and the keys of R in directory, for load
+        """
+        typecode = self.typecode(self.keys) if not isinstance(self.keys, array) else self.keys.typecode
+        if typecode is None:
+            raise ValueError("the ordering keys must be integers of 64 bits at most to be saved")
+        self.pi.save(os.path.join(directory, "index.bin"))
+        with open(os.path.join(directory, "keys.bin"), "wb") as f:
+            f.write(array('Q', [len(self.key_offsets) - 1, ord(typecode)]).tobytes())
+            f.write(self.key_offsets.tobytes())
+            f.write(array(typecode, self.keys).tobytes())
+
+    @classmethod
+    def load(cls, directory, J=None):
+        """
+        RSJoin saved by save: the index and the keys are memory-mapped, shared by the processes that load them
+        """
+        join = cls.__new__(cls)
+        join.pi = PrefixIndexing.load(os.path.join(directory, "index.bin"))
+        join.J = join.pi.J if J is None else J
+        with open(os.path.join(directory, "keys.bin"), "rb") as f:
+            buffer = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        n, typecode = view[:16].cast('Q')
+        join.key_offsets = view[16:16 + 8 * (n + 1)].cast('Q')
+        join.keys = view[16 + 8 * (n + 1):].cast(chr(typecode))
+        return join
+
+    def run(self, S, J=None, verify=True, batch_size=1024, workers=1, directory=None):
+        """
+        yields the results of join_batch for the batches of batch_size strings of the iterable S, as soon as
+        they are done. With workers > 1, batches are joined by a pool of processes which load the index
+        and the keys from 'directory' (see save; a temporary directory by default), at most 2 batches per
+        process at a time; results come in the order of the batches
+        """
+        def batches():
+            items = enumerate(S)
+            while True:
+                batch = list(islice(items, batch_size))
+                if not batch:
+                    return
+                yield batch
+
+        if workers <= 1:
+            for batch in batches():
+                yield from self.join_batch(batch, J, verify)
+            return
+
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+        with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+            self.save(tmpdir)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_rs_join_init, initargs=(tmpdir,)) as executor:
+                pending = collections.deque()
+                for batch in batches():
+                    pending.append(executor.submit(_rs_join_batch, batch, J, verify))
+                    if len(pending) >= 2 * workers:
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+
+
+_rs_join = None
+
+def _rs_join_init(directory):
+    global _rs_join
+    _rs_join = RSJoin.load(directory)
+
+def _rs_join_batch(batch, J, verify):
+    return _rs_join.join_batch(batch, J, verify)
+
+
+def rs_join(R, S, J, indexing=PrefixPositionLengthIndexing, order=order_symbol_1, verify=True, batch_size=1024,
+            workers=1, index_smaller=True, **options):
+    """
+    similarity join between two collections of strings: yields the (indx_r, indx_s, sim) triples such that
+    jaccard(R[indx_r], S[indx_s]) >= J (or the 'similarity' of options, see Similarity; or the candidate
+    (indx_r, indx_s) pairs without verify), batch by batch.
+    R is indexed (see RSJoin) and S is streamed: S may be any iterable (e.g. the lines of a file).
+    With index_smaller=True, if both have a len and S is the smaller one, S is indexed and R is streamed instead
+    (less memory, more probes). See RSJoin.run for batch_size and workers
+    """
+    swap = index_smaller and hasattr(R, "__len__") and hasattr(S, "__len__") and len(S) < len(R)
+    if swap:
+        R, S = S, R
+    join = RSJoin(R, J, indexing=indexing, order=order, **options)
+    for item in join.run(S, verify=verify, batch_size=batch_size, workers=workers):
+        yield (item[1], item[0]) + item[2:] if swap else item
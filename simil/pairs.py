@@ -0,0 +1,185 @@
+"""
+candidate pairs packed in 64-bit integers, deduplicated by sorting, spilled to disk beyond a memory budget (PairBuffer)
+"""
+import collections
+import heapq
+import os
+from array import array
+
+#bytes of a packed pair
+PAIR_BYTES = 8
+#sorted chunks merged in memory beyond this number, to keep the merge of the iteration narrow
+MAX_CHUNKS = 8
+
+
+def sort_unique(arrays):
+    """
+    sorted array('Q') of the distinct codes of a list of arrays of codes (sorted by NumPy when it is installed)
+    """
+    arrays = [codes for codes in arrays if len(codes)]
+    try:
+        import numpy as np
+    except ImportError:
+        return array('Q', sorted(set().union(*arrays)))
+    unique = array('Q')
+    if arrays:
+        codes = np.concatenate([np.frombuffer(codes, dtype=np.uint64) for codes in arrays])
+        codes.sort()
+        #not np.unique, which may hash instead of sorting
+        unique.frombytes(memoryview(codes[np.concatenate(([True], codes[1:] != codes[:-1]))]).cast("B"))
+    return unique
+
+
+class PairBuffer(object):
+    """
+    set of (indx_s, indx_t) pairs, indx_s < indx_t, packed as 64-bit integers (see encode_pair): 8 bytes
+    per pair instead of ~100 in a set of tuples.
+    Pairs are appended to an array('Q'); every chunk_size pairs, it is sorted and deduplicated into a sorted chunk
+    (see sort_unique). With a memory_budget (bytes), the chunks are merged into a sorted run written to 'directory'
+    (a temporary directory by default) as soon as they would take more than a quarter of it (sorting takes copies).
+    Iterating merges the chunks and the runs (heapq.merge): pairs come out sorted and distinct.
+    'report' counts the pairs added, the chunks, the runs and the bytes written and read
+    """
+
+    def __init__(self, memory_budget=None, directory=None, chunk_size=1 << 20):
+        self.memory_budget = memory_budget
+        if memory_budget is not None:
+            chunk_size = max(1, min(chunk_size, memory_budget // (8 * PAIR_BYTES)))
+        self.chunk_size = chunk_size
+        self.directory = directory
+        self.temporary = None
+        self.codes = array('Q')
+        self.chunks = []
+        self.runs = []
+        self.report = collections.Counter()
+
+    def add(self, indx_s, indx_t):
+        self.codes.append((indx_s << 32) | indx_t if indx_s < indx_t else (indx_t << 32) | indx_s)
+        if len(self.codes) >= self.chunk_size:
+            self.sort_chunk()
+
+    def extend(self, indx_s, candidates):
+        """
+        adds the pairs of indx_s with each of the candidates
+        """
+        high = indx_s << 32
+        self.codes.extend([high | indx_t if indx_s < indx_t else (indx_t << 32) | indx_s for indx_t in candidates])
+        if len(self.codes) >= self.chunk_size:
+            self.sort_chunk()
+
+    def extend_codes(self, codes):
+        """
+        adds packed pairs (e.g. an array('Q') of encode_pair)
+        """
+        self.codes.extend(codes)
+        if len(self.codes) >= self.chunk_size:
+            self.sort_chunk()
+
+    def sort_chunk(self):
+        """
+        sorts and deduplicates the pairs added since the last chunk
+        """
+        if not self.codes:
+            return
+        self.report["pairs_added"] += len(self.codes)
+        self.report["chunks"] += 1
+        self.chunks.append(sort_unique([self.codes]))
+        self.codes = array('Q')
+        if self.memory_budget is not None and PAIR_BYTES * (sum(map(len, self.chunks)) + self.chunk_size) > self.memory_budget // 4:
+            self.spill()
+        elif len(self.chunks) > MAX_CHUNKS:
+            self.chunks = [sort_unique(self.chunks)]
+
+    def spill(self):
+        """
+        writes the merged chunks to a new run
+        """
+        if self.directory is None:
+            import tempfile
+            self.temporary = tempfile.TemporaryDirectory()
+            self.directory = self.temporary.name
+        path = os.path.join(self.directory, "pair_run_{:06d}.bin".format(len(self.runs)))
+        codes = sort_unique(self.chunks)
+        self.chunks = []
+        with open(path, "wb") as f:
+            codes.tofile(f)
+        self.runs.append(path)
+        self.report["runs"] += 1
+        self.report["bytes_written"] += PAIR_BYTES * len(codes)
+
+    def read_run(self, path, block_size=1 << 16):
+        with open(path, "rb") as f:
+            while True:
+                codes = array('Q')
+                try:
+                    codes.fromfile(f, block_size)
+                except EOFError:
+                    pass  #the last block is shorter
+                if not codes:
+                    return
+                self.report["bytes_read"] += PAIR_BYTES * len(codes)
+                yield from codes
+
+    def sorted_codes(self):
+        """
+        sorted distinct codes of all the pairs
+        """
+        self.sort_chunk()
+        if len(self.chunks) > 1 and self.memory_budget is None:
+            self.chunks = [sort_unique(self.chunks)]
+        #the blocks read from the runs share a quarter of the budget
+        block_size = 1 << 16 if self.memory_budget is None else max(1, self.memory_budget // (4 * PAIR_BYTES * max(1, len(self.runs))))
+        sources = [self.read_run(path, block_size) for path in self.runs] + self.chunks
+        if len(sources) == 1:
+            yield from sources[0]
+            return
+        last = None
+        for code in heapq.merge(*sources):
+            if code != last:
+                last = code
+                yield code
+
+    def __iter__(self):
+        #decode_pair, inlined
+        for code in self.sorted_codes():
+            yield code >> 32, code & 0xFFFFFFFF
+
+    def count(self):
+        """
+        number of distinct pairs (a pass over the runs, if any; not __len__, which list() would call before iterating)
+        """
+        self.sort_chunk()
+        if self.runs or len(self.chunks) > 1 and self.memory_budget is not None:
+            return sum(1 for _ in self.sorted_codes())
+        if len(self.chunks) > 1:
+            self.chunks = [sort_unique(self.chunks)]
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def to_set(self):
+        return set(self)
+
+    @property
+    def nbytes(self):
+        """
+        memory of the pairs (the runs on disk excluded)
+        """
+        return PAIR_BYTES * (len(self.codes) + sum(map(len, self.chunks)))
+
+    def close(self):
+        """
+        removes the runs
+        """
+        for path in self.runs:
+            os.remove(path)
+        self.runs = []
+        self.chunks = []
+        self.codes = array('Q')
+        if self.temporary is not None:
+            self.temporary.cleanup()
+            self.temporary = self.directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
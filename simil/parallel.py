@@ -0,0 +1,97 @@
+"""
+shared memory records for the worker processes of make_many_to_many_index_parallel
+"""
+import collections
+import heapq
+from array import array
+from itertools import accumulate, repeat
+from multiprocessing.shared_memory import SharedMemory
+
+from .records import RecordStore
+from .tokens import encode_pair, identity
+
+
+class SharedRecords(object):
+    """
+    prefixes and set sizes of a RecordStore in a shared memory block, for worker processes
+
+    symbols are replaced by integer tokens ranked in the order of the store, so that workers can use
+    the identity as ordering. Layout: prefix offsets (n+1, uint64), sizes (n, uint32), prefix tokens (uint32)
+    """
+    def __init__(self, name):
+        self.shm = SharedMemory(name=name)
+        self.name = self.shm.name
+        self.n, self.n_tokens, self.n_prefix_tokens = self.shm.buf[:24].cast('Q').tolist()
+        offsets_end = 24 + 8 * (self.n + 1)
+        sizes_end = offsets_end + 4 * self.n
+        self.offsets = self.shm.buf[24:offsets_end].cast('Q')
+        self.sizes = self.shm.buf[offsets_end:sizes_end].cast('I')
+        self.tokens = self.shm.buf[sizes_end:sizes_end + 4 * self.n_prefix_tokens].cast('I')
+
+    @classmethod
+    def create(cls, records, order):
+        ranked = sorted({symbol for indx in range(len(records)) for symbol in records.prefix(indx)}, key=order)
+        token_ids = {symbol: t for t, symbol in enumerate(ranked)}
+
+        tokens = array('I', (token_ids[symbol] for indx in range(len(records)) for symbol in records.prefix(indx)))
+        offsets = array('Q', [0])
+        offsets.extend(accumulate(records.prefix_lengths))
+        header = array('Q', [len(records), len(ranked), len(tokens)])
+
+        chunks = [header, offsets, records.sizes, tokens]
+        size = sum(memoryview(chunk).nbytes for chunk in chunks)
+        shm = SharedMemory(create=True, size=max(size, 1))
+        position = 0
+        for chunk in chunks:
+            chunk = memoryview(chunk).cast('B')
+            shm.buf[position:position + chunk.nbytes] = chunk
+            position += chunk.nbytes
+        name = shm.name
+        shm.close()
+        return cls(name)
+
+    def records(self):
+        """
+        RecordStore whose symbols are the (token) prefixes only
+        """
+        offsets, tokens = self.offsets, self.tokens
+        prefixes = [tuple(tokens[offsets[k]:offsets[k + 1]]) for k in range(self.n)]
+        return RecordStore.from_arrays(prefixes, array('I', self.sizes), array('I', map(len, prefixes)))
+
+    def shards(self, n_shards):
+        """
+        token sets of n_shards shards, greedily balanced on the number of prefixes containing each token
+        """
+        df = collections.Counter(self.tokens)
+        heap = [(0, k, set()) for k in range(min(n_shards, max(len(df), 1)))]
+        for token, n in df.most_common():
+            load, k, shard = heapq.heappop(heap)
+            shard.add(token)
+            heapq.heappush(heap, (load + n, k, shard))
+        return [shard for _, _, shard in sorted(heap, key=lambda item: item[1]) if shard]
+
+    def close(self):
+        self.offsets.release()
+        self.sizes.release()
+        self.tokens.release()
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+
+def _many_to_many_shard(indexing, J, name, shard, length_filter, similarity=None):
+    """
+    worker of make_many_to_many_index_parallel: packed candidate pairs (array('Q') bytes) of one shard
+    """
+    shared = SharedRecords(name)
+    try:
+        pi = indexing(None, J, order=identity, similarity=similarity)
+        pi.records = shared.records()
+        cp = array('Q')
+        for indx_s, c_for_s in pi.many_to_many_candidates(shard=shard, length_filter=length_filter):
+            cp.extend(map(encode_pair, repeat(indx_s), c_for_s))
+        return cp.tobytes()
+    finally:
+        shared.close()
@@ -0,0 +1,55 @@
+"""
+RecordStore: the tokenized strings of an index
+"""
+from array import array
+from itertools import chain, repeat
+
+
+class RecordStore(object):
+    """
+    list of strings converted once (see MMDS 3.9.2) into parallel read-only arrays:
+    symbols[k] is the ordered tuple of symbols of string k, sizes[k] its set size
+    and prefix_lengths[k] the length of its prefix (prefix_length of the symbols)
+    """
+    __slots__ = ("symbols", "sizes", "prefix_lengths", "_columns")
+
+    def __init__(self, list_of_strings, to_symbols, prefix_length):
+        self.symbols = list(map(to_symbols, list_of_strings))
+        self.sizes = memoryview(array('I', map(len, self.symbols))).toreadonly()
+        self.prefix_lengths = memoryview(array('I', map(prefix_length, self.symbols))).toreadonly()
+        self._columns = None
+
+    @classmethod
+    def from_arrays(cls, symbols, sizes, prefix_lengths):
+        """
+        store of already tokenized strings: 'symbols' may be truncated to the prefixes
+        """
+        records = cls.__new__(cls)
+        records.symbols = list(symbols)
+        records.sizes = memoryview(sizes).toreadonly()
+        records.prefix_lengths = memoryview(prefix_lengths).toreadonly()
+        records._columns = None
+        return records
+
+    def append(self, s_symbols, prefix_length, size=None):
+        """
+        adds a tokenized string and returns its indx ('size' is the set size if s_symbols is truncated to the prefix)
+        sizes and prefix_lengths are views over arrays with spare room, reallocated by doubling (amortized O(1)):
+        views taken before stay valid, they just do not see the new string
+        """
+        indx = len(self.symbols)
+        if self._columns is None or len(self._columns[0]) == indx:
+            room = max(indx, 16)
+            self._columns = (array('I', chain(self.sizes, repeat(0, room))), array('I', chain(self.prefix_lengths, repeat(0, room))))
+        sizes, prefix_lengths = self._columns
+        sizes[indx], prefix_lengths[indx] = len(s_symbols) if size is None else size, prefix_length
+        self.symbols.append(s_symbols)
+        self.sizes = memoryview(sizes)[:indx + 1].toreadonly()
+        self.prefix_lengths = memoryview(prefix_lengths)[:indx + 1].toreadonly()
+        return indx
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def prefix(self, indx):
+        return self.symbols[indx][:self.prefix_lengths[indx]]
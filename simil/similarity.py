@@ -0,0 +1,477 @@
+"""
+similarity measures (Jaccard by default) and exact verification of candidate pairs
+"""
+import functools
+import math
+
+from .tokens import identity
+
+
+def overlap(x, y, required):
+    """
+    size of the intersection of x and y, two tuples of ordering keys sorted in increasing order
+    merge-based; stops as soon as 'required' can no longer be reached,
+    in which case the returned value is < required but not the exact overlap
+    """
+    i, j, o = 0, 0, 0
+    len_x, len_y = len(x), len(y)
+    while i < len_x and j < len_y:
+        if o + min(len_x - i, len_y - j) < required:
+            break
+        if x[i] == y[j]:
+            o += 1
+            i += 1
+            j += 1
+        elif x[i] < y[j]:
+            i += 1
+        else:
+            j += 1
+    return o
+
+
+def required_overlap(J, len_x, len_y):
+    """
+    jaccard(x, y) >= J  <=>  |x & y| >= J / (1 + J) * (|x| + |y|)
+    (rounded down by EPS, the exact test is done on the similarity itself)
+    """
+    return math.ceil(J / (1 + J) * (len_x + len_y) - Similarity.EPS)
+
+
+def verified_sim(J, x, y):
+    """
+    Jaccard similarity of x and y (tuples of ordering keys sorted in increasing order) if it is >= J, None otherwise
+    """
+    o = overlap(x, y, required_overlap(J, len(x), len(y)))
+    sim = float(o) / (len(x) + len(y) - o)
+    return sim if sim >= J else None
+
+
+def cached_method(maxsize):
+    """
+    caches the results of a method in its instance (functools.lru_cache on a method would share one cache
+    between all the instances and keep them alive); the cache is emptied when it holds maxsize results
+    """
+    def decorator(method):
+        attribute = "_cache_" + method.__name__
+
+        @functools.wraps(method)
+        def cached(self, *args):
+            cache = self.__dict__.get(attribute)
+            if cache is None:
+                cache = self.__dict__[attribute] = {}
+            elif args in cache:
+                return cache[args]
+            if len(cache) >= maxsize:
+                cache.clear()
+            result = cache[args] = method(self, *args)
+            return result
+        return cached
+    return decorator
+
+
+class Similarity(object):
+    """
+    similarity measure of two sets, with the bounds that prefix filtering needs: for a threshold t and sets
+    of sizes len_x and len_y, a subclass gives
+    sim(o, len_x, len_y): similarity of two sets sharing o symbols
+    required_overlap(t, len_x, len_y): smallest o such that sim(o, len_x, len_y) >= t (rounded down by EPS)
+    size_bounds(t, size): (min, max) size of the sets that may reach t with a set of this size
+    min_overlap(t, size): lower bound of required_overlap(t, size, len_y) for the sizes len_y within size_bounds
+
+    the prefix length (MMDS 3.9.3), the positions of PrefixPositionIndexing (max_j) and the suffix lengths
+    of PrefixPositionLengthIndexing (q_range) are derived from them numerically (and cached), unless a subclass
+    gives closed forms (see Jaccard).
+    Everything holds as long as sim grows with o, and required_overlap grows by at most 1 when len_y grows by 1
+    within size_bounds (true for the measures below).
+    """
+    EPS = 1e-3
+    name = None
+    #thresholds are at most MAX_THRESHOLD (a number of symbols for Overlap)
+    MAX_THRESHOLD = 1
+
+    def sim(self, o, len_x, len_y):
+        raise NotImplementedError
+
+    def bound(self, o, len_x, len_y):
+        """
+        upper bound of the similarity of two sets of these sizes sharing at most o symbols (see top_k)
+        """
+        return self.sim(o, len_x, len_y)
+
+    def prefix_length(self, t, size):
+        return min(size, max(0, math.floor(size - self.min_overlap(t, size) + self.EPS) + 1))
+
+    def prefix_length_of(self, t, s_symbols):
+        """
+        prefix length of an ordered tuple of symbols (see WeightedJaccard)
+        """
+        return self.prefix_length(t, len(s_symbols))
+
+    def verified_sim(self, t, x, y):
+        """
+        similarity of x and y (tuples of ordering keys sorted in increasing order) if it is >= t, None otherwise
+        """
+        o = overlap(x, y, self.required_overlap(t, len(x), len(y)))
+        sim = self.sim(o, len(x), len(y))
+        return sim if sim >= t else None
+
+    def bind(self, order):
+        """
+        the measure for the ordering keys of 'order' (see WeightedJaccard)
+        """
+        return self
+
+    def for_ranks(self, ranked_symbols):
+        """
+        the measure for symbols replaced by their rank in ranked_symbols (see ExternalJoin)
+        """
+        return self
+
+    def position_ok(self, t, i, j, size):
+        """
+        whether a set of any size len_y within size_bounds whose symbol at position j is the first one shared
+        with the symbol at position i of a set of this size may reach the overlap required for t
+        """
+        lo, hi = self.size_bounds(t, size)
+        rest = size - i
+        for len_y in range(max(j, math.ceil(lo)), min(math.floor(hi), j + rest) + 1):
+            if 1 + min(rest, len_y - j) >= self.required_overlap(t, size, len_y):
+                return True
+        return False
+
+    @cached_method(maxsize=1 << 16)
+    def max_j(self, t, i, size):
+        """
+        largest position j of the keys (symbol, j) that may match the symbol at position i of a set of this size
+        (position_ok is decreasing in j)
+        """
+        j = 0
+        while self.position_ok(t, i, j + 1, size):
+            j += 1
+        return j
+
+    @cached_method(maxsize=1 << 16)
+    def q_range(self, t, i, j, size):
+        """
+        range [q_min, q_max] of the suffix lengths q such that the key (symbol, j, q) may match the symbol
+        at position i of a set of this size (empty if q_min > q_max): the set size of the key is j + q,
+        and its overlap is at most 1 + min(size - i, q). Within size_bounds, the test grows with q up to size - i
+        (required_overlap grows by at most 1), then decreases: the bounds are found by bisection around size - i
+        """
+        p = size - i
+        lo, hi = self.size_bounds(t, size)
+        q_lo, q_hi = max(0, math.ceil(lo) - j), math.floor(hi) - j
+        ok = lambda q: 1 + min(p, q) >= self.required_overlap(t, size, j + q)
+        peak = min(max(p, q_lo), q_hi)
+        if q_lo > q_hi or not ok(peak):
+            return 1, 0
+        a, b = q_lo, peak
+        while a < b:
+            m = (a + b) // 2
+            if ok(m):
+                b = m
+            else:
+                a = m + 1
+        q_min = a
+        a, b = peak, q_hi
+        while a < b:
+            m = (a + b + 1) // 2
+            if ok(m):
+                a = m
+            else:
+                b = m - 1
+        return q_min, a
+
+    @cached_method(maxsize=1 << 16)
+    def min_suffix(self, t, j):
+        """
+        smallest suffix length q such that position j is in the prefix, for t, of a set of size j + q
+        (prefix_length grows with the size)
+        """
+        if self.prefix_length(t, j) >= j:
+            return 0
+        hi = 1
+        while self.prefix_length(t, j + hi) < j:
+            hi *= 2
+            if hi > 1 << 32:
+                return math.inf
+        lo = hi // 2
+        while hi - lo > 1:
+            m = (lo + hi) // 2
+            if self.prefix_length(t, j + m) >= j:
+                hi = m
+            else:
+                lo = m
+        return hi
+
+    def __repr__(self):
+        return "{}()".format(type(self).__name__)
+
+
+class Jaccard(Similarity):
+    """
+    |x & y| / |x | y|, with the closed-form bounds of MMDS 3.9
+    """
+    name = "jaccard"
+
+    def sim(self, o, len_x, len_y):
+        return float(o) / (len_x + len_y - o)
+
+    def required_overlap(self, t, len_x, len_y):
+        return required_overlap(t, len_x, len_y)
+
+    def size_bounds(self, t, size):
+        return t * size - self.EPS, size / t + self.EPS
+
+    def min_overlap(self, t, size):
+        return t * size
+
+    def prefix_length(self, t, size):
+        return math.floor((1-t) * size + self.EPS) + 1
+
+    def verified_sim(self, t, x, y):
+        return verified_sim(t, x, y)
+
+    def max_j(self, t, i, size):
+        return math.floor((size * (1-t) - i + 1 + t)/t + self.EPS)
+
+    def q_range(self, t, i, j, size):
+        """
+        case p >= q: q + 1 >= t * (size + j - 1)
+        case p < q:  p + 1 >= t * (i + j - 1 + q)
+        with p = size - i. The closed-form bounds are checked against these inequalities
+        so that floating point rounding gives the same keys as an exhaustive enumeration.
+        """
+        EPS, p = self.EPS, size - i
+        inf_ok = lambda q: (q + 1 + EPS) >= t * (size + j - 1)
+        sup_ok = lambda q: (p + 1 + EPS) >= t * (i + j - 1 + q)
+
+        q_min = max(0, math.ceil(t * (size + j - 1) - 1 - EPS))
+        while q_min > 0 and inf_ok(q_min - 1):
+            q_min -= 1
+        while q_min <= p and not inf_ok(q_min):
+            q_min += 1
+
+        q_max = math.floor((p + 1 + EPS) / t - i - j + 1)
+        while sup_ok(q_max + 1):
+            q_max += 1
+        while q_max > p and not sup_ok(q_max):
+            q_max -= 1
+
+        if q_min <= p:
+            return q_min, max(p, q_max)
+        return p + 1, q_max
+
+    def min_suffix(self, t, j):
+        if j == 1:
+            return 0
+        if t >= 1:
+            return math.inf
+        q = max(0, math.ceil((j - 1 - self.EPS) / (1 - t)) - j)
+        while q > 0 and self.prefix_length(t, j + q - 1) >= j:
+            q -= 1
+        while self.prefix_length(t, j + q) < j:
+            q += 1
+        return q
+
+
+class Cosine(Similarity):
+    """
+    |x & y| / sqrt(|x| * |y|)
+    """
+    name = "cosine"
+
+    def sim(self, o, len_x, len_y):
+        return o / math.sqrt(len_x * len_y)
+
+    def required_overlap(self, t, len_x, len_y):
+        return math.ceil(t * math.sqrt(len_x * len_y) - self.EPS)
+
+    def size_bounds(self, t, size):
+        return t * t * size - self.EPS, size / (t * t) + self.EPS
+
+    def min_overlap(self, t, size):
+        return t * t * size
+
+
+class Dice(Similarity):
+    """
+    2 |x & y| / (|x| + |y|)
+    """
+    name = "dice"
+
+    def sim(self, o, len_x, len_y):
+        return 2.0 * o / (len_x + len_y)
+
+    def required_overlap(self, t, len_x, len_y):
+        return math.ceil(t * (len_x + len_y) / 2 - self.EPS)
+
+    def size_bounds(self, t, size):
+        return t / (2 - t) * size - self.EPS, (2 - t) / t * size + self.EPS
+
+    def min_overlap(self, t, size):
+        return t / (2 - t) * size
+
+
+class Overlap(Similarity):
+    """
+    |x & y|: the threshold is a number of shared symbols. No set is too large for a match,
+    so that positions and suffix lengths are only bounded from below (max_j and q_max are infinite)
+    """
+    name = "overlap"
+    MAX_THRESHOLD = math.inf
+
+    def sim(self, o, len_x, len_y):
+        return o
+
+    def required_overlap(self, t, len_x, len_y):
+        return math.ceil(t - self.EPS)
+
+    def size_bounds(self, t, size):
+        return t - self.EPS, math.inf
+
+    def min_overlap(self, t, size):
+        return t
+
+    def prefix_length(self, t, size):
+        return max(0, size - math.ceil(t - self.EPS) + 1)
+
+    def max_j(self, t, i, size):
+        return math.inf if size - i + 1 >= math.ceil(t - self.EPS) else 0
+
+    def q_range(self, t, i, j, size):
+        o = math.ceil(t - self.EPS)
+        if size - i + 1 < o:
+            return 1, 0
+        return max(0, o - 1), math.inf
+
+    def min_suffix(self, t, j):
+        return max(0, math.ceil(t - self.EPS) - 1)
+
+
+class WeightedJaccard(Similarity):
+    """
+    weighted Jaccard similarity: w(x & y) / w(x | y), w being the sum of the weights of the symbols
+    (e.g. IDF weights; weights[symbol], 'default' for the symbols without weight, all > 0)
+
+    the prefix of a set is its shortest prefix whose suffix weighs less than t * w(set): two sets reaching t
+    share a symbol of their prefixes. Sizes say little about weights: with r = min weight / max weight,
+    the (unweighted) Jaccard similarity of a pair is at least r times its weighted one, so that the length,
+    position, suffix and overlap bounds of Jaccard for r * t hold, with less pruning as r gets smaller.
+    Candidates are verified with the weights.
+    """
+    name = "weighted_jaccard"
+
+    def __init__(self, weights, default=1.0):
+        self.weights = dict(weights)
+        self.default = default
+        values = list(self.weights.values()) + [default]
+        assert min(values) > 0, "weights must be positive"
+        self.ratio = min(values) / max(values)
+        self.jaccard = Jaccard()
+        #weights of the ordering keys of the symbols (see bind)
+        self.key_weights = self.weights
+        self.order = identity
+
+    def weight(self, symbol):
+        return self.weights.get(symbol, self.default)
+
+    def bind(self, order):
+        if order is self.order:
+            return self
+        bound = WeightedJaccard(self.weights, self.default)
+        bound.key_weights = {order(symbol): w for symbol, w in self.weights.items()}
+        bound.order = order
+        return bound
+
+    def for_ranks(self, ranked_symbols):
+        return WeightedJaccard({rank: self.weight(symbol) for rank, symbol in enumerate(ranked_symbols)}, self.default)
+
+    def bound(self, o, len_x, len_y):
+        return min(1.0, self.jaccard.sim(o, len_x, len_y) / self.ratio)
+
+    def required_overlap(self, t, len_x, len_y):
+        return self.jaccard.required_overlap(self.ratio * t, len_x, len_y)
+
+    def size_bounds(self, t, size):
+        return self.jaccard.size_bounds(self.ratio * t, size)
+
+    def min_overlap(self, t, size):
+        return self.jaccard.min_overlap(self.ratio * t, size)
+
+    def prefix_length(self, t, size):
+        return self.jaccard.prefix_length(self.ratio * t, size)
+
+    def prefix_length_of(self, t, s_symbols):
+        weights = [self.weights.get(symbol, self.default) for symbol in s_symbols]
+        total = sum(weights)
+        #the suffix must weigh less than t * total (by a margin of EPS)
+        limit, suffix, p = (t - self.EPS) * total, 0.0, len(weights)
+        while p > 0 and suffix + weights[p - 1] < limit:
+            p -= 1
+            suffix += weights[p]
+        return p
+
+    def max_j(self, t, i, size):
+        return self.jaccard.max_j(self.ratio * t, i, size)
+
+    def q_range(self, t, i, j, size):
+        return self.jaccard.q_range(self.ratio * t, i, j, size)
+
+    def min_suffix(self, t, j):
+        #positions in the weighted prefix of a set can not be told from its size
+        return 0
+
+    def verified_sim(self, t, x, y):
+        key_weights, default = self.key_weights, self.default
+        wx = [key_weights.get(key, default) for key in x]
+        wy = [key_weights.get(key, default) for key in y]
+        total = sum(wx) + sum(wy)
+        #w(x & y) >= t / (1 + t) * (w(x) + w(y)): stop when the rest of x (or y) can no longer reach it
+        required = t / (1 + t) * total - self.EPS
+        rest_x, rest_y = sum(wx), sum(wy)
+        i, j, o = 0, 0, 0.0
+        while i < len(x) and j < len(y):
+            if o + min(rest_x, rest_y) < required:
+                break
+            if x[i] == y[j]:
+                o += wx[i]
+                rest_x -= wx[i]
+                rest_y -= wy[j]
+                i += 1
+                j += 1
+            elif x[i] < y[j]:
+                rest_x -= wx[i]
+                i += 1
+            else:
+                rest_y -= wy[j]
+                j += 1
+        sim = o / (total - o)
+        return sim if sim >= t else None
+
+    def __repr__(self):
+        return "WeightedJaccard({} weights, default={})".format(len(self.weights), self.default)
+
+
+JACCARD, COSINE, DICE, OVERLAP = Jaccard(), Cosine(), Dice(), Overlap()
+SIMILARITIES = {similarity.name: similarity for similarity in (JACCARD, COSINE, DICE, OVERLAP)}
+
+def similarity_of(similarity):
+    """
+    a Similarity, from None (Jaccard), a name of SIMILARITIES or a Similarity
+    """
+    if similarity is None:
+        return JACCARD
+    if isinstance(similarity, str):
+        return SIMILARITIES[similarity]
+    return similarity
+
+def similarity_to_json(similarity):
+    if isinstance(similarity, WeightedJaccard):
+        return {"name": similarity.name, "weights": list(similarity.weights.items()), "default": similarity.default}
+    return {"name": similarity.name}
+
+def similarity_from_json(spec):
+    if spec["name"] == WeightedJaccard.name:
+        return WeightedJaccard(map(tuple, spec["weights"]), spec["default"])
+    return SIMILARITIES[spec["name"]]
@@ -0,0 +1,108 @@
+"""
+counters and timers of an index (IndexStats), probe cache (ProbeCache), index histogram, latency percentiles
+"""
+import collections
+import json
+import math
+
+
+class IndexStats(object):
+    """
+    opt-in counters and timers of an indexing object (see PrefixIndexing.enable_stats)
+    counters: numbers of probes, keys, postings...; timers: wall time in seconds of every phase;
+    posting_lengths: histogram (by powers of 2) of the lengths of the posting lists read
+    """
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = collections.Counter()
+        self.posting_lengths = collections.Counter()
+
+    def add_postings(self, lists):
+        """
+        counts the posting lists read (and their total length)
+        """
+        for postings in lists:
+            n = len(postings)
+            self.posting_lengths[1 << n.bit_length() >> 1] += 1
+            self.counters["postings_read"] += n
+
+    def as_dict(self):
+        return {"counters": dict(self.counters), "timers": dict(self.timers),
+                "posting_lengths": dict(sorted(self.posting_lengths.items()))}
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+
+class ProbeCache(object):
+    """
+    LRU cache of the candidates of many-one probes (see PrefixIndexing.enable_cache), keyed by
+    (ordered symbols of the probe, J); bounded by a number of entries and/or a total number of cached candidates
+    counters: hits, misses, evictions (entries dropped to fit the bounds), invalidations (clears on index changes)
+    """
+    def __init__(self, max_entries=1024, max_candidates=None):
+        assert max_entries or max_candidates, "the cache must be bounded"
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self.entries = collections.OrderedDict()
+        self.n_candidates = 0
+        self.counters = collections.Counter()
+
+    def get(self, key):
+        candidates = self.entries.get(key)
+        if candidates is None:
+            self.counters["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return candidates
+
+    def put(self, key, candidates):
+        """
+        caches the candidates (a frozenset) of key, evicting the least recently used entries if needed;
+        a set of candidates larger than max_candidates is not cached
+        """
+        if self.max_candidates is not None and len(candidates) > self.max_candidates:
+            return
+        self.entries[key] = candidates
+        self.n_candidates += len(candidates)
+        while (self.max_entries and len(self.entries) > self.max_entries
+               or self.max_candidates is not None and self.n_candidates > self.max_candidates):
+            _, evicted = self.entries.popitem(last=False)
+            self.n_candidates -= len(evicted)
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        if self.entries:
+            self.counters["invalidations"] += 1
+        self.entries.clear()
+        self.n_candidates = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def as_dict(self):
+        return dict(self.counters, entries=len(self.entries), candidates=self.n_candidates)
+
+
+def index_histogram(ii):
+    """
+    size and skew of an inverted index: numbers of keys and postings, longest posting list, share of the postings
+    in the longest 1% of the posting lists, and histogram (by powers of 2) of the posting list lengths
+    """
+    lengths = sorted(map(len, ii.values()), reverse=True)
+    n_postings = sum(lengths)
+    histogram = collections.Counter(1 << n.bit_length() >> 1 for n in lengths)
+    return {"keys": len(lengths), "postings": n_postings, "max_length": lengths[0] if lengths else 0,
+            "top_1pct_share": sum(lengths[:-(-len(lengths) // 100)]) / n_postings if n_postings else 0.0,
+            "lengths": dict(sorted(histogram.items()))}
+
+
+def percentiles(values, ps=(50, 90, 99)):
+    """
+    nearest-rank percentiles of a list of values (None if it is empty)
+    """
+    values = sorted(values)
+    if not values:
+        return {"p{}".format(p): None for p in ps}
+    return {"p{}".format(p): values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))] for p in ps}
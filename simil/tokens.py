@@ -0,0 +1,204 @@
+"""
+sets as strings (MMDS 3.9.2): ordering keys of the symbols, shingles, hashed shingles, packed pairs
+"""
+import collections
+import functools
+
+
+def pair(a, b):
+    assert a != b
+    return tuple(sorted((a, b)))
+
+def encode_pair(a, b):
+    """
+    pair (a, b) packed in a 64-bit integer
+    """
+    a, b = pair(a, b)
+    return (a << 32) | b
+
+def decode_pair(code):
+    return code >> 32, code & 0xFFFFFFFF
+
+def order_symbol_1(symbol):
+    """
+    ordering key : corresponds ~to the ASCII value
+    """
+    assert isinstance(symbol, str) #Python has no 'char' type...
+    return ord(symbol) - 96
+
+def symbols(s, order=order_symbol_1):
+    """
+    see MMDS 3.9.2 "Representing Sets as Strings"
+    removes duplicates in string s and orders the symbols according to order 'orde'
+    """
+    return tuple(sorted(set(s), key=order))
+
+def id_and_symbols(s, order_symbol=order_symbol_1):
+    return s, symbols(s, order=order_symbol)
+
+
+identity = lambda x: x
+
+def shingles_n(s, n, hashfun=identity):
+    """Compute set of possible hashed n-shingles. """
+    return {hashfun(s[i:i+n]) for i in range(len(s) - n + 1)}
+
+def order_symbol_lex(shingle):
+    """
+    lexicographical order
+    """
+    #TEST
+    assert isinstance(shingle, str)
+    return shingle
+
+def order_symbol_hash(shingle):
+    """
+    order based on the value of the hash of a shingle
+    """
+    return hash(shingle)
+
+class FrequencyOrder(object):
+    """
+    data-dependent ordering key: rarest symbols first
+    document frequencies are counted in one pass over the corpus, ties are broken by the symbols themselves.
+    With shingle_size (and shingle_hash), the symbols counted are those of an index with the same options.
+    Symbols that do not appear in the corpus (e.g. with an order built from a sample) come after the others,
+    with distinct keys: the merge-based verification needs a total order.
+
+    usage: order = FrequencyOrder(list_of_strings); PrefixIndexing(list_of_strings, J, order=order)
+    """
+    def __init__(self, list_of_strings, shingle_size=None, shingle_hash=False):
+        if shingle_hash:
+            list_of_strings = shingle_hashes(list_of_strings, shingle_size)
+        elif shingle_size:
+            list_of_strings = (shingles_n(s, shingle_size) for s in list_of_strings)
+        df = collections.Counter()
+        for s in list_of_strings:
+            df.update(set(s))
+        self.rank = {symbol: r for r, symbol in enumerate(sorted(df, key=lambda symbol: (df[symbol], symbol)))}
+
+    @classmethod
+    def from_ranking(cls, ranked_symbols):
+        order = cls(())
+        order.rank = {symbol: r for r, symbol in enumerate(ranked_symbols)}
+        return order
+
+    def __call__(self, symbol):
+        rank = self.rank.get(symbol)
+        if rank is not None:
+            return rank
+        #unseen symbol, after the ranks: an integer symbol itself, or the bytes of a string
+        if isinstance(symbol, int):
+            return len(self.rank) + symbol
+        return len(self.rank) + int.from_bytes(b"\x01" + symbol.encode("utf-8", "surrogatepass"), "big")
+
+#Utility
+def jaccard_sim(a, b):
+    set_a, set_b = set(a), set(b)
+    return float(len(set_a & set_b)) / len(set_a | set_b)
+
+def order_to_json(order):
+    """
+    JSON description of an ordering key: the name of a module-level function, or the ranking of a FrequencyOrder
+    (not order_symbol_hash: hash() of a string is salted per process)
+    """
+    if isinstance(order, FrequencyOrder):
+        return {"frequency": sorted(order.rank, key=order.rank.get)}
+    if order is order_symbol_hash:
+        raise ValueError("ordering {!r} depends on the hash() of the process and can not be saved".format(order))
+    for name, value in globals().items():
+        if value is order and callable(value):
+            return {"function": name}
+    raise ValueError("ordering {!r} can not be saved".format(order))
+
+def order_from_json(spec):
+    if "frequency" in spec:
+        return FrequencyOrder.from_ranking(spec["frequency"])
+    return globals()[spec["function"]]
+
+#shingle size is hardcoded
+SHINGLE_SIZE = 3
+shingles = functools.partial(shingles_n, n=SHINGLE_SIZE)
+symbols_shingles = functools.partial(symbols, order=order_symbol_lex)
+
+#function that takes a string, computes its shingles and returns the ordered set of symbols corresponding to these shingles (see MMDS p119, §2)
+string_to_symbols = lambda s: symbols_shingles(shingles(s))
+
+#hashing of shingles into 64-bit integer symbols: polynomial hash of the code points, then the splitmix64 finalizer
+#so that the order of the hash values is random (see order_symbol_hash)
+HASH_MASK = (1 << 64) - 1
+HASH_BASE = 0x100000001B3
+HASH_MIX = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+
+def shingle_hash(shingle):
+    """
+    64-bit hash of a shingle, stable across runs (unlike hash()), same as shingle_hashes
+    """
+    h = 0
+    for c in shingle:
+        h = (h * HASH_BASE + ord(c)) & HASH_MASK
+    h = ((h ^ (h >> 30)) * HASH_MIX[0]) & HASH_MASK
+    h = ((h ^ (h >> 27)) * HASH_MIX[1]) & HASH_MASK
+    return h ^ (h >> 31)
+
+def shingle_hashes(list_of_strings, n=None, use_numpy=None):
+    """
+    for every string, the sorted tuple of the distinct shingle_hash of its n-shingles (n=SHINGLE_SIZE by default),
+    i.e. sorted(shingles_n(s, n, hashfun=shingle_hash))
+
+    with NumPy (if installed, or if use_numpy=True) the hashes of all strings are computed at once, rolling over
+    the code points of the concatenated strings, then sorted and deduplicated per string in 2D arrays
+    """
+    n = n or SHINGLE_SIZE
+    if use_numpy is None or use_numpy:
+        try:
+            import numpy
+        except ImportError:
+            if use_numpy:
+                raise
+        else:
+            return _shingle_hashes_numpy(numpy, list_of_strings, n)
+    #without NumPy, each distinct shingle is hashed once
+    hashes = {}
+    list_of_hashes = []
+    for s in list_of_strings:
+        s_shingles = shingles_n(s, n)
+        for shingle in s_shingles.difference(hashes):
+            hashes[shingle] = shingle_hash(shingle)
+        list_of_hashes.append(tuple(sorted(map(hashes.__getitem__, s_shingles))))
+    return list_of_hashes
+
+def _shingle_hashes_numpy(np, list_of_strings, n):
+    lengths = np.fromiter(map(len, list_of_strings), dtype=np.int64, count=len(list_of_strings))
+    codes = np.frombuffer("".join(list_of_strings).encode("utf-32-le", "surrogatepass"), dtype="<u4").astype(np.uint64)
+
+    #hash of the n-shingle starting at every position of the concatenation
+    n_windows = max(len(codes) - n + 1, 0)
+    h = np.zeros(n_windows, dtype=np.uint64)
+    for k in range(n):
+        h = h * np.uint64(HASH_BASE) + codes[k:k + n_windows]
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(HASH_MIX[0])
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(HASH_MIX[1])
+    h ^= h >> np.uint64(31)
+
+    #windows of string d: h[starts[d]:starts[d] + counts[d]] (the others cross the end of a string)
+    counts = np.maximum(lengths - n + 1, 0)
+    starts = np.cumsum(lengths) - lengths
+
+    #strings are sorted and deduplicated as rows of 2D arrays, one per class of counts (powers of 2)
+    #rows are padded by repeating their last window, which deduplication removes
+    list_of_hashes = [()] * len(list_of_strings)
+    (docs,) = np.nonzero(counts)
+    classes = np.ceil(np.log2(counts[docs])).astype(np.int64)
+    for c in np.unique(classes).tolist():
+        docs_c = docs[classes == c]
+        counts_c = counts[docs_c][:, None]
+        windows = starts[docs_c][:, None] + np.minimum(np.arange(counts_c.max()), counts_c - 1)
+        rows = np.sort(h[windows], axis=1)
+        keep = np.ones(rows.shape, dtype=bool)
+        keep[:, 1:] = rows[:, 1:] != rows[:, :-1]
+        hashes = rows[keep].tolist()
+        bounds = [0] + np.cumsum(keep.sum(axis=1)).tolist()
+        for k, d in enumerate(docs_c.tolist()):
+            list_of_hashes[d] = tuple(hashes[bounds[k]:bounds[k + 1]])
+    return list_of_hashes